@@ -1,45 +1,102 @@
+import os
+
 from flask import Flask
 from flask_admin import Admin
 from flask_login import LoginManager
+from sqlalchemy.orm import make_transient_to_detached
 from app.services.udb_service import create_udb_service
 from app.services.ldap_service import create_ldap_service
+from app.services.handbook_service import create_handbook_resolver
+from app.check_in_queue import create_check_in_queue
+from app.live_feed import create_live_feed
+from app.event_index import EventIndex
+from app.thread_pool import LazyThreadPool
+from app.cache import LRUCache
+from app.metrics import Metrics
 from app.views import (
     ReportsView, EventsView, StudentsView, CoursesView, EnrolmentsView, CheckInsView, UsersView,
-    CategoriesView, DegreesView, AdminIndexView, AdminRedirectView, ApiView, AppDownloadView
+    CategoriesView, DegreesView, AdminIndexView, AdminRedirectView, ApiView, AppDownloadView, QRCodeView,
+    MetricsView, LiveView
 )
-from db import db, User
+from db import db, init_db, User
 
 
-def init_login(app):
+def init_login(app, user_cache):
     login_manager = LoginManager(app)
 
     @login_manager.user_loader
-    def load_user(zid):
-        return db.session.query(User).get(zid)
+    def load_user(user_id):
+        # every admin page loads the user; keep a detached copy for a while and
+        # attach it to this request's session without asking the database
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return None
+        user = user_cache.get(user_id)
+        if user is not None:
+            return db.session.merge(user, load=False)
+
+        user = db.session.query(User).get(user_id)
+        if user is not None:
+            user_cache.set(user_id, detached_copy(user))
+        return user
+
+
+def detached_copy(user):
+    copy = User(id=user.id, zid=user.zid, first_name=user.first_name, last_name=user.last_name)
+    make_transient_to_detached(copy)
+    return copy
 
 
 def create_app(config):
     app = Flask(__name__)
     app.config.from_object(config)
-    db.init_app(app)
-    init_login(app)
+    init_db(app)
+    user_cache = LRUCache(config.USER_CACHE_SIZE, config.USER_CACHE_TTL)
+    init_login(app, user_cache)
+
+    metrics = Metrics(
+        config.METRICS_ENABLED,
+        config.SLOW_REQUEST_THRESHOLD,
+        app.logger,
+        os.path.join(app.root_path, config.METRICS_DIR) if config.METRICS_DIR else None
+    )
+    metrics.instrument(db.get_engine(app))
 
-    udb_service = create_udb_service(config)
+    udb_service = create_udb_service(app, config)
     ldap_service = create_ldap_service(config)
+    handbook_resolver = create_handbook_resolver(app, config, metrics)
+    event_index = EventIndex(config.EVENT_LEEWAY, config.EVENT_INDEX_REFRESH, config.EVENT_INDEX_VERSION_CHECK)
+    udb_pool = LazyThreadPool(config.UDB_BATCH_WORKERS)
+    live_feed = create_live_feed(app, config)
+    check_in_queue = create_check_in_queue(app, config, handbook_resolver, live_feed)
+    if check_in_queue is not None:
+        # so scripts and the gunicorn exit hook can flush it
+        app.extensions['check_in_queue'] = check_in_queue
 
-    admin = Admin(app, name='Bark', index_view=AdminIndexView(ldap_service), base_template='master.html')
-    admin.add_view(ReportsView(name='Reports'))
+    admin = Admin(app, name='Bark', index_view=AdminIndexView(ldap_service, user_cache), base_template='master.html')
+    admin.add_view(ReportsView(config.REPORT_CACHE_TTL, name='Reports'))
     admin.add_view(EventsView(db.session, name='Events'))
     admin.add_view(StudentsView(db.session, name='Students'))
     admin.add_view(DegreesView(db.session, name='Degrees'))
     admin.add_view(CoursesView(db.session, name='Courses'))
     admin.add_view(EnrolmentsView(db.session, name='Enrolments'))
-    admin.add_view(CheckInsView(db.session, name='Check-ins'))
-    admin.add_view(UsersView(db.session, name='Users'))
+    admin.add_view(CheckInsView(db.session, config.ADMIN_LIST_CACHE_TTL, name='Check-ins'))
+    admin.add_view(UsersView(db.session, user_cache, name='Users'))
     admin.add_view(CategoriesView(db.session, name='Categories'))
 
-    app.add_url_rule('/api', view_func=ApiView.as_view('api', udb_service, config.EVENT_LEEWAY))
+    app.add_url_rule('/api', view_func=ApiView.as_view(
+        'api', udb_service, handbook_resolver, event_index, udb_pool, config.MAX_BATCH_SIZE, config.MAX_SCAN_AGE,
+        config.MAX_SCAN_CLOCK_SKEW, metrics, check_in_queue, live_feed
+    ))
     app.add_url_rule('/', view_func=AdminRedirectView.as_view('admin-redirect'))
+    app.add_url_rule('/qr/<token>.<fmt>', view_func=QRCodeView.as_view(
+        'qr-code', event_index, LRUCache(config.QR_CACHE_SIZE, config.QR_CACHE_TTL), config.QR_MAX_AGE
+    ))
+    app.add_url_rule('/metrics', view_func=MetricsView.as_view('metrics', metrics, config.METRICS_TOKEN))
+    app.add_url_rule('/events/<int:event_id>/live', view_func=LiveView.as_view(
+        'live', live_feed, config.LIVE_STREAM_DURATION, config.LIVE_STREAM_HEARTBEAT
+    ))
     app.add_url_rule('/download', view_func=AppDownloadView.as_view('app-download', config.ANDROID_URL))
 
     return app
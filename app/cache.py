@@ -0,0 +1,65 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache(object):
+    """
+    A bounded, thread-safe least-recently-used cache whose entries expire
+    after a time-to-live.
+
+    The cache lives in process memory, so each gunicorn worker has its own.
+    """
+    def __init__(self, max_size, ttl):
+        self._max_size = max_size
+        self._ttl = ttl.total_seconds()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, _MISSING)
+            if entry is not _MISSING:
+                expires, value = entry
+                if expires > time.time():
+                    # re-insert to mark the entry as most recently used
+                    self._entries[key] = entry
+                    self.hits += 1
+                    return value
+
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        ttl = self._ttl if ttl is None else ttl.total_seconds()
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + ttl, value)
+
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'max_size': self._max_size
+            }
+
+    def __len__(self):
+        return len(self._entries)
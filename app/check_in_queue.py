@@ -0,0 +1,438 @@
+import atexit
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy.exc import OperationalError
+
+from app.check_ins import (
+    already_checked_in, check_in_response, find_check_in, find_student, preview_details, record_check_in,
+    stored_details
+)
+from app.db import CheckIn, CheckInQueueMark, Student, db
+from app.live_feed import check_in_message
+from app.services.udb_parser import dump_user, load_user
+
+_SCHEMA = [
+    # identifies the queue in the database's CheckInQueueMark
+    '''CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )''',
+    "INSERT OR IGNORE INTO meta VALUES ('queue_id', lower(hex(randomblob(16))))",
+    # how many times each student has scanned in at each event, including the
+    # scans that are still queued. this is what max_scans is checked against.
+    # details is what repeat scans are answered with (see put_many)
+    '''CREATE TABLE IF NOT EXISTS scan_count (
+        event_id INTEGER NOT NULL,
+        zid TEXT NOT NULL,
+        number_of_scans INTEGER NOT NULL,
+        expires REAL NOT NULL,
+        details TEXT NOT NULL,
+        PRIMARY KEY (event_id, zid)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS pending (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id INTEGER NOT NULL,
+        zid TEXT NOT NULL,
+        scanned_at REAL NOT NULL,
+        user_info TEXT
+    )''',
+    'CREATE INDEX IF NOT EXISTS ix_pending_event_zid ON pending (event_id, zid)',
+    # check-ins the database refused, kept so they can be looked at by hand
+    '''CREATE TABLE IF NOT EXISTS failed (
+        id INTEGER PRIMARY KEY,
+        event_id INTEGER NOT NULL,
+        zid TEXT NOT NULL,
+        scanned_at REAL NOT NULL,
+        user_info TEXT,
+        error TEXT
+    )'''
+]
+
+
+class CheckInQueue(object):
+    """
+    Lets the API answer a check-in without waiting to write it to the
+    database.
+
+    Scans are put in a queue kept in a local SQLite file, which survives
+    restarts, and written to the database in batches by a single writer at a
+    time. Each worker runs a thread that drains the queue every `interval`;
+    a lock on `<path>.lock` makes sure only one of them writes at once.
+
+    max_scans is checked against a count of each student's scans per event
+    that is kept in the same file and updated in the same transaction as the
+    queue, so it holds across workers even before the scans are written. The
+    count is seeded from the database the first time a student scans in at
+    an event, and forgotten `retention` after the event ends once nothing is
+    queued for it.
+
+    The database records how far the queue has been written (CheckInQueueMark)
+    in the same transaction as each batch, so a batch that was written but
+    not yet taken out of the queue isn't written again.
+
+    Check-ins are passed on to `live_feed`, if given, once they are written.
+    """
+    def __init__(self, app, path, handbook_resolver, batch_size, interval, flush_timeout, retention,
+                 live_feed=None):
+        self._app = app
+        self._path = path
+        self._handbook_resolver = handbook_resolver
+        self._live_feed = live_feed
+        self._batch_size = batch_size
+        self._interval = interval.total_seconds()
+        self._flush_timeout = flush_timeout.total_seconds()
+        self._retention = retention
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._schema_pid = None
+        self._stopped = threading.Event()
+
+    def _connect(self):
+        # sqlite connections can't be shared between threads (or greenlets,
+        # in a gevent worker) or processes
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            conn = sqlite3.connect(self._path, timeout=self._flush_timeout, isolation_level=None)
+            with self._lock:
+                if self._schema_pid != pid:
+                    conn.execute('PRAGMA journal_mode=WAL')
+                    for statement in _SCHEMA:
+                        conn.execute(statement)
+                    self._schema_pid = pid
+            self._local.conn = conn
+            self._local.pid = pid
+        return self._local.conn
+
+    def _start(self):
+        # threads don't survive a fork, so each worker starts its own writer
+        pid = os.getpid()
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            self._stopped = threading.Event()
+
+        atexit.register(self.stop)
+        thread = threading.Thread(target=self._run, name='check-in-writer')
+        thread.daemon = True
+        thread.start()
+
+    def put_many(self, event, scans):
+        """
+        Queues scans at `event`, given as (zid, max_scans, user_info,
+        scanned_at) tuples, in one transaction. Returns the response for each
+        scan, as record_check_in would give it, or the BarkError it was
+        refused with.
+
+        A student's first scan at an event is answered from UDB, and not
+        queued if they would be discarded (the event only keeps CSE students
+        and they aren't one). Later scans are answered with what the first one
+        stored. Everything is read from the database before the queue is
+        locked, so workers don't wait on each other's queries.
+        """
+        self._start()
+        conn = self._connect()
+
+        students = {}
+        stored = {}
+        for zid, _, user_info, _ in scans:
+            if zid in students:
+                continue
+            students[zid] = find_student(zid, user_info)
+
+            row = conn.execute(
+                'SELECT 1 FROM scan_count WHERE event_id = ? AND zid = ?', (event.id, zid)
+            ).fetchone()
+            if row is None:
+                stored[zid] = self._stored(event.id, students[zid], user_info)
+
+        results = []
+        expires = time.mktime((event.end + self._retention).timetuple())
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for zid, max_scans, user_info, scanned_at in scans:
+                student = students[zid]
+                row = conn.execute(
+                    'SELECT number_of_scans, details FROM scan_count WHERE event_id = ? AND zid = ?', (event.id, zid)
+                ).fetchone()
+
+                if row is None:
+                    if zid not in stored:
+                        # forgotten since we looked, so the event ended a while
+                        # ago. rare enough to read the database while locked
+                        stored[zid] = self._stored(event.id, student, user_info)
+
+                    # nothing is queued for this student, so the database is up to date
+                    number_of_scans, details = stored[zid]
+                    if number_of_scans == 0 and event.check_cse and not details[0]:
+                        # the check in is discarded
+                        results.append(check_in_response(student, 1, *details))
+                        continue
+
+                    conn.execute(
+                        'INSERT INTO scan_count VALUES (?, ?, ?, ?, ?)',
+                        (event.id, zid, number_of_scans, expires, json.dumps(details))
+                    )
+                else:
+                    number_of_scans, details = row
+                    details = json.loads(details)
+
+                if max_scans is not None and number_of_scans + 1 > max_scans:
+                    results.append(already_checked_in(number_of_scans))
+                    continue
+
+                conn.execute(
+                    'UPDATE scan_count SET number_of_scans = number_of_scans + 1 WHERE event_id = ? AND zid = ?',
+                    (event.id, zid)
+                )
+                conn.execute(
+                    'INSERT INTO pending (event_id, zid, scanned_at, user_info) VALUES (?, ?, ?, ?)',
+                    (event.id, zid, time.mktime(scanned_at.timetuple()) + scanned_at.microsecond / 1e6,
+                     dump_user(user_info) if user_info else None)
+                )
+                results.append(check_in_response(student, number_of_scans + 1, *details))
+            conn.execute('COMMIT')
+        except:
+            conn.execute('ROLLBACK')
+            raise
+
+        return results
+
+    def _stored(self, event_id, student, user_info):
+        # the student's number of scans in the database, and what their scans
+        # are answered with
+        check_in = find_check_in(student, event_id)
+        if check_in is None:
+            return 0, preview_details(student, user_info)
+        return check_in.number_of_scans, stored_details(check_in)
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            try:
+                self.flush(blocking=False)
+            except Exception:
+                self._app.logger.exception('Could not write queued check-ins')
+
+    def flush(self, blocking=True):
+        """
+        Writes out everything in the queue. If another process is already
+        writing, waits for it (up to the flush timeout) unless `blocking` is
+        False. Returns whether the queue was drained.
+        """
+        with open(self._path + '.lock', 'a') as lock_file:
+            deadline = time.time() + self._flush_timeout
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except IOError:
+                    if not blocking or time.time() > deadline:
+                        return False
+                    time.sleep(0.05)
+
+            try:
+                while self._write_batch():
+                    pass
+                self._forget_finished()
+                return True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def stop(self):
+        """
+        Stops this worker's writer and writes out whatever is left. Called
+        when the worker exits.
+        """
+        self._stopped.set()
+        if self._pid == os.getpid() and not self.flush():
+            self._app.logger.warning('Check-ins were left in the queue at %s', self._path)
+
+    def _write_batch(self):
+        conn = self._connect()
+        queue_id = conn.execute("SELECT value FROM meta WHERE key = 'queue_id'").fetchone()[0]
+        rows = conn.execute(
+            'SELECT id, event_id, zid, scanned_at, user_info FROM pending ORDER BY id LIMIT ?', (self._batch_size,)
+        ).fetchall()
+        if not rows:
+            return 0
+
+        new_degrees = []
+        new_courses = []
+        written = []
+        failed = 0
+        # event id -> check-ins to pass on to dashboards
+        messages = {}
+
+        with self._app.app_context():
+            try:
+                # scans up to the mark were written, but the writer stopped
+                # before taking them out of the queue
+                written_up_to = db.session.query(CheckInQueueMark.last_id) \
+                    .filter(CheckInQueueMark.queue_id == queue_id) \
+                    .scalar() or 0
+                written = [row for row in rows if row[0] <= written_up_to]
+                rows = [row for row in rows if row[0] > written_up_to]
+
+                try:
+                    # write the whole batch in one transaction
+                    batch_messages = [(row[1], self._write(row, new_degrees, new_courses)) for row in rows]
+                    if rows:
+                        self._mark(queue_id, rows[-1][0])
+                    db.session.commit()
+                    written += rows
+                    for event_id, message in batch_messages:
+                        messages.setdefault(event_id, []).append(message)
+                except OperationalError:
+                    # most likely the database is locked, try again next time
+                    db.session.rollback()
+                    raise
+                except Exception:
+                    db.session.rollback()
+                    self._app.logger.exception('Could not write a batch of check-ins, writing them one at a time')
+
+                    # one at a time, so a bad check-in doesn't hold up the rest
+                    del new_degrees[:]
+                    del new_courses[:]
+                    for row in rows:
+                        try:
+                            message = self._write(row, new_degrees, new_courses)
+                            self._mark(queue_id, row[0])
+                            db.session.commit()
+                            written.append(row)
+                            messages.setdefault(row[1], []).append(message)
+                        except OperationalError:
+                            db.session.rollback()
+                            break
+                        except Exception as e:
+                            db.session.rollback()
+                            self._app.logger.exception('Could not write check-in %d', row[0])
+                            # set aside now, since the next check-in written
+                            # moves the mark past this one
+                            self._fail(row, e)
+                            failed += 1
+            finally:
+                db.session.remove()
+
+        conn.execute('BEGIN IMMEDIATE')
+        conn.executemany('DELETE FROM pending WHERE id = ?', [(row[0],) for row in written])
+        conn.execute('COMMIT')
+
+        for code in set(new_degrees):
+            self._handbook_resolver.resolve_degree(code)
+        for code in set(new_courses):
+            self._handbook_resolver.resolve_course(code)
+
+        if self._live_feed is not None:
+            for event_id, event_messages in messages.items():
+                self._live_feed.publish(event_id, 'check_in', event_messages)
+
+        return len(written) + failed
+
+    def _mark(self, queue_id, last_id):
+        # in the same transaction as the check-ins written up to last_id.
+        # only one process writes a queue at a time, so this can't race
+        table = CheckInQueueMark.__table__
+        update = table.update().where(table.c.queue_id == queue_id).values(last_id=last_id)
+        if not db.session.execute(update).rowcount:
+            db.session.execute(table.insert().values(queue_id=queue_id, last_id=last_id))
+
+    def _fail(self, row, error):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM pending WHERE id = ?', (row[0],))
+            conn.execute('INSERT INTO failed VALUES (?, ?, ?, ?, ?, ?)', row + (repr(error),))
+            conn.execute('COMMIT')
+        except:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _write(self, row, new_degrees, new_courses):
+        # returns what dashboards are sent about the check-in
+        _, event_id, zid, scanned_at, user_info = row
+        scanned_at = datetime.fromtimestamp(scanned_at)
+
+        # scans were checked against max_scans when they were queued, and
+        # only ones that should be kept were queued
+        resp = record_check_in(
+            event_id, False, zid, None,
+            load_user(user_info) if user_info else None,
+            scanned_at,
+            new_degrees, new_courses
+        )
+
+        # the session doesn't autoflush, so flush for later scans of the same
+        # student to see this one
+        db.session.flush()
+        return check_in_message(zid, resp, scanned_at)
+
+    def _forget_finished(self):
+        conn = self._connect()
+        conn.execute(
+            'DELETE FROM scan_count WHERE expires < ? AND NOT EXISTS ('
+            'SELECT 1 FROM pending WHERE pending.event_id = scan_count.event_id AND pending.zid = scan_count.zid)',
+            (time.time(),)
+        )
+
+    def check(self):
+        """
+        Compares the scan counts the queue has checked max_scans against with
+        the ones in the database. Returns (event_id, zid, queued, stored) for
+        every student they disagree on, ignoring those with scans still in
+        the queue. Run it after a flush.
+        """
+        conn = self._connect()
+        counts = conn.execute(
+            'SELECT event_id, zid, number_of_scans FROM scan_count WHERE NOT EXISTS ('
+            'SELECT 1 FROM pending WHERE pending.event_id = scan_count.event_id AND pending.zid = scan_count.zid)'
+        ).fetchall()
+
+        mismatches = []
+        for event_id in set(event_id for event_id, _, _ in counts):
+            stored = dict(
+                db.session.query(Student.zid, CheckIn.number_of_scans)
+                .join(CheckIn, CheckIn.student_id == Student.id)
+                .filter(CheckIn.event_id == event_id)
+            )
+            for count_event_id, zid, queued in counts:
+                if count_event_id == event_id and stored.get(zid, 0) != queued:
+                    mismatches.append((event_id, zid, queued, stored.get(zid, 0)))
+
+        return sorted(mismatches)
+
+    def failed(self):
+        """
+        Returns the check-ins the database refused, as (id, event_id, zid,
+        scanned_at, error) tuples.
+        """
+        conn = self._connect()
+        return [
+            (id_, event_id, zid, datetime.fromtimestamp(scanned_at), error)
+            for id_, event_id, zid, scanned_at, _, error
+            in conn.execute('SELECT * FROM failed ORDER BY id')
+        ]
+
+
+def create_check_in_queue(app, config, handbook_resolver, live_feed=None):
+    if not config.CHECK_IN_WRITE_BEHIND:
+        return None
+
+    return CheckInQueue(
+        app,
+        os.path.join(app.root_path, config.CHECK_IN_QUEUE_PATH),
+        handbook_resolver,
+        batch_size=config.CHECK_IN_QUEUE_BATCH_SIZE,
+        interval=config.CHECK_IN_QUEUE_INTERVAL,
+        flush_timeout=config.CHECK_IN_QUEUE_FLUSH_TIMEOUT,
+        retention=config.EVENT_LEEWAY,
+        live_feed=live_feed
+    )
@@ -0,0 +1,255 @@
+from datetime import datetime
+
+from app.db import Student, CheckIn, Degree, Course, Enrolment, db, insert_ignore
+from app.event_stats import add_to_stats
+from app.services.udb_parser import UDBClass
+
+
+class BarkError(Exception):
+    pass
+
+
+def find_student(zid, user_info):
+    """
+    Returns the student with the given zID, or a new one (not yet added to the
+    session) filled in from UDB.
+    """
+    student = Student.query.filter(Student.zid == zid).order_by(Student.id).first()
+    if student:
+        # student exists in the system
+        return student
+
+    student = Student()
+    student.zid = zid
+    if user_info:
+        # student doesn't exist in the system
+        student.given_names = user_info.given_names
+        student.surname = user_info.surname
+    else:
+        # student doesn't exist in UDB
+        student.given_names = 'Unknown'
+        student.surname = 'Student'
+    return student
+
+
+def enrolment_details(user_info):
+    """
+    Returns the degree (a UDBClass) and course codes UDB has for a student, and
+    the latest date any of them expires.
+    """
+    if user_info and len(user_info.degrees):
+        degree_info = max(user_info.degrees, key=lambda deg: deg.expiry)
+    else:
+        # no degree. might be doing COMP as a gened or something
+        degree_info = UDBClass(code=0, expiry=datetime.fromtimestamp(0).date())
+
+    courses_info = user_info.courses if user_info else []
+    course_codes = unique([course_info.code for course_info in courses_info])
+
+    # max(expiry of all degrees & courses)
+    expiry = max([degree_info.expiry] + [course_info.expiry for course_info in courses_info])
+
+    return degree_info, course_codes, expiry
+
+
+def already_checked_in(number_of_scans):
+    if number_of_scans == 1:
+        s = 'once'
+    elif number_of_scans == 2:
+        s = 'twice'
+    else:
+        s = '%d times' % number_of_scans
+
+    return BarkError('Student has already checked in ' + s)
+
+
+def record_check_in(event_id, check_cse, zid, max_scans, user_info, scanned_at, new_degrees, new_courses):
+    """
+    Records a scan of `zid` at an event in the session, without committing.
+    Returns the response for the scanner, or raises a BarkError before
+    anything is written. A `max_scans` of None doesn't limit the scans.
+
+    The codes of degrees and courses that have no name yet are added to
+    `new_degrees` and `new_courses`.
+
+    A scan costs the same number of queries however many courses the
+    student is enrolled in. The event's counters are updated with it.
+    """
+    student = find_student(zid, user_info)
+
+    # look up check-in (a new student can't have one). on databases that
+    # support it, lock it so concurrent scans can't both add to the count
+    check_in = None
+    if student.id is not None:
+        check_in = CheckIn.query \
+            .filter(CheckIn.student_id == student.id) \
+            .filter(CheckIn.event_id == event_id) \
+            .with_for_update() \
+            .first()
+
+    if check_in:
+        # check-in already exists
+        if max_scans is not None and check_in.number_of_scans + 1 > max_scans:
+            raise already_checked_in(check_in.number_of_scans)
+
+        check_in.number_of_scans += 1
+        num_scans = check_in.number_of_scans
+        add_to_stats(event_id, scans=1)
+        is_cse, degree_name, course_codes = stored_details(check_in)
+    else:
+        # check-in doesn't exist
+        num_scans = 1
+
+        degree_info, course_codes, expiry = enrolment_details(user_info)
+        is_cse = expiry > datetime.now().date() or bool(student.override_cse)
+        keep = is_cse or not check_cse
+
+        # handle degree
+        if keep:
+            degree = get_or_create_degree(degree_info.code)
+        else:
+            degree = Degree.query.filter(Degree.code == degree_info.code).first()
+            if degree is None:
+                degree = Degree()
+                degree.code = degree_info.code
+
+        if degree.name is None:
+            if degree.code == 0:
+                degree.name = 'Non-CSE degree'
+            else:
+                new_degrees.append(degree.code)
+
+        degree_name = unicode(degree)
+
+        if keep:
+            if student.id is None:
+                student = get_or_create_student(student)
+
+            check_in = CheckIn()
+            check_in.timestamp = scanned_at
+            check_in.student = student
+            check_in.event_id = event_id
+            check_in.degree = degree
+            check_in.is_cse = is_cse
+            db.session.add(check_in)
+
+            # handle courses, then create all the enrolments at once
+            courses = get_or_create_courses(course_codes)
+            new_courses.extend(course.code for course in courses if course.name is None)
+
+            db.session.flush()
+            if courses:
+                db.session.execute(Enrolment.__table__.insert(), [
+                    {'check_in_id': check_in.id, 'course_id': course.id} for course in courses
+                ])
+
+            add_to_stats(event_id, check_ins=1, cse=int(is_cse), arc=int(bool(student.is_arc)), scans=1)
+        # otherwise the check in and student details are discarded
+
+    return check_in_response(student, num_scans, is_cse, degree_name, course_codes)
+
+
+def find_check_in(student, event_id):
+    if student.id is None:
+        return None
+    return CheckIn.query \
+        .filter(CheckIn.student_id == student.id) \
+        .filter(CheckIn.event_id == event_id) \
+        .first()
+
+
+def stored_details(check_in):
+    """
+    Returns whether a stored check-in's student is from CSE, their degree's
+    name and their course codes, which repeat scans are answered with.
+    """
+    courses = db.session.query(Course.code) \
+        .join(Enrolment, Enrolment.course_id == Course.id) \
+        .filter(Enrolment.check_in_id == check_in.id) \
+        .order_by(Enrolment.id) \
+        .all()
+    return check_in.is_cse, unicode(check_in.degree), [code for code, in courses]
+
+
+def preview_details(student, user_info):
+    """
+    Works out what record_check_in would store for a student's first scan,
+    from UDB and the student's details, without writing anything: whether
+    they are from CSE, their degree's name and their course codes.
+    """
+    degree_info, course_codes, expiry = enrolment_details(user_info)
+    is_cse = expiry > datetime.now().date() or bool(student.override_cse)
+
+    degree = Degree.query.filter(Degree.code == degree_info.code).first()
+    if degree is not None:
+        degree_name = unicode(degree)
+    elif degree_info.code == 0:
+        degree_name = u'Non-CSE degree'
+    else:
+        degree_name = u'Unknown Degree (%s)' % degree_info.code
+
+    return is_cse, degree_name, course_codes
+
+
+def check_in_response(student, num_scans, is_cse, degree_name, course_codes):
+    resp = {}
+
+    resp['name'] = '%s %s' % (student.given_names, student.surname)
+    resp['num_scans'] = num_scans
+    resp['is_arc'] = student.is_arc
+    resp['is_cse'] = is_cse
+
+    resp['degree'] = degree_name
+    if student.override_cse:
+        resp['degree'] += ' (Overridden)'
+
+    resp['courses'] = course_codes
+
+    return resp
+
+
+def unique(items):
+    seen = set()
+    return [item for item in items if not (item in seen or seen.add(item))]
+
+
+def get_or_create_student(student):
+    """
+    Saves a new Student from find_student, unless another worker has just
+    saved the same one, and returns the saved row.
+
+    Without the unique index on zid (see migrate_db.py) both workers' rows
+    are saved; the first is used, as find_student does.
+    """
+    insert_ignore(Student.__table__, [{
+        'zid': student.zid,
+        'given_names': student.given_names,
+        'surname': student.surname
+    }])
+    return Student.query.filter(Student.zid == student.zid).order_by(Student.id).first()
+
+
+def get_or_create_degree(code):
+    degree = Degree.query.filter(Degree.code == code).order_by(Degree.id).first()
+    if degree is None:
+        insert_ignore(Degree.__table__, [{'code': code, 'is_cse': True}])  # TODO: wat
+        degree = Degree.query.filter(Degree.code == code).order_by(Degree.id).first()
+    return degree
+
+
+def get_or_create_courses(codes):
+    """
+    Returns the courses with the given codes, in the same order, inserting any
+    that don't exist yet. Takes at most three statements.
+    """
+    if not codes:
+        return []
+
+    courses = dict((course.code, course) for course in Course.query.filter(Course.code.in_(codes)))
+
+    missing = [code for code in codes if code not in courses]
+    if missing:
+        insert_ignore(Course.__table__, [{'code': code} for code in missing])
+        courses.update((course.code, course) for course in Course.query.filter(Course.code.in_(missing)))
+
+    return [courses[code] for code in codes]
@@ -0,0 +1,24 @@
+try:
+    import gevent
+    from gevent import monkey
+except ImportError:
+    gevent = None
+
+
+def is_cooperative():
+    """
+    Whether we're running in a gevent worker, i.e. the socket module has been
+    monkey patched.
+    """
+    return gevent is not None and monkey.is_module_patched('socket')
+
+
+def run_blocking(func, *args):
+    """
+    Calls func(*args). In a gevent worker the call is made on gevent's thread
+    pool instead, for libraries like python-ldap that block in C code where
+    gevent can't switch to other requests.
+    """
+    if is_cooperative():
+        return gevent.get_hub().threadpool.apply(func, args)
+    return func(*args)
@@ -1,8 +1,108 @@
 from datetime import datetime
 
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.pool import QueuePool
+
+# How SQLite connections are set up, by DATABASE_PROFILE: the PRAGMAs run
+# on each new connection, and how many connections each worker keeps open
+# (None opens a new one every time)
+SQLITE_PROFILES = {
+    'default': {
+        'pragmas': [],
+        'pool_size': None
+    },
+    'production': {
+        'pragmas': [
+            # readers no longer block the writer, or the other way around
+            ('journal_mode', 'WAL'),
+            # still safe from corruption in WAL mode, but a power cut can
+            # lose the last few commits
+            ('synchronous', 'NORMAL'),
+            # wait this many ms for another worker's write instead of failing
+            ('busy_timeout', 10000),
+            # read through the OS page cache, which all workers share
+            ('mmap_size', 256 * 1024 * 1024),
+            # in KiB when negative. each pooled connection keeps its own
+            ('cache_size', -8 * 1024),
+            ('temp_store', 'MEMORY')
+        ],
+        # keep connections, and their caches, between requests
+        'pool_size': 2
+    }
+}
+
+
+def sqlite_profile(app):
+    profile = app.config.get('DATABASE_PROFILE', 'default')
+    if profile not in SQLITE_PROFILES:
+        raise ValueError('Unknown database profile %r' % profile)
+    return SQLITE_PROFILES[profile]
+
+
+class BarkSQLAlchemy(SQLAlchemy):
+    def apply_driver_hacks(self, app, info, options):
+        super(BarkSQLAlchemy, self).apply_driver_hacks(app, info, options)
+
+        pool_size = sqlite_profile(app)['pool_size']
+        if info.drivername == 'sqlite' and pool_size and 'poolclass' in options:
+            # neither flask-sqlalchemy nor SQLAlchemy pool SQLite file
+            # connections unless told to
+            options['poolclass'] = QueuePool
+            options['pool_size'] = pool_size
+            # the pool hands a connection to one thread at a time, but not
+            # always the thread that opened it
+            options['connect_args'] = {'check_same_thread': False}
+
+        if info.drivername.startswith('postgresql'):
+            options['pool_size'] = app.config['POSTGRES_POOL_SIZE']
+            options['max_overflow'] = app.config['POSTGRES_MAX_OVERFLOW']
+            options['pool_timeout'] = app.config['POSTGRES_POOL_TIMEOUT'].total_seconds()
+            options['pool_recycle'] = int(app.config['POSTGRES_POOL_RECYCLE'].total_seconds())
+            # replace connections the server has closed before using them
+            options['pool_pre_ping'] = True
+
+
+db = BarkSQLAlchemy()
+
+
+def init_db(app):
+    """
+    Sets up `db` for the app, and the PRAGMAs of its DATABASE_PROFILE if the
+    database is SQLite.
+    """
+    db.init_app(app)
+
+    engine = db.get_engine(app)
+    pragmas = sqlite_profile(app)['pragmas']
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+        cursor.close()
 
-db = SQLAlchemy()
+
+def insert_ignore(table, rows):
+    """
+    Inserts `rows` into `table` as part of the session's transaction, skipping
+    any that clash with a unique index (e.g. because another worker inserted
+    the same student at the same time). Returns the result, whose rowcount
+    is how many were inserted.
+    """
+    dialect = db.session.get_bind(mapper=None, clause=table).dialect.name
+    if dialect == 'postgresql':
+        statement = postgresql.insert(table).on_conflict_do_nothing()
+    elif dialect == 'sqlite':
+        statement = table.insert().prefix_with('OR IGNORE')
+    else:
+        statement = table.insert()
+
+    return db.session.execute(statement, rows)
 
 
 class User(db.Model):
@@ -48,7 +148,7 @@ class Event(db.Model):
 
     timestamp = db.Column(db.DateTime)
 
-    token = db.Column(db.String(64))  # hex-encoded session token
+    token = db.Column(db.String(64), unique=True, index=True)  # hex-encoded session token
 
     def __init__(self):
         self.timestamp = datetime.now()
@@ -57,6 +157,25 @@ class Event(db.Model):
         return self.name
 
 
+class EventsVersion(db.Model):
+    """
+    A single row counting changes to events, bumped in the same transaction
+    as each change, so every worker's EventIndex can tell when it is out of
+    date.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+@event.listens_for(Event, 'after_insert')
+@event.listens_for(Event, 'after_update')
+@event.listens_for(Event, 'after_delete')
+def bump_events_version(mapper, connection, target):
+    table = EventsVersion.__table__
+    if not connection.execute(table.update().values(version=table.c.version + 1)).rowcount:
+        connection.execute(table.insert().values(id=1, version=1))
+
+
 class Category(db.Model):
     """
     Defines an event category.
@@ -73,7 +192,7 @@ class Student(db.Model):
     Defines a student.
     """
     id = db.Column(db.Integer, primary_key=True)
-    zid = db.Column(db.String(20))
+    zid = db.Column(db.String(20), unique=True, index=True)
     given_names = db.Column(db.String(100))
     surname = db.Column(db.String(100))
     is_arc = db.Column(db.Boolean)  # update this infrequently, maybe every year
@@ -90,7 +209,7 @@ class Degree(db.Model):
     Defines a UNSW degree.
     """
     id = db.Column(db.Integer, primary_key=True)
-    code = db.Column(db.Integer)
+    code = db.Column(db.Integer, unique=True, index=True)
     name = db.Column(db.String(100))
     is_cse = db.Column(db.Boolean)
 
@@ -103,7 +222,7 @@ class Course(db.Model):
     Defines a UNSW course.
     """
     id = db.Column(db.Integer, primary_key=True)
-    code = db.Column(db.String(8))
+    code = db.Column(db.String(8), unique=True, index=True)
     name = db.Column(db.String(100))
 
     def __unicode__(self):
@@ -116,7 +235,7 @@ class Enrolment(db.Model):
     """
     id = db.Column(db.Integer, primary_key=True)
 
-    check_in_id = db.Column(db.Integer, db.ForeignKey('check_in.id'))
+    check_in_id = db.Column(db.Integer, db.ForeignKey('check_in.id'), index=True)
     check_in = db.relationship('CheckIn', backref=db.backref('enrolments', lazy='dynamic'))
 
     course_id = db.Column(db.Integer, db.ForeignKey('course.id'))
@@ -127,12 +246,19 @@ class CheckIn(db.Model):
     """
     Defines an instance of an student "checking in" to an event.
     """
+    __table_args__ = (
+        # a student checks in to each event at most once
+        db.Index('ix_check_in_student_event', 'student_id', 'event_id', unique=True),
+        # the admin list pages through check-ins in this order
+        db.Index('ix_check_in_timestamp_id', 'timestamp', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
 
     student_id = db.Column(db.Integer, db.ForeignKey('student.id'))
     student = db.relationship('Student', backref=db.backref('checkins', lazy='dynamic'))
 
-    event_id = db.Column(db.Integer, db.ForeignKey('event.id'))
+    event_id = db.Column(db.Integer, db.ForeignKey('event.id'), index=True)
     event = db.relationship('Event', backref=db.backref('students', lazy='dynamic'))
 
     timestamp = db.Column(db.DateTime)
@@ -152,3 +278,29 @@ class CheckIn(db.Model):
 
     def __unicode__(self):
         return '%s @ %s' % (unicode(self.student), unicode(self.event))
+
+
+class CheckInQueueMark(db.Model):
+    """
+    How far each write-behind queue (app.check_in_queue) has been written to
+    the database: the id of the last scan written. It is updated in the same
+    transaction as the check-ins, so scans are never written twice, even if
+    the writer stops before it can take them out of the queue.
+    """
+    queue_id = db.Column(db.String(32), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False)
+
+
+class EventStats(db.Model):
+    """
+    Running totals of an event's check-ins, kept up to date as check-ins are
+    written so they can be shown without counting them. A student checks in
+    to an event at most once, so check_ins is also the number of students.
+    """
+    event_id = db.Column(db.Integer, db.ForeignKey('event.id'), primary_key=True)
+    event = db.relationship('Event', backref=db.backref('stats', uselist=False, cascade='all, delete-orphan'))
+
+    check_ins = db.Column(db.Integer, nullable=False, default=0)
+    cse = db.Column(db.Integer, nullable=False, default=0)
+    arc = db.Column(db.Integer, nullable=False, default=0)
+    scans = db.Column(db.Integer, nullable=False, default=0)
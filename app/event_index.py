@@ -0,0 +1,83 @@
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+from app.db import Event, EventsVersion, db
+
+EventInfo = namedtuple('EventInfo', ['id', 'name', 'location', 'start', 'end', 'check_cse', 'check_arc'])
+
+
+def event_info(event):
+    return EventInfo(
+        id=event.id,
+        name=event.name,
+        location=event.location,
+        start=event.start,
+        end=event.end,
+        check_cse=event.check_cse,
+        check_arc=event.check_arc
+    )
+
+
+class EventIndex(object):
+    """
+    Keeps the events that are live (running, give or take the leeway) in
+    memory, keyed by token, so the API doesn't query the database for the
+    event on every call.
+
+    Each worker has its own index. It is reloaded after `refresh_interval`,
+    and after any worker commits a change to an event, which bumps
+    EventsVersion. The version is read at most once per `version_interval`,
+    so lookups in between don't touch the database. Tokens that aren't live
+    fall back to a database query.
+    """
+    def __init__(self, event_leeway, refresh_interval, version_interval):
+        self._event_leeway = event_leeway
+        self._refresh_interval = refresh_interval
+        self._version_interval = version_interval
+        self._events = {}
+        self._loaded_at = None
+        self._checked_at = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        now = datetime.now()
+        if self._loaded_at is None or now - self._loaded_at > self._refresh_interval:
+            self._refresh(self._read_version())
+        elif now - self._checked_at > self._version_interval:
+            version = self._read_version()
+            if version != self._version:
+                self._refresh(version)
+
+        info = self._events.get(token)
+        if info is None:
+            event = Event.query.filter(Event.token == token).first()
+            if event:
+                info = event_info(event)
+        return info
+
+    def is_running(self, info, now=None):
+        now = now or datetime.now()
+        return info.start - self._event_leeway <= now and now <= info.end + self._event_leeway
+
+    def _read_version(self):
+        self._checked_at = datetime.now()
+        return db.session.query(EventsVersion.version).scalar()
+
+    def _refresh(self, version):
+        # `version` was read before the events, so a change committed in
+        # between is picked up again on the next lookup
+        with self._lock:
+            now = datetime.now()
+
+            # also load events that will start running before the next refresh
+            events = Event.query \
+                .filter(Event.token.isnot(None)) \
+                .filter(Event.start <= now + self._event_leeway + self._refresh_interval) \
+                .filter(Event.end >= now - self._event_leeway) \
+                .all()
+
+            self._events = dict((event.token, event_info(event)) for event in events)
+            self._loaded_at = now
+            self._version = version
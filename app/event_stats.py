@@ -0,0 +1,128 @@
+from sqlalchemy import func, case
+
+from app.db import db, CheckIn, Student, EventStats, insert_ignore
+
+_stats = EventStats.__table__
+
+
+def count_check_ins(event_id=None):
+    """
+    Counts check-ins per event from scratch. Returns a list of dicts with the
+    columns of EventStats.
+    """
+    query = db.session.query(
+        CheckIn.event_id,
+        func.count(CheckIn.id),
+        func.sum(case([(CheckIn.is_cse, 1)], else_=0)),
+        func.sum(case([(Student.is_arc, 1)], else_=0)),
+        func.sum(CheckIn.number_of_scans)
+    ) \
+        .join(Student, CheckIn.student_id == Student.id) \
+        .group_by(CheckIn.event_id)
+    if event_id is not None:
+        query = query.filter(CheckIn.event_id == event_id)
+
+    return [
+        {'event_id': id_, 'check_ins': check_ins, 'cse': int(cse or 0), 'arc': int(arc or 0), 'scans': int(scans or 0)}
+        for id_, check_ins, cse, arc, scans in query
+    ]
+
+
+def _counted(event_id):
+    rows = count_check_ins(event_id)
+    return rows[0] if rows else {'event_id': event_id, 'check_ins': 0, 'cse': 0, 'arc': 0, 'scans': 0}
+
+
+def add_to_stats(event_id, **changes):
+    """
+    Adds `changes` (e.g. check_ins=1, scans=1) to an event's counters, as part
+    of the session's transaction. Call it after the change it counts has been
+    made in the session.
+
+    Counters that don't exist yet are counted from scratch instead, which
+    takes in the change already.
+    """
+    update = _stats.update() \
+        .where(_stats.c.event_id == event_id) \
+        .values(**dict((name, _stats.c[name] + value) for name, value in changes.items()))
+
+    if db.session.execute(update).rowcount:
+        return
+
+    db.session.flush()
+    if not insert_ignore(_stats, [_counted(event_id)]).rowcount:
+        # another worker counted them first, without this change
+        db.session.execute(update)
+
+
+def add_arc_change(student_id, is_arc):
+    """
+    Moves a student in or out of the ARC counters of every event they have
+    checked in to.
+    """
+    db.session.execute(
+        _stats.update()
+        .where(_stats.c.event_id.in_(
+            db.session.query(CheckIn.event_id).filter(CheckIn.student_id == student_id).subquery()
+        ))
+        .values(arc=_stats.c.arc + (1 if is_arc else -1))
+    )
+
+
+def refresh_arc_counts():
+    """
+    Recounts the ARC members of every event with counters, in one statement,
+    e.g. after many students' ARC membership changed at once.
+    """
+    arc = db.session.query(func.count(CheckIn.id)) \
+        .join(Student, CheckIn.student_id == Student.id) \
+        .filter(CheckIn.event_id == _stats.c.event_id) \
+        .filter(Student.is_arc) \
+        .correlate(_stats) \
+        .as_scalar()
+    db.session.execute(_stats.update().values(arc=arc))
+
+
+def get_event_stats(event_id):
+    """
+    Returns an event's counters as a dict. It only reads, as it is called
+    from read-only requests: an event without counters is counted, and its
+    counters are left for its next check-in, migrate_db.py or
+    rebuild_stats.py to store.
+    """
+    stats = db.session.query(EventStats).get(event_id)
+    if stats is None:
+        return _counted(event_id)
+
+    return {'event_id': event_id, 'check_ins': stats.check_ins, 'cse': stats.cse, 'arc': stats.arc,
+            'scans': stats.scans}
+
+
+def add_missing_stats():
+    """
+    Counts and stores the counters of events that have check-ins but no
+    counters yet, e.g. ones checked in to before there were counters. Returns
+    how many events were counted; the caller commits.
+    """
+    counted = set(event_id for event_id, in db.session.query(EventStats.event_id))
+    rows = [row for row in count_check_ins() if row['event_id'] not in counted]
+    if rows:
+        insert_ignore(_stats, rows)
+    return len(rows)
+
+
+def rebuild_event_stats(event_id=None):
+    """
+    Throws away the counters of one event, or all of them, and counts them
+    again from the check-ins. Commits.
+    """
+    delete = _stats.delete()
+    if event_id is not None:
+        delete = delete.where(_stats.c.event_id == event_id)
+    db.session.execute(delete)
+
+    rows = count_check_ins(event_id)
+    if rows:
+        db.session.execute(_stats.insert(), rows)
+    db.session.commit()
+    return rows
@@ -0,0 +1,268 @@
+import json
+import os
+import Queue
+import sqlite3
+import threading
+import time
+
+from app.event_stats import get_event_stats
+
+_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS feed (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id INTEGER NOT NULL,
+        created REAL NOT NULL,
+        kind TEXT NOT NULL,
+        data TEXT NOT NULL
+    )''',
+    # the events each worker has dashboards watching, renewed by its reader
+    # until `expires`, so nothing is published for events nobody watches
+    '''CREATE TABLE IF NOT EXISTS watcher (
+        event_id INTEGER NOT NULL,
+        pid INTEGER NOT NULL,
+        expires REAL NOT NULL,
+        PRIMARY KEY (event_id, pid)
+    )'''
+]
+
+# how many messages a slow dashboard can fall behind by before it misses some
+SUBSCRIBER_BACKLOG = 1000
+
+# how long a worker's watcher entries last without being renewed, e.g. after
+# it was killed
+WATCHER_TTL = 30
+
+# how long publishers go on with what they last saw of the watcher entries
+WATCHER_CHECK_INTERVAL = 1
+
+
+def check_in_message(zid, resp, scanned_at):
+    """
+    What dashboards are sent about a check-in, given its response.
+    """
+    return {
+        'zid': zid,
+        'name': resp['name'],
+        'num_scans': resp['num_scans'],
+        'is_cse': resp['is_cse'],
+        'is_arc': resp['is_arc'],
+        'degree': resp['degree'],
+        'time': time.mktime(scanned_at.timetuple())
+    }
+
+
+class LiveFeed(object):
+    """
+    Passes check-ins from the worker that wrote them to every worker with a
+    dashboard watching the event.
+
+    Messages are appended to a local SQLite file, and kept for `retention`.
+    Each worker with dashboards open runs one thread that reads new messages
+    every `interval`, hands them to the dashboards watching their event, and
+    follows them with the event's counters.
+
+    Messages are only published for events some worker has a dashboard
+    watching. A new dashboard can miss the check-ins of its first second or
+    so; the counters that follow the next one take them in.
+    """
+    def __init__(self, app, path, interval, retention, timeout):
+        self._app = app
+        self._path = path
+        self._interval = interval.total_seconds()
+        self._retention = retention.total_seconds()
+        self._timeout = timeout.total_seconds()
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._schema_pid = None
+        self._pid = None
+        self._subscribers = {}
+        self._last_id = 0
+        self._pruned_at = 0
+        # event id -> (when it was checked, whether anyone is watching)
+        self._watched = {}
+        self._watched_at = 0
+
+    def _connect(self):
+        # sqlite connections can't be shared between threads or processes
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            conn = sqlite3.connect(self._path, timeout=self._timeout, isolation_level=None)
+            with self._lock:
+                if self._schema_pid != pid:
+                    conn.execute('PRAGMA journal_mode=WAL')
+                    for statement in _SCHEMA:
+                        conn.execute(statement)
+                    self._schema_pid = pid
+            self._local.conn = conn
+            self._local.pid = pid
+        return self._local.conn
+
+    def publish(self, event_id, kind, messages):
+        """
+        Sends `messages` (dicts) of `kind` to every dashboard watching the event.
+        Failures are logged rather than raised, since the scans they describe
+        have already been written.
+        """
+        if not messages:
+            return
+
+        now = time.time()
+        try:
+            if not self._is_watched(event_id, now):
+                return
+
+            conn = self._connect()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.executemany(
+                    'INSERT INTO feed (event_id, created, kind, data) VALUES (?, ?, ?, ?)',
+                    [(event_id, now, kind, json.dumps(message)) for message in messages]
+                )
+                if now - self._pruned_at > self._retention:
+                    self._pruned_at = now
+                    conn.execute('DELETE FROM feed WHERE created < ?', (now - self._retention,))
+                conn.execute('COMMIT')
+            except:
+                conn.execute('ROLLBACK')
+                raise
+        except sqlite3.Error:
+            self._app.logger.warning('Could not publish to the live feed at %s', self._path, exc_info=True)
+
+    def _is_watched(self, event_id, now):
+        checked_at, watched = self._watched.get(event_id, (0, False))
+        if now - checked_at > WATCHER_CHECK_INTERVAL:
+            watched = self._connect().execute(
+                'SELECT 1 FROM watcher WHERE event_id = ? AND expires > ?', (event_id, now)
+            ).fetchone() is not None
+            self._watched[event_id] = (now, watched)
+        return watched
+
+    def subscribe(self, event_id, last_id=None):
+        """
+        Starts watching an event. Returns a queue of (id, kind, data) tuples,
+        beginning after message `last_id` if it is still kept, or with the
+        next new message.
+        """
+        self._start()
+
+        queue = Queue.Queue(SUBSCRIBER_BACKLOG)
+        with self._lock:
+            self._subscribers.setdefault(event_id, set()).add(queue)
+            # the reader sends everything after this
+            read_up_to = self._last_id
+        self._watch([event_id])
+
+        if last_id is not None:
+            # a reconnecting dashboard catches up on what it missed
+            rows = self._connect().execute(
+                'SELECT id, kind, data FROM feed WHERE event_id = ? AND id > ? AND id <= ? ORDER BY id',
+                (event_id, last_id, read_up_to)
+            ).fetchall()
+            for row in rows:
+                _put(queue, row)
+        return queue
+
+    def unsubscribe(self, event_id, queue):
+        with self._lock:
+            queues = self._subscribers.get(event_id, set())
+            queues.discard(queue)
+            if queues:
+                return
+            self._subscribers.pop(event_id, None)
+
+        try:
+            self._connect().execute('DELETE FROM watcher WHERE event_id = ? AND pid = ?', (event_id, os.getpid()))
+        except sqlite3.Error:
+            # it expires by itself
+            pass
+
+    def _watch(self, event_ids):
+        # (re)registers this worker as watching `event_ids` for WATCHER_TTL
+        now = time.time()
+        pid = os.getpid()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('INSERT OR REPLACE INTO watcher VALUES (?, ?, ?)',
+                             [(event_id, pid, now + WATCHER_TTL) for event_id in event_ids])
+            conn.execute('DELETE FROM watcher WHERE expires < ?', (now,))
+            conn.execute('COMMIT')
+        except:
+            conn.execute('ROLLBACK')
+            raise
+        self._watched_at = now
+
+    def _start(self):
+        # threads don't survive a fork, so each worker starts its own reader
+        pid = os.getpid()
+        conn = self._connect()
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            self._subscribers = {}
+            self._last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM feed').fetchone()[0]
+
+        thread = threading.Thread(target=self._run, name='live-feed-reader')
+        thread.daemon = True
+        thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self._interval)
+            try:
+                if time.time() - self._watched_at > WATCHER_TTL / 3.0:
+                    with self._lock:
+                        event_ids = list(self._subscribers)
+                    self._watch(event_ids)
+                self._read()
+            except Exception:
+                self._app.logger.exception('Could not read the live feed')
+
+    def _read(self):
+        rows = self._connect().execute(
+            'SELECT id, event_id, kind, data FROM feed WHERE id > ? ORDER BY id', (self._last_id,)
+        ).fetchall()
+        if not rows:
+            return
+
+        # move on and pick who gets these together, so a new subscriber gets
+        # each message either from here or from its catch up, not both
+        with self._lock:
+            self._last_id = rows[-1][0]
+            subscribers = dict((event_id, list(queues)) for event_id, queues in self._subscribers.items())
+
+        changed = {}
+        for id_, event_id, kind, data in rows:
+            for queue in subscribers.get(event_id, ()):
+                changed[event_id] = id_
+                _put(queue, (id_, kind, data))
+
+        # one counters message per event, however many check-ins came in
+        with self._app.app_context():
+            for event_id, id_ in changed.items():
+                stats = json.dumps(get_event_stats(event_id))
+                for queue in subscribers[event_id]:
+                    _put(queue, (id_, 'stats', stats))
+
+
+def _put(queue, message):
+    try:
+        queue.put_nowait(message)
+    except Queue.Full:
+        # the dashboard isn't keeping up; it catches up on the counters
+        pass
+
+
+def create_live_feed(app, config):
+    if not config.LIVE_FEED_ENABLED:
+        return None
+
+    return LiveFeed(
+        app,
+        os.path.join(app.root_path, config.LIVE_FEED_PATH),
+        interval=config.LIVE_FEED_INTERVAL,
+        retention=config.LIVE_FEED_RETENTION,
+        timeout=config.LIVE_FEED_TIMEOUT
+    )
@@ -0,0 +1,246 @@
+import glob
+import json
+import os
+import threading
+import time
+
+from flask import g, has_app_context
+from sqlalchemy import event
+
+# upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# upper bounds of the database queries per request histogram buckets
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+# how often, at most, a worker writes its metrics out for the others
+DUMP_INTERVAL = 5
+
+
+class RequestTimer(object):
+    """
+    Collects how long one request spends in each phase, and how many database
+    queries it makes.
+    """
+    def __init__(self):
+        self.start = time.time()
+        self.phases = {}
+        self.queries = 0
+        self.query_time = 0.0
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+
+def current_timer():
+    if has_app_context():
+        return getattr(g, '_request_timer', None)
+    return None
+
+
+class phase(object):
+    """
+    Times a block as part of the current request's phase `name`, e.g.
+
+        with phase('udb_fetch'):
+            ...
+
+    Does nothing outside a timed request, e.g. on a background thread or when
+    metrics are turned off.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._timer = None
+
+    def __enter__(self):
+        self._timer = current_timer()
+        if self._timer is not None:
+            self._start = time.time()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._timer is not None:
+            self._timer.add(self._name, time.time() - self._start)
+
+
+class Metrics(object):
+    """
+    Histograms and counters in the Prometheus text format.
+
+    Each gunicorn worker keeps its own. If `directory` is set, workers write
+    theirs there every few seconds, and /metrics adds up the ones of the
+    workers that are still running.
+    """
+    def __init__(self, enabled, slow_request_threshold, logger, directory=None):
+        self.enabled = enabled
+        self._slow_request_threshold = slow_request_threshold.total_seconds()
+        self._logger = logger
+        self._directory = directory
+
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._dumped_at = 0
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': list(buckets), 'counts': [0] * len(buckets),
+                                                     'sum': 0.0, 'count': 0}
+
+            for i, bound in enumerate(histogram['buckets']):
+                if value <= bound:
+                    histogram['counts'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def increment(self, name, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+    def start_request(self):
+        """
+        Starts timing the current request, if metrics are turned on.
+        """
+        if self.enabled:
+            g._request_timer = RequestTimer()
+
+    def finish_request(self, action, success):
+        timer = current_timer()
+        if timer is None:
+            return
+        g._request_timer = None
+
+        total = time.time() - timer.start
+        labels = {'action': action}
+
+        self.observe('bark_api_request_seconds', labels, total)
+        self.increment('bark_api_requests_total', {'action': action, 'success': str(success).lower()})
+        self.observe('bark_api_db_queries', labels, timer.queries, QUERY_BUCKETS)
+        self.observe('bark_api_phase_seconds', dict(labels, phase='db'), timer.query_time)
+        for name, seconds in timer.phases.items():
+            self.observe('bark_api_phase_seconds', dict(labels, phase=name), seconds)
+
+        if total > self._slow_request_threshold:
+            phases = ', '.join('%s %.0fms' % (name, seconds * 1000) for name, seconds in sorted(timer.phases.items()))
+            self._logger.warning('Slow %s request took %.0fms: %s, %d queries in %.0fms',
+                                 action, total * 1000, phases or 'no phases', timer.queries, timer.query_time * 1000)
+
+        if self._directory and time.time() - self._dumped_at > DUMP_INTERVAL:
+            self._dump()
+
+    def instrument(self, engine):
+        """
+        Counts and times the current request's database queries.
+        """
+        if not self.enabled:
+            return
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault('query_start', []).append(time.time())
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            start = conn.info['query_start'].pop()
+            timer = current_timer()
+            if timer is not None:
+                timer.queries += 1
+                timer.query_time += time.time() - start
+
+    def _snapshot(self):
+        with self._lock:
+            return {
+                'histograms': [[name, labels, dict(histogram, counts=list(histogram['counts']))]
+                               for (name, labels), histogram in self._histograms.items()],
+                'counters': [[name, labels, value] for (name, labels), value in self._counters.items()]
+            }
+
+    def _dump(self):
+        self._dumped_at = time.time()
+        if not os.path.isdir(self._directory):
+            os.makedirs(self._directory)
+
+        path = os.path.join(self._directory, '%d.json' % os.getpid())
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self._snapshot(), f)
+        os.rename(path + '.tmp', path)
+
+    def _snapshots(self):
+        if not self._directory:
+            return [self._snapshot()]
+
+        self._dump()
+        snapshots = []
+        for path in glob.glob(os.path.join(self._directory, '*.json')):
+            pid = int(os.path.basename(path).split('.')[0])
+            try:
+                os.kill(pid, 0)
+            except OSError:
+                # the worker has exited, its counts go with it
+                os.remove(path)
+                continue
+
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (IOError, ValueError):
+                pass
+        return snapshots
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text format.
+        """
+        histograms = {}
+        counters = {}
+        for snapshot in self._snapshots():
+            for name, labels, histogram in snapshot['histograms']:
+                key = (name, tuple(tuple(label) for label in labels))
+                total = histograms.setdefault(key, {'buckets': histogram['buckets'],
+                                                    'counts': [0] * len(histogram['buckets']), 'sum': 0.0, 'count': 0})
+                total['counts'] = [a + b for a, b in zip(total['counts'], histogram['counts'])]
+                total['sum'] += histogram['sum']
+                total['count'] += histogram['count']
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(tuple(label) for label in labels))
+                counters[key] = counters.get(key, 0) + value
+
+        lines = []
+        for name in sorted(set(name for name, _ in histograms)):
+            lines.append('# TYPE %s histogram' % name)
+            for key in sorted(key for key in histograms if key[0] == name):
+                labels = key[1]
+                histogram = histograms[key]
+                for bound, count in zip(histogram['buckets'], histogram['counts']):
+                    lines.append('%s_bucket%s %d' % (name, format_labels(labels + (('le', repr(float(bound))),)), count))
+                lines.append('%s_bucket%s %d' % (name, format_labels(labels + (('le', '+Inf'),)), histogram['count']))
+                lines.append('%s_sum%s %f' % (name, format_labels(labels), histogram['sum']))
+                lines.append('%s_count%s %d' % (name, format_labels(labels), histogram['count']))
+        for name in sorted(set(name for name, _ in counters)):
+            lines.append('# TYPE %s counter' % name)
+            for key in sorted(key for key in counters if key[0] == name):
+                lines.append('%s%s %d' % (name, format_labels(key[1]), counters[key]))
+
+        return '\n'.join(lines) + '\n'
+
+
+def clear_dumps(directory):
+    """
+    Removes the metrics workers have written to `directory`. Run when the
+    server starts: a new worker can be given the pid of one from the last
+    run, whose counts would otherwise be added to its own.
+    """
+    for path in glob.glob(os.path.join(directory, '*.json')) + glob.glob(os.path.join(directory, '*.json.tmp')):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, value) for name, value in labels)
@@ -0,0 +1,140 @@
+import re
+import threading
+import time
+
+import requests
+
+from app.cache import LRUCache
+from app.db import Degree, Course, db
+from app.thread_pool import LazyThreadPool
+
+_DEGREE_TITLE_RE = re.compile(r'<meta name="DC\.Subject\.Title" CONTENT="(.*?)">')
+_COURSE_TITLE_RE = re.compile(r'<meta name="DC\.Subject\.Description\.Short" CONTENT="(.*?)">')
+
+
+class HandbookService(object):
+    """
+    Looks up degree and course names in the UNSW handbook.
+    """
+    def __init__(self, timeout=None):
+        self._timeout = timeout.total_seconds() if timeout else None
+
+    def _search(self, urls, pattern):
+        for url in urls:
+            r = requests.get(url, timeout=self._timeout)
+            match = pattern.search(r.content)
+            if match:
+                return match.group(1).strip()
+
+    def degree_name(self, code):
+        return self._search(
+            ['http://www.handbook.unsw.edu.au/%s/programs/current/%s.html' % (u, code)
+             for u in ('undergraduate', 'postgraduate', 'research')],
+            _DEGREE_TITLE_RE
+        )
+
+    def course_name(self, code):
+        return self._search(
+            ['http://www.handbook.unsw.edu.au/%s/courses/current/%s.html' % (u, code)
+             for u in ('undergraduate', 'postgraduate')],
+            _COURSE_TITLE_RE
+        )
+
+
+class HandbookResolver(object):
+    """
+    Fills in the names of new degrees and courses in the background, so a
+    check-in never waits on the handbook.
+
+    Rows are created with no name and resolved by a small thread pool. Lookups
+    for a code that is already in flight are dropped, lookups that raise are
+    retried with a growing delay, and codes the handbook doesn't know are
+    remembered for a while so they aren't looked up on every check-in.
+    """
+    def __init__(self, app, handbook_service, workers, max_attempts, retry_delay, unknown_ttl, metrics=None):
+        self._app = app
+        self._metrics = metrics
+        self._handbook_service = handbook_service
+        self._pool = LazyThreadPool(workers)
+        self._max_attempts = max_attempts
+        self._retry_delay = retry_delay.total_seconds()
+        self._unknown = LRUCache(4096, unknown_ttl)
+
+        self._lock = threading.Lock()
+        self._pending = set()
+
+    def resolve_degree(self, code):
+        self._submit(Degree, code)
+
+    def resolve_course(self, code):
+        self._submit(Course, code)
+
+    def _submit(self, model, code, attempt=1):
+        key = (model.__tablename__, code)
+
+        with self._lock:
+            if attempt == 1:
+                if key in self._pending or self._unknown.get(key):
+                    return
+                self._pending.add(key)
+
+        self._pool.get().apply_async(self._resolve, (model, code, attempt))
+
+    def _lookup(self, model, code):
+        start = time.time()
+        try:
+            if model is Degree:
+                return self._handbook_service.degree_name(code)
+            return self._handbook_service.course_name(code)
+        finally:
+            if self._metrics is not None and self._metrics.enabled:
+                self._metrics.observe('bark_handbook_lookup_seconds', {'kind': model.__tablename__},
+                                      time.time() - start)
+
+    def _resolve(self, model, code, attempt):
+        key = (model.__tablename__, code)
+
+        try:
+            name = self._lookup(model, code)
+        except Exception:
+            if attempt < self._max_attempts:
+                timer = threading.Timer(self._retry_delay * attempt, self._submit, (model, code, attempt + 1))
+                timer.daemon = True
+                timer.start()
+                return
+
+            self._app.logger.exception('Handbook lookup failed for %s %s', model.__tablename__, code)
+            name = None
+
+        try:
+            if name is None:
+                self._unknown.set(key, True)
+            else:
+                with self._app.app_context():
+                    model.query \
+                        .filter(model.code == code) \
+                        .filter(model.name.is_(None)) \
+                        .update({'name': name}, synchronize_session=False)
+                    db.session.commit()
+                    db.session.remove()
+        except Exception:
+            self._app.logger.exception('Could not save handbook name for %s %s', model.__tablename__, code)
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+
+def create_handbook_service(config):
+    return HandbookService(timeout=config.HANDBOOK_TIMEOUT)
+
+
+def create_handbook_resolver(app, config, metrics=None):
+    return HandbookResolver(
+        app,
+        create_handbook_service(config),
+        workers=config.HANDBOOK_WORKERS,
+        max_attempts=config.HANDBOOK_MAX_ATTEMPTS,
+        retry_delay=config.HANDBOOK_RETRY_DELAY,
+        unknown_ttl=config.HANDBOOK_UNKNOWN_TTL,
+        metrics=metrics
+    )
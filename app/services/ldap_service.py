@@ -1,36 +1,104 @@
+import os
+
 import ldap
+import ldap.filter
+
+from app.cooperative import run_blocking
 
 class LDAPService():
-    def __init__(self, ldap_host):
+    """
+    Authenticates staff against UNSW's Active Directory.
+
+    Each worker keeps up to `pool_size` connections open between logins and
+    binds them as whoever logs in next, rather than connecting for every
+    attempt. Connections go back to the pool bound anonymously, so none is
+    left holding the last user's identity; ones that fail are unbound and
+    thrown away.
+    """
+    BASE_DN = "OU=IDM_People,OU=IDM,DC=ad,DC=unsw,DC=edu,DC=au"
+    ATTRIBUTES = ['cn', 'displayNamePrintable', 'givenName', 'sn', 'mail']
+
+    def __init__(self, ldap_host, timeout=None, pool_size=2):
         self._ldap_host = ldap_host
+        self._timeout = timeout.total_seconds() if timeout else -1
+        self._pool_size = pool_size
+
+        # list.pop and list.append are atomic, so this needs no lock (which
+        # wouldn't work from gevent's thread pool anyway)
+        self._idle = []
+        self._pid = None
 
     def authenticate(self, username, password):
+        # python-ldap blocks in C, where gevent can't switch away
+        return run_blocking(self._authenticate, username, password)
+
+    def _connect(self):
+        l = ldap.initialize(self._ldap_host)
+        l.set_option(ldap.OPT_NETWORK_TIMEOUT, self._timeout)
+        l.set_option(ldap.OPT_TIMEOUT, self._timeout)
+        l.set_option(ldap.OPT_REFERRALS, 0)
+        return l
+
+    def _checkout(self):
+        # connections can't be shared across a fork
+        pid = os.getpid()
+        if self._pid != pid:
+            self._idle = []
+            self._pid = pid
+
         try:
-            l = ldap.initialize(self._ldap_host)
-            upn = username + '@ad.unsw.edu.au'
-            l.bind_s(upn, password)
+            return self._idle.pop()
+        except IndexError:
+            return self._connect()
 
-            baseDN = "OU=IDM_People,OU=IDM,DC=ad,DC=unsw,DC=edu,DC=au"
-            searchScope = ldap.SCOPE_SUBTREE
-            retrieveAttributes = ['cn', 'displayNamePrintable', 'givenName', 'sn', 'mail']
-            searchFilter = "cn=" + username
+    def _checkin(self, l):
+        try:
+            l.simple_bind_s('', '')
+        except ldap.LDAPError:
+            _unbind(l)
+            return
 
-            ldap_result = l.search(baseDN, searchScope, searchFilter, retrieveAttributes)
-            result_type, result_data = l.result(ldap_result, 0)
+        if len(self._idle) < self._pool_size:
+            self._idle.append(l)
+        else:
+            _unbind(l)
 
-            user_dn, attr_results = result_data[0]
+    def _authenticate(self, username, password):
+        l = self._checkout()
+        try:
+            upn = username + '@ad.unsw.edu.au'
+            l.simple_bind_s(upn, password)
 
-            first_name = attr_results['givenName'][0]
-            last_name = attr_results['sn'][0]
-            email = attr_results['mail'][0]
+            searchFilter = "cn=" + ldap.filter.escape_filter_chars(username)
+            result_data = l.search_st(self.BASE_DN, ldap.SCOPE_SUBTREE, searchFilter, self.ATTRIBUTES,
+                                      timeout=self._timeout)
+        except ldap.INVALID_CREDENTIALS:
+            # a wrong password doesn't break the connection
+            self._checkin(l)
+            return None
+        except ldap.LDAPError:
+            _unbind(l)
+            return None
+        self._checkin(l)
 
-            return {
-                'first_name': first_name,
-                'last_name': last_name,
-                'email': email
-            }
-        except ldap.LDAPError, e:
+        # skip the referrals AD sends along with the entry
+        entries = [attrs for dn, attrs in result_data if dn]
+        if not entries:
             return None
+        attr_results = entries[0]
+
+        return {
+            'first_name': attr_results['givenName'][0].decode('utf-8'),
+            'last_name': attr_results['sn'][0].decode('utf-8'),
+            'email': attr_results['mail'][0].decode('utf-8')
+        }
+
+
+def _unbind(l):
+    try:
+        l.unbind_s()
+    except ldap.LDAPError:
+        pass
 
 class DummyLDAPService():
     """
@@ -47,7 +115,11 @@ def create_ldap_service(config):
     if config.USE_FAKE_SERVICES:
         return DummyLDAPService()
     else:
-        return LDAPService(ldap_host=config.LDAP_HOST)
+        return LDAPService(
+            ldap_host=config.LDAP_HOST,
+            timeout=config.LDAP_TIMEOUT,
+            pool_size=config.LDAP_POOL_SIZE
+        )
 
 
 if __name__ == '__main__':
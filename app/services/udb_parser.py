@@ -0,0 +1,155 @@
+import json
+import re
+from collections import namedtuple
+from datetime import date, datetime
+
+# a degree or course (code is e.g. '3778' or 'COMP1511') or any other class
+# (code is its full name, e.g. 'COMP1511_Tutor'), with the date it expires
+UDBClass = namedtuple('UDBClass', ['code', 'expiry'])
+
+UDBUser = namedtuple('UDBUser', [
+    'zid',
+    'username',
+    'usernames',
+    'given_names',
+    'surname',
+    'degrees',
+    'courses',
+    'classes',
+    'expiry'
+])
+
+# one alternative for each kind of line we care about, so the whole response
+# is tokenized in a single pass
+_TOKEN_RE = re.compile(
+    r'uid = \d+ name=(?P<usernames>[^\s]*)'
+    r'|<\d+ \(\d+ \d+\) (?P<expiry>\d+)> (?P<class>[^ \n]+)'
+    r'|<\d+:(?P<value>[^>]*)> (?P<keys>[^\n]*)\n'
+)
+_CLASS_RE = re.compile(r'^(?:(?P<degree>\d{4})|(?P<course>[A-Z]{4}\d{4}))_Student$')
+_ZID_RE = re.compile(r'^z[0-9]+$')
+_ALPHA_RE = re.compile(r'^[a-z]+$')
+
+_SELECT_KEYS = {
+    'givenname': 'given_names',
+    'surname': 'surname'
+}
+
+
+class UDBParseError(ValueError):
+    pass
+
+
+def _username_key(username):
+    # plain alphabetic usernames (e.g. 'jsmith') sort ahead of the others
+    return _ALPHA_RE.match(username) is not None, username
+
+
+def by_expiry(classes):
+    """
+    Sorts UDBClasses newest (i.e. expiring latest?) first, as UDBUsers hold
+    them.
+    """
+    return tuple(sorted(classes, key=lambda c: c.expiry, reverse=True))
+
+
+def parse_user(output):
+    """
+    Parses the text UDB returns for a user into a UDBUser.
+    """
+    usernames_str = None
+    strings = {'given_names': None, 'surname': None}
+    degrees = []
+    courses = []
+    classes = []
+    dates = {}
+
+    for names, expiry_ts, name, value, keys in _TOKEN_RE.findall(output):
+        if name:
+            expiry = dates.get(expiry_ts)
+            if expiry is None:
+                expiry = dates[expiry_ts] = datetime.fromtimestamp(int(expiry_ts)).date()
+
+            class_match = _CLASS_RE.match(name)
+            if class_match is None:
+                # a misc class, e.g. tutoring
+                classes.append(UDBClass(name, expiry))
+            else:
+                degree, course = class_match.groups()
+                if degree:
+                    degrees.append(UDBClass(degree, expiry))
+                else:
+                    courses.append(UDBClass(course, expiry))
+        elif keys:
+            for key in keys.split('|'):
+                if key in _SELECT_KEYS:
+                    strings[_SELECT_KEYS[key]] = value
+        elif usernames_str is None and names:
+            usernames_str = names
+
+    if usernames_str is None:
+        raise UDBParseError('No usernames in UDB response')
+
+    usernames = [s.split('.', 1)[-1] for s in usernames_str.split('|')]
+    zids = [username for username in usernames if _ZID_RE.match(username)]
+    if not zids:
+        raise UDBParseError('No zID in UDB response')
+    zid = zids[0]
+
+    usernames = sorted((s for s in usernames if s != zid), key=_username_key, reverse=True)
+
+    return UDBUser(
+        zid=zid,
+        username=usernames[0] if usernames else zid,
+        usernames=tuple(usernames),
+        given_names=strings['given_names'],
+        surname=strings['surname'],
+        degrees=by_expiry(degrees),
+        courses=by_expiry(courses),
+        classes=by_expiry(classes),
+        expiry=max(dates.values()) if dates else None
+    )
+
+
+def _dump_classes(classes):
+    return [[c.code, c.expiry.toordinal()] for c in classes]
+
+
+def _load_classes(items):
+    return tuple(UDBClass(code, date.fromordinal(expiry)) for code, expiry in items)
+
+
+def dump_user(user):
+    """
+    Serialises a UDBUser to a compact JSON string, so it can be stored.
+    """
+    return json.dumps([
+        user.zid,
+        user.username,
+        list(user.usernames),
+        user.given_names,
+        user.surname,
+        _dump_classes(user.degrees),
+        _dump_classes(user.courses),
+        _dump_classes(user.classes),
+        user.expiry.toordinal() if user.expiry else None
+    ], separators=(',', ':'))
+
+
+def load_user(data):
+    """
+    Turns a string from dump_user back into a UDBUser.
+    """
+    zid, username, usernames, given_names, surname, degrees, courses, classes, expiry = json.loads(data)
+
+    return UDBUser(
+        zid=zid,
+        username=username,
+        usernames=tuple(usernames),
+        given_names=given_names,
+        surname=surname,
+        degrees=_load_classes(degrees),
+        courses=_load_classes(courses),
+        classes=_load_classes(classes),
+        expiry=date.fromordinal(expiry) if expiry is not None else None
+    )
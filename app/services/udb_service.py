@@ -1,114 +1,233 @@
-import re
+import hashlib
+import os
+import random
+import threading
+import time
+from datetime import date, timedelta
+
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
-from datetime import datetime
 import urllib
 
+from app.cache import LRUCache
+from app.metrics import phase
+from app.services.udb_parser import parse_user, UDBParseError, UDBUser, UDBClass, by_expiry
+from app.services.udb_snapshot import SnapshotUDBService, create_udb_snapshot
+
+_MISSING = object()
+
 class UDBService(object):
-    def __init__(self, url, username, password):
+    def __init__(self, url, username, password, timeout=None, pool_size=10, retries=0, retry_backoff=None):
         self._url = url
         self._username = username
         self._password = password
-
-    def cmp_usernames(a, b):
-        if re.match(r'^[a-z]+$', a):
-            return 1
-        elif re.match(r'^[a-z]+$', b):
-            return -1
-
-        return cmp(a, b)
+        self._timeout = timeout.total_seconds() if timeout else None
+        self._pool_size = pool_size
+        self._retries = retries
+        self._retry_backoff = retry_backoff.total_seconds() if retry_backoff else 0
+
+        self._session = None
+        self._session_pid = None
+        self._session_lock = threading.Lock()
+
+    def _get_session(self):
+        # connections can't be shared across a fork, so each gunicorn worker
+        # builds its own keep-alive session the first time it talks to UDB.
+        # threaded and gevent workers share it between requests
+        pid = os.getpid()
+        with self._session_lock:
+            if self._session is None or self._session_pid != pid:
+                session = requests.Session()
+                session.auth = HTTPBasicAuth(self._username, self._password)
+
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+
+                self._session = session
+                self._session_pid = pid
+            return self._session
 
     def get_data(self, user):
-        r = requests.get(self._url + '?user=' + urllib.quote(user),
-                         auth=HTTPBasicAuth(self._username, self._password))
+        url = self._url + '?user=' + urllib.quote(user)
+
+        # retries have to fit in one timeout, so a scan never waits on UDB
+        # for much longer than that
+        deadline = time.time() + self._timeout if self._timeout else None
+        attempt = 0
+        while True:
+            try:
+                r = self._get_session().get(url, timeout=self._timeout)
+                break
+            except requests.ConnectionError:
+                # the request never reached UDB. timeouts aren't retried: UDB
+                # may be working on it, and asking again waits another timeout
+                delay = self._retry_backoff * 2 ** attempt
+                if attempt >= self._retries or (deadline is not None and time.time() + delay >= deadline):
+                    raise
+
+                # back off exponentially before trying again
+                time.sleep(delay)
+                attempt += 1
+
         if r.status_code != 200:
             return None
         return r.content
 
     def get_user(self, user):
         try:
-            output = self.get_data(user)
+            with phase('udb_fetch'):
+                output = self.get_data(user)
+        except requests.Timeout:
+            raise IOError('Timed out while communicating with UDB')
         except:
             raise IOError('Error while communicating with UDB')
 
         if output is None:
             return None
 
-        select_keys = {
-            'givenname': 'given_names',
-            'surname': 'surname'
-        }
-        data = {key: None for key in select_keys.values()}
+        try:
+            with phase('udb_parse'):
+                return parse_user(output)
+        except UDBParseError:
+            raise IOError('Could not understand the response from UDB')
 
-        # add their usernames
-        usernames_str = re.search(r'uid = \d+ name=([^\s]*)', output).group(1)
-        usernames = [s.split('.', 1)[1] for s in usernames_str.split('|')]
-        zid = [username for username in usernames if re.match(r'^z[0-9]+$', username)][0]
-        usernames = [s for s in usernames if s != zid]
-        usernames.sort(cmp=self.cmp_usernames, reverse=True)
 
-        data['usernames'] = usernames
-        data['username'] = usernames[0] if len(usernames) else zid
-        data['zid'] = zid
+class CachingUDBService(object):
+    """
+    Wraps a UDB service and remembers its answers for a while, so repeat scans
+    of the same student don't wait on a UDB round trip.
 
-        expiries = []
-
-        # get classes
-        degrees = []
-        courses = []
-        classes = []
-        for expiry_ts, name in re.findall(r'<\d+ \(\d+ \d+\) (\d+)> ([^ ]+)', output):
-            expiry_ts = int(expiry_ts)
-            expiry = datetime.fromtimestamp(expiry_ts).date()
-
-            expiries.append(expiry)
-
-            match = re.match('^(\d{4})_Student$', name)
-            if match:
-                # it's a degree
-                degrees.append({
-                    'code': match.group(1),
-                    'expiry': expiry
-                })
-                continue
-
-            match = re.match('^([A-Z]{4}\d{4})_Student$', name)
-            if match:
-                # it's a course
-                courses.append({
-                    'code': match.group(1),
-                    'expiry': expiry
-                })
-                continue
-
-            # if we're still here, it's a misc class, e.g. tutoring
-            classes.append({
-                'name': name,
-                'expiry': expiry
-            })
-
-        # put newest (i.e. expiring latest?) classes first
-        class_sort = lambda x: sorted(x, key=lambda y: y['expiry'], reverse=True)
-
-        data['degrees'] = class_sort(degrees)
-        data['courses'] = class_sort(courses)
-        data['classes'] = class_sort(classes)
-
-        data['expiry'] = max(expiries)
-
-        # get data from strings
-        for value, keys in re.findall(r'<\d+:([^>]*)> ([^\n]*)\n', output, re.DOTALL):
-            keys = keys.split('|')
-            for key in keys:
-                if key in select_keys:
-                    data[select_keys[key]] = value
+    Students that aren't in UDB are cached too, under a separate (usually
+    shorter) TTL. Communication errors are never cached.
+    """
+    def __init__(self, udb_service, max_size, ttl, negative_ttl):
+        self._udb_service = udb_service
+        self._negative_ttl = negative_ttl
+        self._cache = LRUCache(max_size, ttl)
 
+    def get_user(self, user):
+        data = self._cache.get(user, _MISSING)
+        if data is not _MISSING:
+            return data
+
+        data = self._udb_service.get_user(user)
+        if data is None:
+            self._cache.set(user, None, ttl=self._negative_ttl)
+        else:
+            self._cache.set(user, data)
         return data
 
+    def invalidate(self, user):
+        self._cache.pop(user)
+
+    def stats(self):
+        return self._cache.stats()
+
+
+class DummyUDBService(object):
+    """
+    A dummy UDB service that makes up a student for any zID, so check-ins work
+    without network access.
+
+    The same zID always gets the same student: a current degree (sometimes
+    with an older, expired one), a few current and past courses, and a name.
+    A `missing_rate` share of zIDs aren't in UDB at all. Lookups can be slowed
+    down by `latency`, and fail with an IOError `error_rate` of the time.
+    """
+    COURSE_PREFIXES = ['COMP', 'SENG', 'MATH', 'ENGG', 'DESN']
+    GIVEN_NAMES = ['Alex', 'Jamie', 'Sam', 'Jordan', 'Taylor', 'Morgan', 'Casey', 'Riley', 'Avery', 'Quinn']
+    SURNAMES = ['Smith', 'Nguyen', 'Chen', 'Wang', 'Lee', 'Brown', 'Singh', 'Patel', 'Kim', 'Tran']
+
+    def __init__(self, num_degrees=50, num_courses=400, latency=None, error_rate=0, missing_rate=0):
+        self.degree_codes = [str(3000 + i) for i in xrange(num_degrees)]
+        self.course_codes = [
+            '%s%04d' % (self.COURSE_PREFIXES[i % len(self.COURSE_PREFIXES)], 1000 + i // len(self.COURSE_PREFIXES))
+            for i in xrange(num_courses)
+        ]
+        self._latency = latency.total_seconds() if latency else 0
+        self._error_rate = error_rate
+        self._missing_rate = missing_rate
 
-def create_udb_service(config):
-    return UDBService(
-        url=config.UDB_URL,
-        username=config.UDB_USER,
-        password=config.UDB_PASSWORD
-    )
+    def get_user(self, user):
+        with phase('udb_fetch'):
+            if self._latency:
+                time.sleep(self._latency)
+            if self._error_rate and random.random() < self._error_rate:
+                raise IOError('Error while communicating with UDB')
+
+        # seed from the zID itself, so every worker makes up the same student
+        rng = random.Random(int(hashlib.md5(user).hexdigest(), 16))
+        if rng.random() < self._missing_rate:
+            return None
+
+        today = date.today()
+
+        def current():
+            return today + timedelta(days=rng.randint(30, 4 * 365))
+
+        def expired():
+            return today - timedelta(days=rng.randint(30, 4 * 365))
+
+        degrees = [UDBClass(rng.choice(self.degree_codes), current())]
+        if rng.random() < 0.2:
+            degrees.append(UDBClass(rng.choice(self.degree_codes), expired()))
+
+        codes = rng.sample(self.course_codes, min(len(self.course_codes), rng.randint(2, 8)))
+        courses = [UDBClass(code, current() if i < 4 else expired()) for i, code in enumerate(codes)]
+
+        classes = []
+        if rng.random() < 0.1:
+            classes.append(UDBClass('csesoc', current()))
+
+        given_names = rng.choice(self.GIVEN_NAMES)
+        surname = rng.choice(self.SURNAMES)
+        username = (given_names[0] + surname).lower()
+        every_class = degrees + courses + classes
+
+        return UDBUser(
+            zid=user,
+            username=username,
+            usernames=(username,),
+            given_names=given_names,
+            surname=surname,
+            degrees=by_expiry(degrees),
+            courses=by_expiry(courses),
+            classes=by_expiry(classes),
+            expiry=max(c.expiry for c in every_class)
+        )
+
+
+def create_udb_service(app, config):
+    if config.USE_FAKE_UDB:
+        udb_service = DummyUDBService(
+            num_degrees=config.FAKE_UDB_DEGREES,
+            num_courses=config.FAKE_UDB_COURSES,
+            latency=config.FAKE_UDB_LATENCY,
+            error_rate=config.FAKE_UDB_ERROR_RATE,
+            missing_rate=config.FAKE_UDB_MISSING_RATE
+        )
+    else:
+        udb_service = UDBService(
+            url=config.UDB_URL,
+            username=config.UDB_USER,
+            password=config.UDB_PASSWORD,
+            timeout=config.UDB_TIMEOUT,
+            pool_size=config.UDB_POOL_SIZE,
+            retries=config.UDB_RETRIES,
+            retry_backoff=config.UDB_RETRY_BACKOFF
+        )
+
+    if config.UDB_SNAPSHOT_ENABLED:
+        udb_service = SnapshotUDBService(udb_service, create_udb_snapshot(app, config))
+
+    if config.UDB_CACHE_ENABLED:
+        udb_service = CachingUDBService(
+            udb_service,
+            max_size=config.UDB_CACHE_SIZE,
+            ttl=config.UDB_CACHE_TTL,
+            negative_ttl=config.UDB_CACHE_NEGATIVE_TTL
+        )
+
+    return udb_service
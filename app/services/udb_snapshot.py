@@ -0,0 +1,138 @@
+import os
+import sqlite3
+import threading
+import time
+
+from app.metrics import phase
+from app.services.udb_parser import dump_user, load_user
+
+_SCHEMA = [
+    # user_info is NULL for students UDB doesn't know about
+    '''CREATE TABLE IF NOT EXISTS udb_user (
+        zid TEXT PRIMARY KEY,
+        user_info TEXT,
+        fetched REAL NOT NULL
+    )'''
+]
+
+_MISSING = object()
+
+
+class UDBSnapshot(object):
+    """
+    A copy of what UDB said about each student, kept in a local SQLite file
+    so check-ins can be answered while UDB is slow or down. It is filled by
+    prefetch_udb.py; entries older than `max_age` are left out, unless UDB
+    can't be reached, and are only deleted once older than `retention`.
+    """
+    def __init__(self, path, max_age, retention, timeout):
+        self._path = path
+        self._max_age = max_age.total_seconds()
+        self._retention = retention.total_seconds()
+        self._timeout = timeout.total_seconds()
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._schema_pid = None
+
+    def _connect(self):
+        # sqlite connections can't be shared between threads or processes
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            conn = sqlite3.connect(self._path, timeout=self._timeout, isolation_level=None)
+            with self._lock:
+                if self._schema_pid != pid:
+                    conn.execute('PRAGMA journal_mode=WAL')
+                    for statement in _SCHEMA:
+                        conn.execute(statement)
+                    self._schema_pid = pid
+            self._local.conn = conn
+            self._local.pid = pid
+        return self._local.conn
+
+    def get(self, zid, max_age=None):
+        """
+        Returns the stored UDBUser for `zid`, None if UDB didn't know them, or
+        _MISSING if they aren't in the snapshot or their entry is older than
+        `max_age` seconds (by default the snapshot's).
+        """
+        if max_age is None:
+            max_age = self._max_age
+
+        row = self._connect().execute(
+            'SELECT user_info FROM udb_user WHERE zid = ? AND fetched >= ?', (zid, time.time() - max_age)
+        ).fetchone()
+        if row is None:
+            return _MISSING
+        return load_user(row[0]) if row[0] is not None else None
+
+    def put_many(self, users):
+        """
+        Stores (zid, UDBUser or None) pairs, replacing older entries.
+        """
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT OR REPLACE INTO udb_user (zid, user_info, fetched) VALUES (?, ?, ?)',
+                [(zid, dump_user(user) if user is not None else None, now) for zid, user in users]
+            )
+            conn.execute('COMMIT')
+        except:
+            conn.execute('ROLLBACK')
+            raise
+
+    def prune(self):
+        """
+        Deletes entries older than the retention, which are too old even to
+        fall back on. Returns how many there were.
+        """
+        return self._connect().execute(
+            'DELETE FROM udb_user WHERE fetched < ?', (time.time() - self._retention,)
+        ).rowcount
+
+    def count(self):
+        return self._connect().execute(
+            'SELECT COUNT(*) FROM udb_user WHERE fetched >= ?', (time.time() - self._max_age,)
+        ).fetchone()[0]
+
+
+class SnapshotUDBService(object):
+    """
+    Wraps a UDB service, answering from a UDBSnapshot first and only asking
+    UDB about students that aren't in it. Students UDB didn't know about when
+    the snapshot was filled are asked about again, since they may have
+    enrolled since; that UDB didn't know them is only used if it can't be
+    reached.
+
+    If UDB can't be reached, an entry too old to be used normally is still
+    better than failing the scan, since the degree and course expiry dates
+    it holds still decide whether the student is from CSE.
+    """
+    def __init__(self, udb_service, snapshot):
+        self._udb_service = udb_service
+        self._snapshot = snapshot
+
+    def get_user(self, user):
+        with phase('udb_snapshot'):
+            data = self._snapshot.get(user)
+        if data is not _MISSING and data is not None:
+            return data
+
+        try:
+            return self._udb_service.get_user(user)
+        except IOError:
+            data = self._snapshot.get(user, max_age=float('inf'))
+            if data is _MISSING:
+                raise
+            return data
+
+
+def create_udb_snapshot(app, config):
+    return UDBSnapshot(
+        os.path.join(app.root_path, config.UDB_SNAPSHOT_PATH),
+        max_age=config.UDB_SNAPSHOT_MAX_AGE,
+        retention=config.UDB_SNAPSHOT_RETENTION,
+        timeout=config.UDB_TIMEOUT
+    )
@@ -0,0 +1,26 @@
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+
+
+class LazyThreadPool(object):
+    """
+    A thread pool that is only started when first used.
+
+    Threads don't survive a fork, so a pool created before gunicorn forks its
+    workers would be useless in them. Instead each process starts its own pool
+    the first time it asks for one.
+    """
+    def __init__(self, size):
+        self._size = size
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        pid = os.getpid()
+        with self._lock:
+            if self._pool is None or self._pid != pid:
+                self._pool = ThreadPool(self._size)
+                self._pid = pid
+            return self._pool
@@ -8,6 +8,9 @@ from .courses_view import CoursesView
 from .degrees_view import DegreesView
 from .enrolments_view import EnrolmentsView
 from .events_view import EventsView
+from .live_view import LiveView
+from .metrics_view import MetricsView
+from .qr_code_view import QRCodeView
 from .reports_view import ReportsView
 from .students_view import StudentsView
 from .users_view import UsersView
@@ -10,9 +10,10 @@ class LoginForm(Form):
     zid = fields.TextField('zID', validators=[validators.required()])
     password = fields.PasswordField('Password', validators=[validators.required()])
 
-    def __init__(self, ldap_service, *args, **kwargs):
+    def __init__(self, ldap_service, user_cache, *args, **kwargs):
         super(LoginForm, self).__init__(*args, **kwargs)
         self._ldap_service = ldap_service
+        self._user_cache = user_cache
 
     def validate_zid(self, field):
         user = self.get_user()
@@ -24,19 +25,25 @@ class LoginForm(Form):
         if not user_data:
             raise validators.ValidationError('Invalid zID/password')
 
-        # set user data
-        user.first_name = user_data['first_name']
-        user.last_name = user_data['last_name']
-        db.session.commit()
+        # update user data, if it changed
+        names = (user_data['first_name'], user_data['last_name'])
+        if (user.first_name, user.last_name) != names:
+            user.first_name, user.last_name = names
+            db.session.commit()
+            self._user_cache.pop(user.id)
 
     def get_user(self):
-        return db.session.query(User).filter_by(zid=self.zid.data).first()
+        # validate_zid and login_view both want the user, only look it up once
+        if getattr(self, '_user', None) is None:
+            self._user = db.session.query(User).filter_by(zid=self.zid.data).first()
+        return self._user
 
 
 class AdminIndexView(BaseAdminIndexView):
-    def __init__(self, ldap_service, *args, **kwargs):
+    def __init__(self, ldap_service, user_cache, *args, **kwargs):
         super(AdminIndexView, self).__init__(*args, **kwargs)
         self._ldap_service = ldap_service
+        self._user_cache = user_cache
 
     @expose('/')
     def index(self):
@@ -46,7 +53,7 @@ class AdminIndexView(BaseAdminIndexView):
 
     @expose('/login/', methods=('GET', 'POST'))
     def login_view(self):
-        form = LoginForm(self._ldap_service, request.form)
+        form = LoginForm(self._ldap_service, self._user_cache, request.form)
         if helpers.validate_form_on_submit(form):
             user = form.get_user()
             login_user(user)
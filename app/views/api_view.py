@@ -3,25 +3,45 @@ import re
 import time
 from datetime import datetime
 
-import requests
-from flask import request
+from flask import current_app, request
 from flask.views import MethodView
+from sqlalchemy.exc import IntegrityError
 
-from app.db import Event, Student, CheckIn, Degree, Course, Enrolment, db
+from app.check_ins import BarkError, record_check_in
+from app.event_stats import add_arc_change, get_event_stats
+from app.db import Student, db
+from app.live_feed import check_in_message
+from app.metrics import phase
 
-
-class BarkError(Exception):
-    pass
+ACTIONS = ['check_in', 'check_in_batch', 'update_arc', 'get_event_info']
 
 
 class ApiView(MethodView):
-    def __init__(self, udb_service, event_leeway):
-        self._event_leeway = event_leeway
+    def __init__(self, udb_service, handbook_resolver, event_index, udb_pool, max_batch_size, max_scan_age,
+                 max_clock_skew, metrics, check_in_queue=None, live_feed=None):
+        self._event_index = event_index
         self._udb_service = udb_service
+        self._handbook_resolver = handbook_resolver
+        self._udb_pool = udb_pool
+        self._max_batch_size = max_batch_size
+        self._max_scan_age = max_scan_age
+        self._max_clock_skew = max_clock_skew
+        self._metrics = metrics
+        self._check_in_queue = check_in_queue
+        self._live_feed = live_feed
+
+        # degrees and courses whose names should be looked up once we commit
+        self._new_degrees = []
+        self._new_courses = []
+        # check-ins to pass on to dashboards once we commit
+        self._written = []
 
     def post(self):
+        self._metrics.start_request()
+
         success = True
         error = None
+        action = None
 
         resp = {}
 
@@ -39,16 +59,13 @@ class ApiView(MethodView):
             token = data['token']
 
             # check token against events
-            results = Event.query.filter(Event.token == token).all()
-            if len(results):
-                # woo, match
-                event = results[0]
-            else:
+            with phase('token_lookup'):
+                event = self._event_index.get(token)
+            if event is None:
                 raise BarkError('Invalid token')
 
             # check if event is currently running
-            now = datetime.now()
-            running = (event.start - self._event_leeway <= now and now <= event.end + self._event_leeway)
+            running = self._event_index.is_running(event)
 
             # check action
             if 'action' not in data:
@@ -60,125 +77,24 @@ class ApiView(MethodView):
                 if not running:
                     raise BarkError('Event is not currently running')
 
-                # check zid
-                zid = data['zid']
-                if not validate_zid(zid):
-                    raise BarkError('zID is not valid')
-
-                max_scans = data['max_scans']
-                if type(max_scans) is not int or max_scans < 1:
-                    raise BarkError('Max scans is not valid')
+                zid, max_scans = validate_check_in(data)
 
                 user_info = self._udb_service.get_user(zid)
+                resp, = self._check_in(event, [(zid, max_scans, user_info, datetime.now())])
+                if isinstance(resp, BarkError):
+                    raise resp
 
-                if user_info:
-                    results = Student.query.filter(Student.zid == zid).all()
-                    if len(results):
-                        # student exists in the system
-                        student = results[0]
-                    else:
-                        # student doesn't exist in the system
-                        student = Student()
-                        student.zid = zid
-                        student.given_names = user_info['given_names']
-                        student.surname = user_info['surname']
-                else:
-                    # student doesn't exist in UDB
-                    student = Student()
-                    student.zid = zid
-                    student.given_names = 'Unknown'
-                    student.surname = 'Student'
-
-                # look up check-in
-                check_in = CheckIn.query.filter(CheckIn.student == student).filter(CheckIn.event == event).first()
-                if check_in:
-                    # check-in already exists
-                    if check_in.number_of_scans + 1 > max_scans:
-                        if check_in.number_of_scans == 1:
-                            s = 'once'
-                        elif check_in.number_of_scans == 2:
-                            s = 'twice'
-                        else:
-                            s = '%d times' % check_in.number_of_scans
-
-                        raise BarkError('Student has already checked in ' + s)
-
-                    check_in.number_of_scans += 1
-                else:
-                    # check-in doesn't exist
-                    check_in = CheckIn()
-                    check_in.student = student
-                    check_in.event = event
-
-                    if user_info and len(user_info['degrees']):
-                        degree_info = max(user_info['degrees'], key=lambda deg: deg['expiry'])
-                    else:
-                        # no degree. might be doing COMP as a gened or something
-                        degree_info = {'code': 0, 'expiry': datetime.fromtimestamp(0).date()}
-
-                    courses_info = user_info['courses'] if user_info else []
-
-                    expiry = datetime.fromtimestamp(0).date()  # max(expiry of all degrees & courses)
-
-                    # handle degree
-                    results = Degree.query.filter(Degree.code == degree_info['code']).all()
-                    if len(results):
-                        # degree exists
-                        degree = results[0]
-                    else:
-                        # degree doesn't exist
-                        degree = Degree()
-                        degree.code = degree_info['code']
-                        degree.name = degree_name(degree_info['code'])
-                        degree.is_cse = True  # TODO: wat
-
-                    expiry = max(expiry, degree_info['expiry'])
-
-                    check_in.degree = degree
-
-                    # handle courses
-                    for course_info in courses_info:
-                        results = Course.query.filter(Course.code == course_info['code']).all()
-                        if len(results):
-                            # course exists
-                            course = results[0]
-                        else:
-                            # course doesn't exist
-                            course = Course()
-                            course.code = course_info['code']
-                            course.name = course_name(course_info['code'])
-
-                        expiry = max(expiry, course_info['expiry'])
-
-                        # create enrolment entry
-                        enrolment = Enrolment()
-                        enrolment.check_in = check_in
-                        enrolment.course = course
-
-                    if expiry > datetime.now().date() or student.override_cse:
-                        check_in.is_cse = True
-                    else:
-                        check_in.is_cse = False
-
-                resp['name'] = '%s %s' % (student.given_names, student.surname)
-                resp['num_scans'] = check_in.number_of_scans
-                resp['is_arc'] = student.is_arc
-                resp['is_cse'] = check_in.is_cse
-
-                resp['degree'] = unicode(check_in.degree)
-                if student.override_cse:
-                    resp['degree'] += ' (Overridden)'
-
-                courses = []
-                for enrolment in check_in.enrolments:
-                    courses.append(unicode(enrolment.course))
-                resp['courses'] = courses
-
-                if not check_in.is_cse and event.check_cse:
-                    # discard the check in and student details
-                    db.session.expunge(check_in)
-                    db.session.expunge(student)
-                db.session.commit()
+                with phase('commit'):
+                    db.session.commit()
+                self._resolve_names()
+                self._publish(event)
+            elif action == 'check_in_batch':
+                resp['results'] = self._check_in_batch(event, data)
+
+                with phase('commit'):
+                    db.session.commit()
+                self._resolve_names()
+                self._publish(event)
             elif action == 'update_arc':
                 # event must be running
                 if not running:
@@ -197,13 +113,21 @@ class ApiView(MethodView):
                     raise BarkError('is_arc should be a boolean')
 
                 results = Student.query.filter(Student.zid == zid).all()
+                if not len(results) and self._check_in_queue is not None and self._check_in_queue.flush():
+                    # their first check-in might still be queued
+                    results = Student.query.filter(Student.zid == zid).all()
+
                 if len(results):
                     # student exists in the system
                     student = results[0]
 
+                    if bool(student.is_arc) != is_arc:
+                        add_arc_change(student.id, is_arc)
                     student.is_arc = is_arc
 
                     db.session.commit()
+                    if self._live_feed is not None:
+                        self._live_feed.publish(event.id, 'arc', [{'zid': zid, 'is_arc': is_arc}])
                 else:
                     raise BarkError('Student has not checked in before')
             elif action == 'get_event_info':
@@ -212,6 +136,15 @@ class ApiView(MethodView):
                 resp['start_time'] = time.mktime(event.start.timetuple())
                 resp['end_time'] = time.mktime(event.end.timetuple())
                 resp['running'] = running
+
+                stats = get_event_stats(event.id)
+                resp['attendance'] = {
+                    'check_ins': stats['check_ins'],
+                    'cse': stats['cse'],
+                    'non_cse': stats['check_ins'] - stats['cse'],
+                    'arc': stats['arc'],
+                    'scans': stats['scans']
+                }
             else:
                 raise BarkError('Invalid action')
 
@@ -221,6 +154,18 @@ class ApiView(MethodView):
         except IOError as e:
             success = False
             error = e.message
+        except IntegrityError:
+            # another worker created the same student, degree, course or
+            # check-in between our lookup and our commit
+            db.session.rollback()
+            success = False
+            error = 'Student was scanned twice at once, please scan again'
+        except Exception:
+            # counted as a failed request on its way to becoming a 500
+            success = False
+            raise
+        finally:
+            self._metrics.finish_request(action if action in ACTIONS else 'invalid', success)
 
         if not success:
             resp = {}
@@ -230,31 +175,164 @@ class ApiView(MethodView):
 
         return json.dumps(resp)
 
+    def _check_in(self, event, scans):
+        """
+        Records scans at `event`, given as (zid, max_scans, user_info,
+        scanned_at) tuples, without committing. Returns the response for each
+        scan, or the BarkError it was refused with before anything was
+        written for it.
+
+        In write-behind mode the scans are queued instead, and answered
+        without waiting for them to be written. The queue passes them on to
+        dashboards once they are, so the counters sent along take them in.
+        """
+        if self._check_in_queue is not None:
+            with phase('queue'):
+                return self._check_in_queue.put_many(event, scans)
+
+        results = []
+        for zid, max_scans, user_info, scanned_at in scans:
+            try:
+                resp = record_check_in(
+                    event.id, event.check_cse, zid, max_scans, user_info, scanned_at,
+                    self._new_degrees, self._new_courses
+                )
+            except BarkError as e:
+                results.append(e)
+                continue
+            results.append(resp)
+
+            # the session doesn't autoflush, so flush for later scans of the
+            # same student to see this one
+            db.session.flush()
+
+            if resp['is_cse'] or not event.check_cse:
+                # passed on to dashboards once committed; discarded scans aren't
+                self._written.append(check_in_message(zid, resp, scanned_at))
+        return results
+
+    def _check_in_batch(self, event, data):
+        """
+        Records a list of scans, e.g. ones a scanner queued while it was
+        offline. Each scan gets its own result in the same format as a single
+        check-in; the caller commits them all together.
+        """
+        entries = data.get('check_ins')
+        if type(entries) is not list:
+            raise BarkError('check_ins should be a list')
+        if len(entries) > self._max_batch_size:
+            raise BarkError('Too many check-ins in one batch (at most %d)' % self._max_batch_size)
+
+        # validate everything first so UDB is only asked about valid scans
+        scans = []
+        for entry in entries:
+            try:
+                if type(entry) is not dict:
+                    raise BarkError('Check-in should be an object')
+
+                zid, max_scans = validate_check_in(entry)
+                scanned_at = validate_scanned_at(entry, self._max_scan_age, self._max_clock_skew)
+
+                if not self._event_index.is_running(event, scanned_at):
+                    raise BarkError('Event was not running when scanned')
+
+                scans.append((zid, max_scans, scanned_at, None))
+            except BarkError as e:
+                scans.append((None, None, None, e.message))
+
+        # look up every student in UDB at the same time
+        zids = list(set(zid for zid, _, _, error in scans if error is None))
+        app = current_app._get_current_object()
+        with phase('udb_fetch'):
+            user_infos = dict(zip(zids, self._udb_pool.get().map(lambda zid: self._get_user(app, zid), zids)))
+
+        # then check in everyone who was found, all together
+        to_check_in = []
+        for i, (zid, max_scans, scanned_at, error) in enumerate(scans):
+            if error is None and isinstance(user_infos[zid], IOError):
+                scans[i] = (zid, max_scans, scanned_at, user_infos[zid].message)
+            elif error is None:
+                to_check_in.append((zid, max_scans, user_infos[zid], scanned_at))
+        checked_in = iter(self._check_in(event, to_check_in))
+
+        results = []
+        for zid, max_scans, scanned_at, error in scans:
+            if error is None:
+                resp = next(checked_in)
+                if isinstance(resp, BarkError):
+                    error = resp.message
+                else:
+                    resp['success'] = True
+                    results.append(resp)
+                    continue
+
+            results.append({'error': error, 'success': False})
+
+        return results
+
+    def _get_user(self, app, zid):
+        # runs in the pool's threads, which don't have the request's context.
+        # hand errors back rather than raising them, so one failed lookup
+        # doesn't fail the whole batch
+        with app.app_context():
+            try:
+                return self._udb_service.get_user(zid)
+            except IOError as e:
+                return e
+
+    def _publish(self, event):
+        if self._live_feed is not None:
+            self._live_feed.publish(event.id, 'check_in', self._written)
+
+    def _resolve_names(self):
+        with phase('handbook'):
+            for code in set(self._new_degrees):
+                self._handbook_resolver.resolve_degree(code)
+            for code in set(self._new_courses):
+                self._handbook_resolver.resolve_course(code)
+
 
 def validate_zid(zid):
     return re.match(r'^z[0-9]{7}$', zid) is not None
 
 
-def degree_name(code):
-    if code == 0:
-        return 'Non-CSE degree'
+def validate_check_in(data):
+    if 'zid' not in data:
+        raise BarkError('zID is missing')
+
+    # check zid
+    zid = data['zid']
+    if not isinstance(zid, basestring) or not validate_zid(zid):
+        raise BarkError('zID is not valid')
+
+    if 'max_scans' not in data:
+        raise BarkError('Max scans is missing')
+
+    max_scans = data['max_scans']
+    if type(max_scans) is not int or max_scans < 1:
+        raise BarkError('Max scans is not valid')
+
+    return zid, max_scans
 
-    for u in ('undergraduate', 'postgraduate', 'research'):
-        url = 'http://www.handbook.unsw.edu.au/%s/programs/current/%s.html' % (u, code)
-        r = requests.get(url)
-        content = r.content
 
-        match = re.search(r'<meta name="DC\.Subject\.Title" CONTENT="(.*?)">', content)
-        if match:
-            return match.group(1).strip()
+def validate_scanned_at(data, max_age, max_clock_skew):
+    now = datetime.now()
+    scanned_at = data.get('scanned_at')
+    if scanned_at is None:
+        return now
 
+    if type(scanned_at) not in (int, float):
+        raise BarkError('scanned_at is not valid')
 
-def course_name(code):
-    for u in ('undergraduate', 'postgraduate'):
-        url = 'http://www.handbook.unsw.edu.au/%s/courses/current/%s.html' % (u, code)
-        r = requests.get(url)
-        content = r.content
+    try:
+        scanned_at = datetime.fromtimestamp(scanned_at)
+    except (ValueError, OverflowError):
+        raise BarkError('scanned_at is not valid')
 
-        match = re.search(r'<meta name="DC\.Subject\.Description\.Short" CONTENT="(.*?)">', content)
-        if match:
-            return match.group(1).strip()
+    # the scanner's clock decides which event window the scan falls in, so
+    # it can only be trusted so far
+    if scanned_at > now + max_clock_skew:
+        raise BarkError('scanned_at is in the future')
+    if scanned_at < now - max_age:
+        raise BarkError('scanned_at is too long ago')
+    return scanned_at
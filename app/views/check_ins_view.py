@@ -1,6 +1,9 @@
+from flask import g
 from flask_admin.contrib.sqla import ModelView
 from flask_login import current_user
+from sqlalchemy import false, or_
 
+from app.cache import LRUCache
 from app.db import CheckIn
 from .formatters import DEFAULT_FORMATTERS
 
@@ -36,8 +39,95 @@ class CheckInsView(ModelView):
 
     column_default_sort = ('timestamp', True)
 
+    # load these in the same query as the page of check-ins
+    column_select_related_list = [CheckIn.student, CheckIn.event, CheckIn.degree]
+
     def is_accessible(self):
         return current_user.is_authenticated()
 
-    def __init__(self, session, **kwargs):
+    def __init__(self, session, cache_ttl, **kwargs):
         super(CheckInsView, self).__init__(CheckIn, session, **kwargs)
+        # per search and filters: how many check-ins match, and the
+        # (timestamp, id) each page visited so far starts after
+        self._counts = LRUCache(256, cache_ttl)
+        self._page_starts = LRUCache(4096, cache_ttl)
+
+    def get_count_query(self):
+        query = super(CheckInsView, self).get_count_query()
+        if g.get('check_in_count_cached'):
+            # ModelView.get_list counts every time; _list has the count
+            # already, so make that a query that stops straight away
+            query = query.filter(false())
+        return query
+
+    def get_list(self, page, sort_column, sort_desc, search, filters, execute=True):
+        """
+        Pages through check-ins sorted by time by seeking past the last
+        (timestamp, id) of the page before, rather than with OFFSET, and
+        caches the total count for a while instead of counting every page.
+
+        Page numbers come from the URL, so the start of each page visited is
+        remembered. A page whose start isn't known seeks to the nearest one
+        before it that is, and skips the rest with OFFSET. Lists sorted by
+        anything else are left to flask-admin, apart from the count.
+        """
+        if sort_column not in (None, 'timestamp'):
+            return self._list(page, sort_column, sort_desc, search, filters, execute)
+        if sort_column is None:
+            sort_desc = True
+        page = page or 0
+
+        # flask-admin applies the search terms and filters, and loads the
+        # related rows in the same query; its order and paging are replaced
+        count, query = self._list(None, None, sort_desc, search, filters, False)
+        query = query.limit(None).order_by(None)
+        key = (search, tuple(filters or ()), bool(sort_desc))
+
+        if sort_desc:
+            query = query.order_by(CheckIn.timestamp.desc(), CheckIn.id.desc())
+        else:
+            query = query.order_by(CheckIn.timestamp, CheckIn.id)
+
+        seek_page = 0
+        for known in xrange(page, 0, -1):
+            start = self._page_starts.get(key + (known,))
+            if start is not None:
+                seek_page = known
+                timestamp, id_ = start
+                # written so the timestamp bound can seek the index
+                if sort_desc:
+                    query = query.filter(CheckIn.timestamp <= timestamp,
+                                         or_(CheckIn.timestamp < timestamp, CheckIn.id < id_))
+                else:
+                    query = query.filter(CheckIn.timestamp >= timestamp,
+                                         or_(CheckIn.timestamp > timestamp, CheckIn.id > id_))
+                break
+
+        if page > seek_page:
+            query = query.offset((page - seek_page) * self.page_size)
+        query = query.limit(self.page_size)
+
+        if execute:
+            query = query.all()
+            if len(query) == self.page_size:
+                last = query[-1]
+                self._page_starts.set(key + (page + 1,), (last.timestamp, last.id))
+
+        return count, query
+
+    def _list(self, page, sort_column, sort_desc, search, filters, execute):
+        # ModelView.get_list, with the count cached per search and filters
+        key = (search, tuple(filters or ()))
+        count = self._counts.get(key)
+
+        g.check_in_count_cached = count is not None
+        try:
+            counted, query = super(CheckInsView, self).get_list(page, sort_column, sort_desc, search, filters,
+                                                                execute)
+        finally:
+            g.check_in_count_cached = False
+
+        if count is None:
+            count = counted
+            self._counts.set(key, count)
+        return count, query
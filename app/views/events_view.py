@@ -21,9 +21,17 @@ class EventsView(ModelView):
         'check_cse',
         'check_arc',
         'timestamp',
+        'attendance',
         # 'token',
     ]
 
+    # load the counters in the same query as the events
+    column_select_related_list = ['category', 'stats']
+
+    column_formatters = {
+        'attendance': lambda view, context, model, name: format_attendance(model.stats)
+    }
+
     column_labels = {
         'start': 'Start Time',
         'end': 'End Time',
@@ -46,8 +54,17 @@ class EventsView(ModelView):
 
     form_excluded_columns = [
         'timestamp',
-        'sessions'
+        'sessions',
+        'stats'
     ]
 
     def __init__(self, session, **kwargs):
+        # saving an event bumps EventsVersion, which tells every worker's
+        # EventIndex to reload
         super(EventsView, self).__init__(Event, session, **kwargs)
+
+
+def format_attendance(stats):
+    if stats is None:
+        return ''
+    return '%d (%d CSE, %d ARC, %d scans)' % (stats.check_ins, stats.cse, stats.arc, stats.scans)
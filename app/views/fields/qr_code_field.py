@@ -1,9 +1,6 @@
-import StringIO
-import base64
 import os
 
-import qrcode
-
+from flask import url_for
 from wtforms import fields
 from wtforms.widgets import HTMLString
 
@@ -14,13 +11,8 @@ class QRCodeWidget(object):
             kwargs['value'] = field._value()
 
         if kwargs['value']:
-            img = qrcode.make(kwargs['value'])
-            output = StringIO.StringIO()
-            img.save(output, 'PNG')
-            data = output.getvalue()
-            output.close()
-
-            uri = 'data:image/gif;base64,%s' % base64.b64encode(data)
+            # served (and cached) by QRCodeView rather than drawn inline
+            uri = url_for('qr-code', token=kwargs['value'], fmt='svg', size=20)
 
             img_str = '<img src="%s">' % uri
             caption_str = '<br>Data: "' + kwargs['value'] + '"'
@@ -0,0 +1,69 @@
+import json
+import Queue
+import time
+
+from flask import Response, abort, request
+from flask.views import MethodView
+from flask_login import current_user
+
+from app.db import Event
+from app.event_stats import get_event_stats
+
+
+class LiveView(MethodView):
+    """
+    Streams an event's check-ins and counters to a dashboard as server-sent
+    events, as they are written.
+
+    Each stream holds a worker (or a thread or greenlet of one) while it is
+    open, so it ends after `duration`; browsers reconnect on their own, and
+    are sent what they missed in between.
+    """
+    def __init__(self, live_feed, duration, heartbeat):
+        self._live_feed = live_feed
+        self._duration = duration.total_seconds()
+        self._heartbeat = heartbeat.total_seconds()
+
+    def get(self, event_id):
+        if self._live_feed is None:
+            abort(404)
+        if not current_user.is_authenticated():
+            abort(403)
+        if Event.query.get(event_id) is None:
+            abort(404)
+
+        try:
+            last_id = int(request.headers['Last-Event-ID'])
+        except (KeyError, ValueError):
+            last_id = None
+
+        stats = get_event_stats(event_id)
+        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        return Response(self._stream(event_id, last_id, stats), mimetype='text/event-stream', headers=headers)
+
+    def _stream(self, event_id, last_id, stats):
+        deadline = time.time() + self._duration
+        queue = None
+        try:
+            # subscribed here rather than in get: a generator closed before it
+            # starts never runs its finally, which would leave the event watched
+            queue = self._live_feed.subscribe(event_id, last_id)
+
+            yield 'retry: 2000\n'
+            yield 'event: stats\ndata: %s\n\n' % json.dumps(stats)
+
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+
+                try:
+                    id_, kind, data = queue.get(timeout=min(self._heartbeat, remaining))
+                except Queue.Empty:
+                    # keeps proxies from closing a quiet connection
+                    yield ': keep-alive\n\n'
+                    continue
+                yield 'id: %d\nevent: %s\ndata: %s\n\n' % (id_, kind, data)
+        finally:
+            if queue is not None:
+                self._live_feed.unsubscribe(event_id, queue)
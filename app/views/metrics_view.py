@@ -0,0 +1,30 @@
+import hmac
+
+from flask import Response, abort, request
+from flask.views import MethodView
+from flask_login import current_user
+
+
+class MetricsView(MethodView):
+    """
+    Serves API timings for Prometheus to scrape, to logged in users or to
+    requests bearing `token`.
+    """
+    def __init__(self, metrics, token=None):
+        self._metrics = metrics
+        self._token = token
+
+    def get(self):
+        if not self._metrics.enabled:
+            abort(404)
+        if not current_user.is_authenticated() and not self._has_token():
+            abort(403)
+        return Response(self._metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    def _has_token(self):
+        if not self._token:
+            return False
+        header = request.headers.get('Authorization', '')
+        if not header.startswith('Bearer '):
+            return False
+        return hmac.compare_digest(str(header[len('Bearer '):]), str(self._token))
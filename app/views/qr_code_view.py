@@ -0,0 +1,78 @@
+import StringIO
+import hashlib
+
+import qrcode
+import qrcode.image.svg
+from flask import request, abort, Response
+from flask.views import MethodView
+from flask_login import current_user
+
+FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml'
+}
+
+DEFAULT_SIZE = 10
+MAX_SIZE = 40
+
+
+class QRCodeView(MethodView):
+    """
+    Serves the QR code for an event's token, e.g. /qr/<token>.svg?size=20
+    where size is the width of each module in pixels (tenths of a millimetre
+    for SVG).
+
+    Only logged in users can see them, since a token is all a scanner needs
+    to check students in. Tokens never change, so rendered images are kept
+    in a bounded cache and browsers are told they can keep them too.
+    """
+    def __init__(self, event_index, cache, max_age):
+        self._event_index = event_index
+        self._cache = cache
+        self._max_age = int(max_age.total_seconds())
+
+    def get(self, token, fmt):
+        if not current_user.is_authenticated():
+            abort(403)
+        if fmt not in FORMATS:
+            abort(404)
+
+        size = request.args.get('size', DEFAULT_SIZE, type=int)
+        if size < 1 or size > MAX_SIZE:
+            abort(400)
+
+        # only draw codes for real events
+        if self._event_index.get(token) is None:
+            abort(404)
+
+        key = (token, fmt, size)
+        etag = hashlib.sha1('%s:%s:%d' % key).hexdigest()
+
+        if etag in request.if_none_match:
+            response = Response(status=304)
+        else:
+            data = self._cache.get(key)
+            if data is None:
+                data = render_qr_code(token, fmt, size)
+                self._cache.set(key, data)
+            response = Response(data, mimetype=FORMATS[fmt])
+
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.max_age = self._max_age
+        return response
+
+
+def render_qr_code(data, fmt, size):
+    output = StringIO.StringIO()
+
+    if fmt == 'svg':
+        img = qrcode.make(data, image_factory=qrcode.image.svg.SvgPathImage, box_size=size)
+        img.save(output)
+    else:
+        img = qrcode.make(data, box_size=size)
+        img.save(output, 'PNG')
+
+    data = output.getvalue()
+    output.close()
+    return data
@@ -1,22 +1,66 @@
 import StringIO
 import csv
 import re
+from datetime import datetime, time, timedelta
 
-from flask import request, Response
+from flask import request, Response, stream_with_context
 from flask_admin import BaseView, expose
 from flask_login import current_user
+from sqlalchemy import func, distinct, case
 
-from app.db import Event, CheckIn
+from app.cache import LRUCache
+from app.db import db, Event, Category, CheckIn, Student, Degree, Course, Enrolment
+
+# columns that can be added to the CSV export on top of the default ones
+OPTIONAL_COLUMNS = ['degree', 'is_cse', 'number_of_scans', 'courses']
+
+CHUNK_SIZE = 1000
+
+# what aggregate reports can be grouped by
+GROUP_BY = ['event', 'category', 'degree', 'course', 'day']
 
 
 class ReportsView(BaseView):
+    def __init__(self, cache_ttl, **kwargs):
+        super(ReportsView, self).__init__(**kwargs)
+        self._cache = LRUCache(256, cache_ttl)
+
     def is_accessible(self):
         return current_user.is_authenticated()
 
     @expose('/')
     def index(self):
         events = Event.query.order_by(Event.start.desc())
-        return self.render('admin/reports.html', events=events)
+        categories = Category.query.order_by(Category.name)
+        return self.render('admin/reports.html', events=events, categories=categories,
+                           optional_columns=OPTIONAL_COLUMNS, group_by=GROUP_BY)
+
+    @expose('/aggregate')
+    def aggregate(self):
+        group_by = request.args.get('group_by')
+        if group_by not in GROUP_BY:
+            return 'u wot m8'
+
+        try:
+            start = parse_date(request.args.get('start'))
+            end = parse_date(request.args.get('end'))
+            category_id = int(request.args['category']) if request.args.get('category') else None
+        except ValueError:
+            return 'u wot m8'
+
+        # the newest check-in id changes whenever a check-in arrives, which
+        # invalidates every cached report; repeat scans wait out the TTL
+        version = db.session.query(func.max(CheckIn.id)).scalar()
+        key = (group_by, start, end, category_id, version)
+
+        rows = self._cache.get(key)
+        if rows is None:
+            rows = aggregate_check_ins(group_by, start, end, category_id)
+            self._cache.set(key, rows)
+
+        category = Category.query.get(category_id) if category_id else None
+        return self.render('admin/aggregate_report.html', rows=rows, group_by=group_by,
+                           start=start, end=end, category=category)
 
     @expose('/csv', methods=['POST'])
     def csv(self):
@@ -25,26 +69,161 @@ class ReportsView(BaseView):
 
         if event:
             # output CSV
-            output = StringIO.StringIO()
-            writer = csv.DictWriter(output, ['name', 'zid', 'is_arc', 'time'])
-            writer.writeheader()
-
-            results = CheckIn.query.filter(CheckIn.event == event).all()
-            for check_in in results:
-                if check_in.student:
-                    writer.writerow({
-                        'name': check_in.student.given_names + ' ' + check_in.student.surname,
-                        'zid': check_in.student.zid,
-                        'time': check_in.timestamp.isoformat(),
-                        'is_arc': check_in.student.is_arc
-                    })
+            columns = ['name', 'zid', 'is_arc', 'time']
+            columns += [column for column in OPTIONAL_COLUMNS if request.form.get(column)]
 
             filename = re.sub(r'[^a-z0-9_]', '', event.name.replace(' ', '_').lower())
             filename = 'bark_' + filename + '.csv'
 
             headers = {'Content-Disposition': 'attachment; filename=' + filename}
 
-            return Response(output.getvalue(), mimetype='text/csv', headers=headers)
+            rows = stream_with_context(generate_csv(event.id, columns))
+            return Response(rows, mimetype='text/csv', headers=headers)
         else:
             return 'u wot m8'
 
+
+def parse_date(value):
+    if not value:
+        return None
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def aggregate_check_ins(group_by, start=None, end=None, category_id=None):
+    """
+    Counts check-ins, unique students, scans, CSE students and ARC members
+    per event, category, degree, course or day, in a single GROUP BY query.
+    `start` and `end` are inclusive dates on the check-in time.
+
+    Returns a list of (label, check_ins, students, scans, cse, arc) tuples.
+    """
+    if group_by == 'event':
+        keys = [Event.name]
+    elif group_by == 'category':
+        keys = [Category.name]
+    elif group_by == 'degree':
+        keys = [Degree.code, Degree.name]
+    elif group_by == 'course':
+        keys = [Course.code]
+    else:
+        keys = [func.date(CheckIn.timestamp)]
+
+    query = db.session.query(*(keys + [
+        func.count(distinct(CheckIn.id)),
+        func.count(distinct(CheckIn.student_id)),
+        func.sum(CheckIn.number_of_scans),
+        func.sum(case([(CheckIn.is_cse, 1)], else_=0)),
+        func.sum(case([(Student.is_arc, 1)], else_=0))
+    ])) \
+        .select_from(CheckIn) \
+        .join(Student, CheckIn.student_id == Student.id)
+
+    if group_by in ('event', 'category') or category_id is not None:
+        query = query.join(Event, CheckIn.event_id == Event.id)
+    if group_by == 'category':
+        query = query.outerjoin(Category, Event.category_id == Category.id)
+    if group_by == 'degree':
+        query = query.outerjoin(Degree, CheckIn.degree_id == Degree.id)
+    if group_by == 'course':
+        query = query \
+            .join(Enrolment, Enrolment.check_in_id == CheckIn.id) \
+            .join(Course, Enrolment.course_id == Course.id)
+
+    if start is not None:
+        query = query.filter(CheckIn.timestamp >= datetime.combine(start, time()))
+    if end is not None:
+        query = query.filter(CheckIn.timestamp < datetime.combine(end + timedelta(days=1), time()))
+    if category_id is not None:
+        query = query.filter(Event.category_id == category_id)
+
+    query = query.group_by(*keys).order_by(*keys)
+
+    rows = []
+    for row in query:
+        if group_by == 'degree':
+            label = format_degree(*row[:2]) or 'No degree'
+        else:
+            label = row[0] if row[0] is not None else 'None'
+        rows.append((label,) + tuple(int(value or 0) for value in row[len(keys):]))
+    return rows
+
+
+def encode(value):
+    return value.encode('utf-8') if isinstance(value, unicode) else value
+
+
+def generate_csv(event_id, columns):
+    """
+    Yields the CSV export of an event, a chunk of lines at a time.
+
+    Check-ins are read in chunks of CHUNK_SIZE, joined to their student (and
+    degree) in the same query. Courses, if asked for, take one more query per
+    chunk.
+    """
+    buf = StringIO.StringIO()
+    writer = csv.DictWriter(buf, columns)
+
+    writer.writeheader()
+
+    query = db.session.query(
+        CheckIn.id,
+        CheckIn.timestamp,
+        CheckIn.number_of_scans,
+        CheckIn.is_cse,
+        Student.given_names,
+        Student.surname,
+        Student.zid,
+        Student.is_arc,
+        Degree.code,
+        Degree.name
+    ) \
+        .join(Student, CheckIn.student_id == Student.id) \
+        .outerjoin(Degree, CheckIn.degree_id == Degree.id) \
+        .filter(CheckIn.event_id == event_id) \
+        .order_by(CheckIn.id)
+
+    last_id = 0
+    while True:
+        # seek past the previous chunk rather than using OFFSET
+        chunk = query.filter(CheckIn.id > last_id).limit(CHUNK_SIZE).all()
+        if not chunk:
+            break
+        last_id = chunk[-1].id
+
+        courses = {}
+        if 'courses' in columns:
+            enrolments = db.session.query(Enrolment.check_in_id, Course.code) \
+                .join(Course, Enrolment.course_id == Course.id) \
+                .filter(Enrolment.check_in_id.in_([row.id for row in chunk])) \
+                .order_by(Enrolment.id)
+            for check_in_id, code in enrolments:
+                courses.setdefault(check_in_id, []).append(code)
+
+        for row in chunk:
+            values = {
+                'name': row.given_names + ' ' + row.surname,
+                'zid': row.zid,
+                'time': row.timestamp.isoformat(),
+                'is_arc': row.is_arc,
+                'degree': format_degree(row.code, row.name),
+                'is_cse': row.is_cse,
+                'number_of_scans': row.number_of_scans,
+                'courses': ' '.join(courses.get(row.id, []))
+            }
+            writer.writerow(dict((column, encode(values[column])) for column in columns))
+
+        # one write per chunk rather than per line
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+    if buf.tell():
+        # no check-ins, just the header
+        yield buf.getvalue()
+
+
+def format_degree(code, name):
+    if code is None:
+        # the check-in has no degree
+        return ''
+    return name if name else 'Unknown Degree (%s)' % code
@@ -12,6 +12,13 @@ class UsersView(ModelView):
     def is_accessible(self):
         return current_user.is_authenticated()
 
-    def __init__(self, session, **kwargs):
+    def __init__(self, session, user_cache, **kwargs):
         super(UsersView, self).__init__(User, session, **kwargs)
+        self._user_cache = user_cache
+
+    def after_model_change(self, form, model, is_created):
+        self._user_cache.pop(model.id)
+
+    def on_model_delete(self, model):
+        self._user_cache.pop(model.id)
 
@@ -0,0 +1,242 @@
+"""
+Benchmarks the check-in API and CSV export end to end, so changes can be
+compared against a saved baseline.
+
+The app (development config, so USE_FAKE_SERVICES) runs against a seeded
+throwaway database, with UDB replaced by benchmarks.stub_udb, or with
+--fake-udb by app.services.udb_service.DummyUDBService. Each scenario is
+driven through the test client:
+
+    check_in        first scans at a running event
+    repeat_scan     second scans of the same students
+    update_arc      ARC membership updates
+    get_event_info  event lookups
+    csv_export      ReportsView.csv of a past event, with every column
+
+    python -m benchmarks.api_suite --save baseline.json
+    python -m benchmarks.api_suite --compare baseline.json
+
+--compare exits with an error if a scenario's p99 latency or throughput got
+worse by more than --threshold percent.
+"""
+
+import argparse
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from app.db import db, Event, Student, Degree, Course, CheckIn, Enrolment, User
+from app.services.udb_parser import parse_user
+from app.services.udb_service import DummyUDBService
+from benchmarks.common import create_bench_app, insert_rows, summarise
+from benchmarks.stub_udb import FIXTURE, start_stub_udb
+
+TOKEN = 'bench'
+ADMIN_ZID = 'z0000000'
+
+
+def udb_codes(args):
+    """
+    Returns the degree and course codes UDB will answer with.
+    """
+    if args.fake_udb:
+        udb_service = DummyUDBService(args.degrees, args.courses)
+        return [int(code) for code in udb_service.degree_codes], udb_service.course_codes
+
+    with open(FIXTURE) as f:
+        fixture = parse_user(f.read())
+    return [int(degree.code) for degree in fixture.degrees], [course.code for course in fixture.courses]
+
+
+def seed(args):
+    """
+    Seeds a running event (id 1) with no check-ins, and past events with
+    check-ins and enrolments spread across them.
+    """
+    now = datetime.now()
+
+    def events():
+        yield {'name': 'Running', 'location': 'K17', 'start': now - timedelta(hours=1),
+               'end': now + timedelta(hours=2), 'token': TOKEN, 'check_cse': False, 'check_arc': False,
+               'timestamp': now}
+        for i in xrange(1, args.events):
+            yield {'name': 'Event %d' % i, 'location': 'K17', 'start': now - timedelta(days=i),
+                   'end': now - timedelta(days=i) + timedelta(hours=2), 'token': '%064x' % i,
+                   'check_cse': False, 'check_arc': False, 'timestamp': now}
+    insert_rows(Event.__table__, events())
+
+    # name the degrees and courses UDB answers with, so check-ins don't wait
+    # on the handbook
+    degree_codes, course_codes = udb_codes(args)
+    degree_codes += [3000 + i for i in xrange(args.degrees) if 3000 + i not in degree_codes]
+    course_codes += ['COMP%04d' % i for i in xrange(args.courses) if 'COMP%04d' % i not in course_codes]
+
+    insert_rows(Degree.__table__, ({'code': code, 'name': 'Degree %d' % code, 'is_cse': True}
+                                   for code in degree_codes))
+    insert_rows(Course.__table__, ({'code': code, 'name': 'Course %s' % code} for code in course_codes))
+    insert_rows(Student.__table__, (
+        {'zid': 'z%07d' % i, 'given_names': 'Student', 'surname': str(i), 'is_arc': i % 2 == 0}
+        for i in xrange(1, args.students + 1)
+    ))
+
+    per_event = max(1, args.check_ins // max(1, args.events - 1))
+
+    def check_ins():
+        for event_id in xrange(2, args.events + 1):
+            for student_id in random.sample(xrange(1, args.students + 1), min(per_event, args.students)):
+                yield {'student_id': student_id, 'event_id': event_id, 'timestamp': now, 'number_of_scans': 1,
+                       'is_cse': True, 'degree_id': random.randint(1, len(degree_codes))}
+
+    def enrolments():
+        for check_in_id in xrange(1, CheckIn.query.count() + 1):
+            for course_id in random.sample(xrange(1, len(course_codes) + 1), 3):
+                yield {'check_in_id': check_in_id, 'course_id': course_id}
+
+    insert_rows(CheckIn.__table__, check_ins())
+    insert_rows(Enrolment.__table__, enrolments())
+
+    user = User()
+    user.zid = ADMIN_ZID
+    db.session.add(user)
+    db.session.commit()
+
+
+def time_requests(requests_to_make):
+    samples = []
+    start = time.time()
+    for make_request in requests_to_make:
+        request_start = time.time()
+        make_request()
+        samples.append(time.time() - request_start)
+    elapsed = time.time() - start
+
+    summary = summarise(samples)
+    summary['throughput'] = len(samples) / elapsed if elapsed else 0.0
+    return summary
+
+
+def run_scenarios(app, args):
+    client = app.test_client()
+
+    def api(**data):
+        data.setdefault('token', TOKEN)
+        resp = json.loads(client.post('/api', data=json.dumps(data), content_type='application/json').data)
+        if not resp['success']:
+            raise RuntimeError('%s failed: %s' % (data['action'], resp['error']))
+        return resp
+
+    zids = ['z%07d' % i for i in random.sample(xrange(1, args.students + 1), min(args.iterations, args.students))]
+
+    results = {}
+    results['check_in'] = time_requests(
+        lambda zid=zid: api(action='check_in', zid=zid, max_scans=5) for zid in zids)
+    results['repeat_scan'] = time_requests(
+        lambda zid=zid: api(action='check_in', zid=zid, max_scans=5) for zid in zids)
+    results['update_arc'] = time_requests(
+        lambda zid=zid: api(action='update_arc', zid=zid, is_arc=True) for zid in zids)
+    results['get_event_info'] = time_requests(
+        lambda: api(action='get_event_info') for _ in zids)
+
+    # the dummy LDAP service takes any password
+    client.post('/admin/login/', data={'zid': ADMIN_ZID, 'password': 'benchmark'})
+    form = {'event': 2, 'degree': 'y', 'is_cse': 'y', 'number_of_scans': 'y', 'courses': 'y'}
+
+    def export():
+        resp = client.post('/admin/reportsview/csv', data=form)
+        if resp.mimetype != 'text/csv':
+            raise RuntimeError('csv_export failed with status %d' % resp.status_code)
+        return resp.data
+
+    results['csv_export'] = time_requests(export for _ in xrange(args.csv_iterations))
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints how each scenario changed against the baseline. Returns whether
+    none of them got worse by more than `threshold` percent.
+    """
+    ok = True
+    print
+    print '%-16s %12s %12s' % ('vs baseline', 'req/s', 'p99')
+    for name, summary in sorted(results.items()):
+        if name not in baseline:
+            continue
+        before = baseline[name]
+        throughput = 100.0 * (summary['throughput'] - before['throughput']) / before['throughput']
+        p99 = 100.0 * (summary['p99_ms'] - before['p99_ms']) / before['p99_ms']
+
+        regressed = throughput < -threshold or p99 > threshold
+        ok = ok and not regressed
+        print '%-16s %+11.1f%% %+11.1f%%%s' % (name, throughput, p99, '  REGRESSION' if regressed else '')
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=50)
+    parser.add_argument('--students', type=int, default=20000)
+    parser.add_argument('--degrees', type=int, default=100)
+    parser.add_argument('--courses', type=int, default=500)
+    parser.add_argument('--check-ins', type=int, default=100000)
+    parser.add_argument('--iterations', type=int, default=500, help='requests per API scenario')
+    parser.add_argument('--csv-iterations', type=int, default=5)
+    parser.add_argument('--udb-latency', type=float, default=0)
+    parser.add_argument('--fake-udb', action='store_true', help='make students up instead of using the stub')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare the results with this JSON file')
+    parser.add_argument('--threshold', type=float, default=10, help='percent change counted as a regression')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    if args.fake_udb:
+        app, database_path = create_bench_app(
+            USE_FAKE_UDB=True,
+            FAKE_UDB_DEGREES=args.degrees,
+            FAKE_UDB_COURSES=args.courses,
+            FAKE_UDB_LATENCY=timedelta(seconds=args.udb_latency)
+        )
+    else:
+        stub = start_stub_udb(latency=args.udb_latency)
+        app, database_path = create_bench_app(UDB_URL=stub.url)
+
+    try:
+        with app.app_context():
+            db.create_all()
+            start = time.time()
+            seed(args)
+            print 'Seeded %d events, %d students and %d check-ins in %.1fs' % (
+                args.events, args.students, CheckIn.query.count(), time.time() - start)
+            db.session.remove()
+
+        results = run_scenarios(app, args)
+    finally:
+        os.remove(database_path)
+
+    print '%-16s %8s %10s %10s %10s %10s' % ('scenario', 'requests', 'req/s', 'p50 ms', 'p90 ms', 'p99 ms')
+    for name in ('check_in', 'repeat_scan', 'update_arc', 'get_event_info', 'csv_export'):
+        summary = results[name]
+        print '%-16s %8d %10.1f %10.2f %10.2f %10.2f' % (
+            name, summary['count'], summary['throughput'], summary['p50_ms'], summary['p90_ms'], summary['p99_ms'])
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'settings': vars(args), 'results': results}, f, indent=2, sort_keys=True)
+        print 'Saved results to %s' % args.save
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['settings'] != dict(vars(args), save=baseline['settings'].get('save'),
+                                        compare=baseline['settings'].get('compare')):
+            print 'Warning: the baseline was run with different settings'
+        if not compare(results, baseline['results'], args.threshold):
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
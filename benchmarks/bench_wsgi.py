@@ -0,0 +1,14 @@
+"""
+The app gunicorn serves in benchmarks.load_test: the development config
+against the database at BENCH_DATABASE, with UDB at BENCH_UDB_URL.
+"""
+
+import os
+
+from benchmarks.common import create_bench_app
+
+app, _ = create_bench_app(
+    os.environ['BENCH_DATABASE'],
+    UDB_URL=os.environ['BENCH_UDB_URL'],
+    DATABASE_PROFILE=os.environ.get('BENCH_DATABASE_PROFILE', 'production')
+)
@@ -0,0 +1,71 @@
+"""
+Helpers shared by the benchmark scripts.
+"""
+
+import os
+import tempfile
+
+from app import create_app
+from app.db import db
+from config import Development
+
+CHUNK_SIZE = 10000
+
+
+def create_bench_app(database_path=None, **settings):
+    """
+    Creates the app against a throwaway SQLite database (or the given one),
+    with any config values overridden by `settings`.
+    """
+    if database_path is None:
+        fd, database_path = tempfile.mkstemp(prefix='bark-bench-', suffix='.db')
+        os.close(fd)
+
+    config = Development()
+    config.DEBUG = False
+    config.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.abspath(database_path)
+    # keep each benchmark's metrics to itself
+    config.METRICS_DIR = None
+    # talk to benchmarks.stub_udb over HTTP unless asked otherwise
+    config.USE_FAKE_UDB = False
+    for key, value in settings.items():
+        setattr(config, key, value)
+
+    return create_app(config), database_path
+
+
+def insert_rows(table, rows):
+    """
+    Inserts an iterable of rows in chunks of CHUNK_SIZE and commits.
+    """
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK_SIZE:
+            db.session.execute(table.insert(), chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(table.insert(), chunk)
+    db.session.commit()
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    if not samples:
+        return 0.0
+    index = min(len(samples) - 1, int(round(p / 100.0 * (len(samples) - 1))))
+    return samples[index]
+
+
+def summarise(samples):
+    """
+    Summarises latency samples (in seconds) as milliseconds.
+    """
+    return {
+        'count': len(samples),
+        'mean_ms': 1000.0 * sum(samples) / len(samples) if samples else 0.0,
+        'p50_ms': 1000.0 * percentile(samples, 50),
+        'p90_ms': 1000.0 * percentile(samples, 90),
+        'p99_ms': 1000.0 * percentile(samples, 99),
+        'max_ms': 1000.0 * max(samples) if samples else 0.0
+    }
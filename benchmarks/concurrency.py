@@ -0,0 +1,153 @@
+"""
+Hammers /api with check-ins from many processes at once, like gunicorn's
+workers during peak scanning, and reports "database is locked" errors and
+latency for each database profile (see SQLITE_PROFILES in app/db.py).
+
+    python -m benchmarks.concurrency --processes 17 --requests 200 --profiles default,production
+
+UDB is replaced by benchmarks.stub_udb.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import OperationalError
+
+from app.db import db, Event
+from benchmarks.common import create_bench_app, summarise
+from benchmarks.stub_udb import start_stub_udb
+
+TOKEN = 'bench'
+
+
+def bench_settings(profile, udb_url, database_path, write_behind):
+    return dict(
+        DATABASE_PROFILE=profile,
+        UDB_URL=udb_url,
+        CHECK_IN_WRITE_BEHIND=write_behind,
+        CHECK_IN_QUEUE_PATH=database_path + '.queue',
+        # let database errors reach the benchmark instead of becoming a 500
+        PROPAGATE_EXCEPTIONS=True
+    )
+
+
+def hammer(job):
+    database_path, settings, num_requests, num_students, max_scans, seed = job
+    random.seed(seed)
+
+    app, _ = create_bench_app(database_path, **settings)
+    client = app.test_client()
+
+    samples = []
+    counts = {'ok': 0, 'rejected': 0, 'conflicts': 0, 'locked': 0, 'errors': 0}
+    for _ in xrange(num_requests):
+        data = json.dumps({
+            'token': TOKEN,
+            'action': 'check_in',
+            'zid': 'z%07d' % random.randint(1, num_students),
+            'max_scans': max_scans
+        })
+
+        start = time.time()
+        try:
+            resp = json.loads(client.post('/api', data=data, content_type='application/json').data)
+            if resp['success']:
+                counts['ok'] += 1
+            elif 'already checked in' in resp['error']:
+                counts['rejected'] += 1
+            elif 'scanned twice at once' in resp['error']:
+                counts['conflicts'] += 1
+            else:
+                counts['errors'] += 1
+        except OperationalError as e:
+            db.session.remove()
+            counts['locked' if 'locked' in str(e) else 'errors'] += 1
+        samples.append(time.time() - start)
+
+    queue = app.extensions.get('check_in_queue')
+    if queue is not None:
+        queue.stop()
+
+    return samples, counts
+
+
+def run(profile, args, udb_url):
+    fd, database_path = tempfile.mkstemp(prefix='bark-bench-', suffix='.db')
+    os.close(fd)
+    settings = bench_settings(profile, udb_url, database_path, args.write_behind)
+
+    app, _ = create_bench_app(database_path, **settings)
+    with app.app_context():
+        db.create_all()
+
+        event = Event()
+        event.name = 'Benchmark'
+        event.location = 'K17'
+        event.start = datetime.now() - timedelta(hours=1)
+        event.end = datetime.now() + timedelta(hours=2)
+        event.token = TOKEN
+        event.check_cse = False
+        db.session.add(event)
+        db.session.commit()
+        db.session.remove()
+    db.get_engine(app).dispose()
+
+    jobs = [
+        (database_path, settings, args.requests, args.students, args.max_scans, i)
+        for i in xrange(args.processes)
+    ]
+
+    pool = multiprocessing.Pool(args.processes)
+    start = time.time()
+    results = pool.map(hammer, jobs)
+    elapsed = time.time() - start
+    pool.close()
+    pool.join()
+
+    samples = []
+    counts = {'ok': 0, 'rejected': 0, 'conflicts': 0, 'locked': 0, 'errors': 0}
+    for process_samples, process_counts in results:
+        samples.extend(process_samples)
+        for key, value in process_counts.items():
+            counts[key] += value
+
+    for path in (database_path, database_path + '-wal', database_path + '-shm',
+                 settings['CHECK_IN_QUEUE_PATH'], settings['CHECK_IN_QUEUE_PATH'] + '.lock'):
+        if os.path.exists(path):
+            os.remove(path)
+
+    return samples, counts, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count() * 2 + 1)
+    parser.add_argument('--requests', type=int, default=200, help='check-ins per process')
+    parser.add_argument('--students', type=int, default=2000)
+    parser.add_argument('--max-scans', type=int, default=3)
+    parser.add_argument('--profiles', default='default,production')
+    parser.add_argument('--udb-latency', type=float, default=0)
+    parser.add_argument('--write-behind', action='store_true', help='queue check-ins (CHECK_IN_WRITE_BEHIND)')
+    args = parser.parse_args()
+
+    stub = start_stub_udb(latency=args.udb_latency)
+
+    print '%-12s %8s %8s %8s %9s %8s %8s %8s %8s %8s' % (
+        'profile', 'requests', 'ok', 'rejected', 'conflicts', 'locked', 'errors', 'req/s', 'p50 ms', 'p99 ms')
+    for profile in args.profiles.split(','):
+        samples, counts, elapsed = run(profile, args, stub.url)
+        summary = summarise(samples)
+        print '%-12s %8d %8d %8d %9d %8d %8d %8.0f %8.1f %8.1f' % (
+            profile, len(samples), counts['ok'], counts['rejected'], counts['conflicts'], counts['locked'],
+            counts['errors'],
+            len(samples) / elapsed, summary['p50_ms'], summary['p99_ms'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""
+Compares check-in throughput of gunicorn worker classes against a slow UDB.
+
+Each configuration (class:workers:threads) is served by gunicorn, using
+gunicorn.py, from a throwaway database, while `--clients` concurrent
+scanners post check-ins to it for `--duration` seconds. UDB is replaced by
+benchmarks.stub_udb, answering after `--udb-latency` seconds.
+
+    python -m benchmarks.load_test --configs sync:4:1,gthread:4:8,gevent:4:1 --udb-latency 0.2
+
+gthread needs the `futures` package and gevent needs `gevent`; configurations
+that don't start are skipped.
+"""
+
+import argparse
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import requests
+
+from app.db import db, Event
+from benchmarks.common import create_bench_app, summarise
+from benchmarks.stub_udb import start_stub_udb
+
+TOKEN = 'bench'
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def create_database(path):
+    app, _ = create_bench_app(path)
+    with app.app_context():
+        db.create_all()
+
+        event = Event()
+        event.name = 'Load test'
+        event.location = 'K17'
+        event.start = datetime.now() - timedelta(hours=1)
+        event.end = datetime.now() + timedelta(hours=2)
+        event.token = TOKEN
+        event.check_cse = False
+        db.session.add(event)
+        db.session.commit()
+        db.session.remove()
+    db.get_engine(app).dispose()
+
+
+def start_gunicorn(worker_class, workers, threads, port, database_path, udb_url):
+    env = dict(os.environ)
+    env.update({
+        'GUNICORN_WORKER_CLASS': worker_class,
+        'GUNICORN_WORKERS': str(workers),
+        'GUNICORN_THREADS': str(threads),
+        'BENCH_DATABASE': database_path,
+        'BENCH_UDB_URL': udb_url
+    })
+
+    # our gunicorn.py hides the gunicorn package if the repo is on the path,
+    # so leave it out (gunicorn finds the app from its working directory),
+    # and run the gunicorn script rather than `python -m gunicorn`
+    env['PYTHONPATH'] = os.pathsep.join(
+        path for path in env.get('PYTHONPATH', '').split(os.pathsep)
+        if path and os.path.abspath(path) != ROOT
+    )
+    executable = os.path.join(os.path.dirname(sys.executable), 'gunicorn')
+    with open(os.devnull, 'w') as devnull:
+        return subprocess.Popen(
+            [executable, '-c', 'gunicorn.py', '-b', '127.0.0.1:%d' % port, 'benchmarks.bench_wsgi:app'],
+            cwd=ROOT, env=env, stdout=devnull, stderr=devnull
+        )
+
+
+def wait_until_ready(process, url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline and process.poll() is None:
+        try:
+            requests.post(url, data=json.dumps({'token': TOKEN, 'action': 'get_event_info'}),
+                          headers={'Content-Type': 'application/json'}, timeout=1)
+            return True
+        except requests.RequestException:
+            time.sleep(0.2)
+    return False
+
+
+def scanner(url, deadline, num_students, samples, counts, lock):
+    session = requests.Session()
+    while time.time() < deadline:
+        data = json.dumps({
+            'token': TOKEN,
+            'action': 'check_in',
+            'zid': 'z%07d' % random.randint(1, num_students),
+            'max_scans': 1000
+        })
+
+        start = time.time()
+        try:
+            r = session.post(url, data=data, headers={'Content-Type': 'application/json'}, timeout=30)
+            ok = r.status_code == 200 and r.json()['success']
+        except (requests.RequestException, ValueError):
+            ok = False
+        elapsed = time.time() - start
+
+        with lock:
+            samples.append(elapsed)
+            counts['ok' if ok else 'errors'] += 1
+
+
+def run(config, args, udb_url, port):
+    worker_class, workers, threads = config.split(':')
+
+    fd, database_path = tempfile.mkstemp(prefix='bark-bench-', suffix='.db')
+    os.close(fd)
+    create_database(database_path)
+
+    process = start_gunicorn(worker_class, int(workers), int(threads), port, database_path, udb_url)
+    url = 'http://127.0.0.1:%d/api' % port
+    try:
+        if not wait_until_ready(process, url):
+            return None
+
+        samples = []
+        counts = {'ok': 0, 'errors': 0}
+        lock = threading.Lock()
+        deadline = time.time() + args.duration
+
+        clients = [
+            threading.Thread(target=scanner, args=(url, deadline, args.students, samples, counts, lock))
+            for _ in xrange(args.clients)
+        ]
+        start = time.time()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        elapsed = time.time() - start
+
+        return samples, counts, elapsed
+    finally:
+        if process.poll() is None:
+            process.send_signal(signal.SIGTERM)
+            process.wait()
+        for path in (database_path, database_path + '-wal', database_path + '-shm'):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--configs', default='sync:4:1,gthread:4:8,gevent:4:1')
+    parser.add_argument('--clients', type=int, default=32, help='scanners posting at once')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per configuration')
+    parser.add_argument('--students', type=int, default=5000)
+    parser.add_argument('--udb-latency', type=float, default=0.2)
+    parser.add_argument('--port', type=int, default=8090)
+    args = parser.parse_args()
+
+    stub = start_stub_udb(latency=args.udb_latency)
+
+    print '%-20s %8s %8s %8s %8s %8s' % ('config', 'ok', 'errors', 'req/s', 'p50 ms', 'p99 ms')
+    for config in args.configs.split(','):
+        result = run(config, args, stub.url, args.port)
+        if result is None:
+            print '%-20s skipped, gunicorn did not start' % config
+            continue
+
+        samples, counts, elapsed = result
+        summary = summarise(samples)
+        print '%-20s %8d %8d %8.1f %8.1f %8.1f' % (
+            config, counts['ok'], counts['errors'], counts['ok'] / elapsed, summary['p50_ms'], summary['p99_ms'])
+
+
+if __name__ == '__main__':
+    main()
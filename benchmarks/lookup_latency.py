@@ -0,0 +1,125 @@
+"""
+Measures the lookups ApiView.post makes on every scan against a large
+database, first without and then with the indexes declared in app/db.py.
+
+    python -m benchmarks.lookup_latency --students 100000 --check-ins 1000000
+"""
+
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from app.db import db, Event, Student, Degree, Course, CheckIn
+from benchmarks.common import create_bench_app, insert_rows, summarise
+from migrate_db import migrate
+
+def seed(num_students, num_check_ins, num_events, num_degrees, num_courses):
+    now = datetime.now()
+
+    insert_rows(Event.__table__, (
+        {'name': 'Event %d' % i, 'location': 'K17', 'start': now + timedelta(days=i), 'end': now + timedelta(days=i, hours=2),
+         'token': '%064x' % i, 'check_cse': False, 'check_arc': False, 'timestamp': now}
+        for i in xrange(1, num_events + 1)
+    ))
+    insert_rows(Degree.__table__, (
+        {'code': 3000 + i, 'name': 'Degree %d' % i, 'is_cse': True} for i in xrange(1, num_degrees + 1)
+    ))
+    insert_rows(Course.__table__, (
+        {'code': 'COMP%04d' % i, 'name': 'Course %d' % i} for i in xrange(1, num_courses + 1)
+    ))
+    insert_rows(Student.__table__, (
+        {'zid': 'z%07d' % i, 'given_names': 'Student', 'surname': str(i), 'is_arc': i % 2 == 0}
+        for i in xrange(1, num_students + 1)
+    ))
+
+    # spread the check-ins over the events, at most one per student per event
+    per_event = max(1, num_check_ins // num_events)
+
+    def check_ins():
+        for event_id in xrange(1, num_events + 1):
+            for student_id in random.sample(xrange(1, num_students + 1), min(per_event, num_students)):
+                yield {'student_id': student_id, 'event_id': event_id, 'timestamp': now, 'number_of_scans': 1,
+                       'is_cse': True, 'degree_id': random.randint(1, num_degrees)}
+
+    insert_rows(CheckIn.__table__, check_ins())
+
+
+def drop_indexes():
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            db.session.execute('DROP INDEX IF EXISTS %s' % index.name)
+    db.session.commit()
+
+
+def measure(num_lookups, num_students, num_events, num_degrees, num_courses):
+    lookups = {
+        'event.token': lambda: Event.query.filter(Event.token == '%064x' % random.randint(1, num_events)).all(),
+        'student.zid': lambda: Student.query.filter(Student.zid == 'z%07d' % random.randint(1, num_students)).all(),
+        'degree.code': lambda: Degree.query.filter(Degree.code == 3000 + random.randint(1, num_degrees)).all(),
+        'course.code': lambda: Course.query.filter(Course.code == 'COMP%04d' % random.randint(1, num_courses)).all(),
+        'check_in(student, event)': lambda: CheckIn.query
+            .filter(CheckIn.student_id == random.randint(1, num_students))
+            .filter(CheckIn.event_id == random.randint(1, num_events))
+            .first(),
+    }
+
+    results = {}
+    for name, lookup in sorted(lookups.items()):
+        samples = []
+        for _ in xrange(num_lookups):
+            start = time.time()
+            lookup()
+            samples.append(time.time() - start)
+            # don't let the identity map answer the next lookup
+            db.session.expunge_all()
+        results[name] = summarise(samples)
+    return results
+
+
+def report(title, results):
+    print title
+    print '    %-28s %10s %10s %10s' % ('lookup', 'p50 ms', 'p99 ms', 'max ms')
+    for name, summary in sorted(results.items()):
+        print '    %-28s %10.3f %10.3f %10.3f' % (name, summary['p50_ms'], summary['p99_ms'], summary['max_ms'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=100000)
+    parser.add_argument('--check-ins', type=int, default=1000000)
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--degrees', type=int, default=300)
+    parser.add_argument('--courses', type=int, default=3000)
+    parser.add_argument('--lookups', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    app, database_path = create_bench_app()
+
+    try:
+        with app.app_context():
+            db.create_all()
+            drop_indexes()
+
+            start = time.time()
+            seed(args.students, args.check_ins, args.events, args.degrees, args.courses)
+            print 'Seeded %d students and %d check-ins in %.1fs' % (
+                Student.query.count(), CheckIn.query.count(), time.time() - start)
+
+            sizes = (args.students, args.events, args.degrees, args.courses)
+            report('Without indexes:', measure(args.lookups, *sizes))
+
+            start = time.time()
+            migrate()
+            print 'Created indexes in %.1fs' % (time.time() - start)
+
+            report('With indexes:', measure(args.lookups, *sizes))
+    finally:
+        os.remove(database_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+A stand-in for UDB, for benchmarks. Answers `?user=<zid>` with one of the
+fixtures in benchmarks/fixtures/udb, rewritten for that zID, after an
+optional delay.
+
+    python -m benchmarks.stub_udb --port 8081 --latency 0.05
+
+then point UDB_URL at http://localhost:8081/.
+"""
+
+import argparse
+import os
+import threading
+import time
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'udb', 'later_year.txt')
+
+# the zID the fixtures are written for
+FIXTURE_ZID = '5012345'
+
+
+class StubUDBServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, fixture, latency):
+        HTTPServer.__init__(self, address, StubUDBHandler)
+        with open(fixture) as f:
+            self.template = f.read()
+        self.latency = latency
+        self.requests = 0
+
+    def handle_error(self, request, client_address):
+        # clients that time out hang up on us; that's expected here
+        pass
+
+    @property
+    def url(self):
+        return 'http://%s:%d/' % self.server_address
+
+
+class StubUDBHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        query = urlparse.parse_qs(urlparse.urlparse(self.path).query)
+        zid = query.get('user', [''])[0]
+        self.server.requests += 1
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if not zid.startswith('z'):
+            body = ''
+            self.send_response(404)
+        else:
+            body = self.server.template.replace(FIXTURE_ZID, zid[1:])
+            self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_udb(fixture=FIXTURE, latency=0, port=0):
+    """
+    Starts the stub in a background thread. Returns the server; its `url`
+    can be used as UDB_URL.
+    """
+    server = StubUDBServer(('127.0.0.1', port), fixture, latency)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0, help='seconds to wait before answering')
+    parser.add_argument('--fixture', default=FIXTURE)
+    args = parser.parse_args()
+
+    server = StubUDBServer(('0.0.0.0', args.port), args.fixture, args.latency)
+    print 'Serving %s on port %d' % (os.path.basename(args.fixture), args.port)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
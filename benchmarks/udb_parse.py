@@ -0,0 +1,43 @@
+"""
+Measures how long it takes to parse a UDB response, per scan, over the
+fixtures in benchmarks/fixtures/udb.
+
+    python -m benchmarks.udb_parse --iterations 10000
+"""
+
+import argparse
+import glob
+import os
+import time
+
+from app.services.udb_parser import parse_user
+from benchmarks.common import summarise
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'udb')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=10000)
+    parser.add_argument('--fixtures', default=FIXTURES)
+    args = parser.parse_args()
+
+    print '%-20s %8s %10s %10s %10s' % ('fixture', 'bytes', 'mean us', 'p50 us', 'p99 us')
+    for path in sorted(glob.glob(os.path.join(args.fixtures, '*.txt'))):
+        with open(path) as f:
+            output = f.read()
+
+        samples = []
+        for _ in xrange(args.iterations):
+            start = time.time()
+            parse_user(output)
+            samples.append(time.time() - start)
+
+        summary = summarise(samples)
+        print '%-20s %8d %10.1f %10.1f %10.1f' % (
+            os.path.basename(path), len(output),
+            summary['mean_ms'] * 1000, summary['p50_ms'] * 1000, summary['p99_ms'] * 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,11 +5,125 @@ from datetime import timedelta
 class Config(object):
     DEBUG = False
     USE_FAKE_SERVICES = False
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///../data/bark.db'
+    # e.g. postgresql://bark:password@db/bark to use PostgreSQL
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///../data/bark.db')
+    # How SQLite connections are set up, one of app.db.SQLITE_PROFILES
+    DATABASE_PROFILE = 'default'
     UDB_URL = 'https://cgi.cse.unsw.edu.au/~csesoc/udb/'
     UDB_USER = 'udb'
     LDAP_HOST = 'ldap://ad.unsw.edu.au'
+    # How long a login waits on LDAP to connect or answer
+    LDAP_TIMEOUT = timedelta(seconds=5)
+    # Each worker keeps this many LDAP connections open between logins
+    LDAP_POOL_SIZE = 2
+
+    # Logged in users are cached by each worker. Edits in the Users page clear
+    # the cache of the worker that made them; the others catch up within the TTL
+    USER_CACHE_SIZE = 256
+    USER_CACHE_TTL = timedelta(seconds=30)
+
     EVENT_LEEWAY = timedelta(hours=1)
+    # Each worker keeps the live events in memory, and reloads them this often
+    # as well as whenever any worker saves an event, which it checks for at
+    # most every EVENT_INDEX_VERSION_CHECK
+    EVENT_INDEX_REFRESH = timedelta(minutes=1)
+    EVENT_INDEX_VERSION_CHECK = timedelta(seconds=2)
+
+    # Each worker keeps a pool of keep-alive connections to UDB. The pinned
+    # requests version applies UDB_TIMEOUT to both connecting and reading.
+    # Failed connections are retried within UDB_TIMEOUT; timeouts aren't
+    UDB_TIMEOUT = timedelta(seconds=5)
+    UDB_POOL_SIZE = 4
+    UDB_RETRIES = 2
+    UDB_RETRY_BACKOFF = timedelta(milliseconds=200)
+
+    # Batched check-ins look up this many students in UDB at once
+    UDB_BATCH_WORKERS = 8
+    MAX_BATCH_SIZE = 500
+    # Scanners that were offline send their scans' times. Scans are refused
+    # if they are older than this, or further ahead of the server's clock
+    MAX_SCAN_AGE = timedelta(days=1)
+    MAX_SCAN_CLOCK_SKEW = timedelta(minutes=5)
+
+    # Cache UDB lookups in each worker so repeat scans don't hit UDB again
+    UDB_CACHE_ENABLED = False
+    UDB_CACHE_SIZE = 4096
+    UDB_CACHE_TTL = timedelta(hours=1)
+    UDB_CACHE_NEGATIVE_TTL = timedelta(minutes=5)
+
+    # Look students up in a local snapshot of UDB first, filled before events
+    # by prefetch_udb.py, and only ask UDB about the rest. Older entries are
+    # still used while UDB is down, until prefetch_udb.py deletes them
+    UDB_SNAPSHOT_ENABLED = False
+    UDB_SNAPSHOT_PATH = '../data/udb_snapshot.db'
+    UDB_SNAPSHOT_MAX_AGE = timedelta(days=7)
+    UDB_SNAPSHOT_RETENTION = timedelta(days=365)
+
+    # Make students up from their zID instead of asking UDB, so check-ins work
+    # offline. Lookups can be slowed down or made to fail some of the time
+    USE_FAKE_UDB = False
+    FAKE_UDB_DEGREES = 50
+    FAKE_UDB_COURSES = 400
+    FAKE_UDB_LATENCY = timedelta(0)
+    FAKE_UDB_ERROR_RATE = 0.0
+    FAKE_UDB_MISSING_RATE = 0.0
+
+    # Degree and course names are looked up in the handbook in the background
+    HANDBOOK_TIMEOUT = timedelta(seconds=10)
+    HANDBOOK_WORKERS = 2
+    HANDBOOK_MAX_ATTEMPTS = 3
+    HANDBOOK_RETRY_DELAY = timedelta(seconds=30)
+    HANDBOOK_UNKNOWN_TTL = timedelta(hours=6)
+
+    # Connections each worker keeps open to PostgreSQL. Every gunicorn worker
+    # has its own pool, so workers * (size + overflow) has to stay under the
+    # server's max_connections
+    POSTGRES_POOL_SIZE = 2
+    POSTGRES_MAX_OVERFLOW = 3
+    POSTGRES_POOL_TIMEOUT = timedelta(seconds=10)
+    POSTGRES_POOL_RECYCLE = timedelta(minutes=30)
+
+    # Time each /api request by phase, for /metrics and the slow request log.
+    # Workers add up their metrics through files in METRICS_DIR (relative to
+    # the app package); with None, /metrics only shows the worker answering.
+    # /metrics is served to logged in users, and to scrapers that send
+    # METRICS_TOKEN as a bearer token
+    METRICS_ENABLED = False
+    METRICS_DIR = '../data/metrics'
+    METRICS_TOKEN = None
+    SLOW_REQUEST_THRESHOLD = timedelta(milliseconds=500)
+
+    # Write-behind mode answers check-ins straight away and queues them in a
+    # local file (relative to the app package, like the database), which one
+    # worker at a time writes to the database in batches
+    CHECK_IN_WRITE_BEHIND = False
+    CHECK_IN_QUEUE_PATH = '../data/check_in_queue.db'
+    CHECK_IN_QUEUE_BATCH_SIZE = 200
+    CHECK_IN_QUEUE_INTERVAL = timedelta(milliseconds=200)
+    CHECK_IN_QUEUE_FLUSH_TIMEOUT = timedelta(seconds=30)
+
+    # Dashboards can watch an event's check-ins live at /events/<id>/live.
+    # Workers pass check-ins on to each other through LIVE_FEED_PATH, for
+    # events a dashboard is watching
+    LIVE_FEED_ENABLED = False
+    LIVE_FEED_PATH = '../data/live_feed.db'
+    LIVE_FEED_INTERVAL = timedelta(milliseconds=500)
+    LIVE_FEED_RETENTION = timedelta(minutes=5)
+    LIVE_FEED_TIMEOUT = timedelta(seconds=1)
+    LIVE_STREAM_DURATION = timedelta(minutes=5)
+    LIVE_STREAM_HEARTBEAT = timedelta(seconds=15)
+
+    # Aggregate reports are cached until a new check-in arrives, or for this long
+    REPORT_CACHE_TTL = timedelta(minutes=10)
+
+    # How long the check-ins admin list reuses its total count and where
+    # each page starts, rather than working them out again
+    ADMIN_LIST_CACHE_TTL = timedelta(minutes=1)
+
+    # Rendered event QR codes, and how long browsers may keep them
+    QR_CACHE_SIZE = 256
+    QR_CACHE_TTL = timedelta(days=1)
+    QR_MAX_AGE = timedelta(days=1)
 
     # TODO: Add link to Android App Download
     ANDROID_URL = 'about:blank'
@@ -17,17 +131,30 @@ class Config(object):
 
 class Production(Config):
     PROPAGATE_EXCEPTIONS = True
+    DATABASE_PROFILE = 'production'
 
     def __init__(self):
         self.SECRET_KEY = os.environ['SECRET_KEY']
         self.UDB_PASSWORD = os.environ['UDB_PASSWORD']
+        self.METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
 
 
 class Development(Config):
     DEBUG = True
     USE_FAKE_SERVICES = True
+    USE_FAKE_UDB = True
     SECRET_KEY = 'development-only'
 
     def __init__(self):
         super(Development, self).__init__()
         self.UDB_PASSWORD = os.environ.get('UDB_PASSWORD')
+
+
+def get_config():
+    """
+    Picks the configuration for the current environment. Used by scripts that
+    run outside of the web server.
+    """
+    if os.environ.get('ENV') == 'production':
+        return Production()
+    return Development()
@@ -0,0 +1,45 @@
+"""
+Writes out the check-ins queued in write-behind mode (CHECK_IN_WRITE_BEHIND),
+then checks the scan counts max_scans was enforced against agree with the
+database.
+
+Lists any students they disagree on and any check-ins the database refused,
+and exits with an error if there are some.
+"""
+
+from app import create_app
+from config import get_config
+
+
+def flush(check_in_queue):
+    if not check_in_queue.flush():
+        print 'Another worker is still writing the queue, try again later'
+        return False
+
+    ok = True
+
+    mismatches = check_in_queue.check()
+    if mismatches:
+        ok = False
+        print 'Scan counts that disagree with the database:'
+        for event_id, zid, queued, stored in mismatches:
+            print '    event %d, %s: %d counted, %d stored' % (event_id, zid, queued, stored)
+
+    failed = check_in_queue.failed()
+    if failed:
+        ok = False
+        print 'Check-ins the database refused:'
+        for id_, event_id, zid, scanned_at, error in failed:
+            print '    %d: event %d, %s at %s: %s' % (id_, event_id, zid, scanned_at.isoformat(), error)
+
+    return ok
+
+
+if __name__ == '__main__':
+    config = get_config()
+    config.CHECK_IN_WRITE_BEHIND = True
+    app = create_app(config)
+
+    with app.app_context():
+        if not flush(app.extensions['check_in_queue']):
+            raise SystemExit(1)
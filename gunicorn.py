@@ -1,8 +1,36 @@
 """
 Gunicorn configuration used for production web server.
+
+The worker class, number of workers and threads per worker can be set with
+GUNICORN_WORKER_CLASS, GUNICORN_WORKERS and GUNICORN_THREADS. Check-ins spend
+most of their time waiting on UDB, so `gthread` (needs the `futures` package)
+or `gevent` (needs `gevent`) workers serve more scanners than the same number
+of `sync` ones.
 """
 
 import multiprocessing
+import os
 
 bind = "0.0.0.0:8080"
-workers = multiprocessing.cpu_count() * 2 + 1
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+# requests each gevent/eventlet worker handles at once
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+
+def on_starting(server):
+    # metrics left behind by the last run's workers would be counted again
+    from app.metrics import clear_dumps
+    from config import Production
+
+    config = Production()
+    if config.METRICS_ENABLED and config.METRICS_DIR:
+        clear_dumps(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app', config.METRICS_DIR))
+
+
+def worker_exit(server, worker):
+    # write out any check-ins still queued in write-behind mode
+    check_in_queue = getattr(worker.wsgi, 'extensions', {}).get('check_in_queue')
+    if check_in_queue is not None:
+        check_in_queue.stop()
@@ -0,0 +1,185 @@
+"""
+Updates every student's ARC membership from ARC's membership list, a CSV
+file with the members' zIDs in a `zid` column (or the first column, if no
+header row says otherwise).
+
+    python import_arc.py members.csv              # members in the list, nobody else
+    python import_arc.py members.csv --add-only   # only add the members in the list
+    python import_arc.py members.csv --dry-run    # report what would change
+
+Lists without a single zID, or with more than a few lines that don't hold one,
+are most likely the wrong file and are refused unless --force is given.
+
+The list is loaded into a temporary table in chunks, so it doesn't have to
+fit in memory, then students are updated in a couple of statements and the
+events' ARC counters are recounted. Reports how many students changed.
+"""
+
+import argparse
+import codecs
+import csv
+import re
+
+from sqlalchemy import MetaData, Table, Column, String, exists, func, or_
+
+from app import create_app
+from app.db import db, Student, insert_ignore
+from app.event_stats import refresh_arc_counts
+from config import get_config
+
+CHUNK_SIZE = 5000
+
+# the share of lines that can be without a zID before the list is refused
+MAX_INVALID_FRACTION = 0.05
+
+_ZID_RE = re.compile(r'^z?(\d{7})$', re.IGNORECASE)
+
+# only this connection sees it, and it goes away with the connection
+arc_import = Table(
+    'arc_import', MetaData(),
+    Column('zid', String(20), primary_key=True),
+    prefixes=['TEMPORARY']
+)
+
+
+def read_zids(f, counts):
+    """
+    Yields the zIDs in a membership list, normalised to e.g. 'z1234567', and
+    counts lines that don't hold one in counts['invalid'].
+    """
+    reader = csv.reader(f)
+    column = 0
+
+    for i, row in enumerate(reader):
+        if not row:
+            continue
+
+        if i == 0:
+            # spreadsheets often save UTF-8 with a byte order mark
+            if row[0].startswith(codecs.BOM_UTF8):
+                row[0] = row[0][len(codecs.BOM_UTF8):]
+            headers = [header.strip().lower() for header in row]
+            if 'zid' in headers:
+                column = headers.index('zid')
+                continue
+
+        match = _ZID_RE.match(row[column].strip()) if column < len(row) else None
+        if match is None:
+            counts['invalid'] += 1
+            continue
+        yield 'z' + match.group(1)
+
+
+def load_members(zids):
+    """
+    Loads zIDs into the temporary arc_import table in chunks. Returns how
+    many were read, duplicates included.
+    """
+    conn = db.session.connection()
+    # pysqlite commits before creating a table, so one made by an earlier
+    # import on this connection can outlive its rollback
+    arc_import.drop(bind=conn, checkfirst=True)
+    arc_import.create(bind=conn)
+
+    count = 0
+    chunk = []
+    for zid in zids:
+        chunk.append({'zid': zid})
+        count += 1
+        if len(chunk) == CHUNK_SIZE:
+            insert_ignore(arc_import, chunk)
+            chunk = []
+    if chunk:
+        insert_ignore(arc_import, chunk)
+    return count
+
+
+def update_students(add_only):
+    """
+    Marks students in arc_import as members and, unless `add_only`, everyone
+    else as not. Returns how many students joined, how many members left,
+    and how many students whose membership wasn't known are now not members.
+    """
+    students = Student.__table__
+    listed = exists().where(arc_import.c.zid == students.c.zid)
+
+    joined = db.session.execute(
+        students.update()
+        .where(listed)
+        .where(or_(students.c.is_arc.is_(None), students.c.is_arc == False))
+        .values(is_arc=True)
+    ).rowcount
+
+    left = unknown = 0
+    if not add_only:
+        left = db.session.execute(
+            students.update()
+            .where(~listed)
+            .where(students.c.is_arc == True)
+            .values(is_arc=False)
+        ).rowcount
+        unknown = db.session.execute(
+            students.update()
+            .where(~listed)
+            .where(students.c.is_arc.is_(None))
+            .values(is_arc=False)
+        ).rowcount
+
+    return joined, left, unknown
+
+
+def import_arc(f, add_only=False, dry_run=False, force=False):
+    """
+    Imports a membership list. Returns False, changing nothing, if the list
+    was refused.
+    """
+    counts = {'invalid': 0}
+    read = load_members(read_zids(f, counts))
+    members = db.session.query(func.count()).select_from(arc_import).scalar()
+
+    print 'Read %d zIDs (%d distinct), skipped %d lines without one' % (read, members, counts['invalid'])
+    if not force and (not read or counts['invalid'] > MAX_INVALID_FRACTION * (read + counts['invalid'])):
+        db.session.rollback()
+        print 'This doesn\'t look like a membership list, nothing was changed (use --force to import it anyway)'
+        return False
+
+    known = db.session.query(func.count(Student.id)) \
+        .filter(exists().where(arc_import.c.zid == Student.zid)) \
+        .scalar()
+
+    joined, left, unknown = update_students(add_only)
+    refresh_arc_counts()
+
+    print '%d of them are students in the database, %d aren\'t' % (known, members - known)
+    if add_only:
+        print '%d students became ARC members' % joined
+    else:
+        print '%d students became ARC members, %d stopped being members' % (joined, left)
+        print '%d students whose membership wasn\'t known are now not members' % unknown
+
+    if dry_run:
+        db.session.rollback()
+        print 'Dry run, nothing was changed'
+    else:
+        db.session.commit()
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('csv', help='the membership list')
+    parser.add_argument('--add-only', action='store_true', help="don't take membership away from anyone")
+    parser.add_argument('--dry-run', action='store_true', help='report what would change without changing it')
+    parser.add_argument('--force', action='store_true',
+                        help='import lists without any zIDs or with many lines without one')
+    args = parser.parse_args()
+
+    app = create_app(get_config())
+    with app.app_context():
+        with open(args.csv, 'rb') as f:
+            if not import_arc(f, args.add_only, args.dry_run, args.force):
+                raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
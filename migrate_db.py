@@ -0,0 +1,67 @@
+"""
+Brings an existing database (e.g. data/bark.db) up to date with the models.
+
+Missing tables and indexes are created. A unique index can't be created while
+the table holds duplicate values, so those are listed instead and have to be
+merged by hand before running this again. Events checked in to before there
+were attendance counters are counted.
+"""
+
+from sqlalchemy import func, inspect
+
+from app import create_app
+from app.db import db
+from app.event_stats import add_missing_stats
+from config import get_config
+
+
+def find_duplicates(table, index):
+    columns = list(index.columns)
+    query = db.session.query(*(columns + [func.count()])) \
+        .select_from(table) \
+        .filter(*[column.isnot(None) for column in columns]) \
+        .group_by(*columns) \
+        .having(func.count() > 1)
+    return query.all()
+
+
+def migrate():
+    db.create_all()
+
+    inspector = inspect(db.engine)
+    ok = True
+
+    for table in db.metadata.sorted_tables:
+        existing = set(index['name'] for index in inspector.get_indexes(table.name))
+
+        for index in sorted(table.indexes, key=lambda i: i.name):
+            if index.name in existing:
+                continue
+
+            if index.unique:
+                duplicates = find_duplicates(table, index)
+                if duplicates:
+                    ok = False
+                    print 'Cannot create %s, duplicate values in %s:' % (index.name, table.name)
+                    for row in duplicates:
+                        print '    %s (%d rows)' % (', '.join(unicode(v) for v in row[:-1]), row[-1])
+                    continue
+
+            print 'Creating %s' % index.name
+            index.create(bind=db.engine)
+
+    counted = add_missing_stats()
+    db.session.commit()
+    if counted:
+        print 'Counted the check-ins of %d events' % counted
+
+    return ok
+
+
+if __name__ == '__main__':
+    config = get_config()
+    app = create_app(config)
+
+    with app.app_context():
+        if not migrate():
+            raise SystemExit(1)
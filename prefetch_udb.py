@@ -0,0 +1,100 @@
+"""
+Fills the UDB snapshot (UDB_SNAPSHOT_PATH) that check-ins are answered from
+when UDB_SNAPSHOT_ENABLED is set. Run it before an event:
+
+    python prefetch_udb.py               # every student in the database
+    python prefetch_udb.py --zids FILE   # the zIDs in FILE, one per line
+
+Students UDB can't be asked about keep whatever the snapshot already had.
+"""
+
+import argparse
+import time
+from multiprocessing.pool import ThreadPool
+
+from app import create_app
+from app.db import Student
+from app.services.udb_service import create_udb_service
+from app.services.udb_snapshot import create_udb_snapshot
+from config import get_config
+
+# how many students are written to the snapshot at once
+CHUNK_SIZE = 500
+
+
+def fetch(udb_service, zid):
+    try:
+        return zid, udb_service.get_user(zid), None
+    except IOError as e:
+        return zid, None, e
+
+
+def prefetch(udb_service, snapshot, zids, workers):
+    """
+    Looks up each of `zids` in UDB and stores the answers in `snapshot`.
+    Returns how many were found, not in UDB, and couldn't be looked up.
+    """
+    found = missing = errors = 0
+    chunk = []
+
+    pool = ThreadPool(workers)
+    try:
+        for zid, user, error in pool.imap_unordered(lambda zid: fetch(udb_service, zid), zids):
+            if error is not None:
+                errors += 1
+                continue
+
+            if user is None:
+                missing += 1
+            else:
+                found += 1
+            chunk.append((zid, user))
+            if len(chunk) == CHUNK_SIZE:
+                snapshot.put_many(chunk)
+                chunk = []
+                print '%d/%d' % (found + missing + errors, len(zids))
+    finally:
+        pool.close()
+
+    if chunk:
+        snapshot.put_many(chunk)
+    return found, missing, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--zids', help='file with the zIDs to fetch, one per line')
+    parser.add_argument('--workers', type=int, help='lookups at once, UDB_BATCH_WORKERS by default')
+    args = parser.parse_args()
+
+    config = get_config()
+    app = create_app(config)
+
+    if args.zids:
+        with open(args.zids) as f:
+            zids = sorted(set(line.strip() for line in f if line.strip()))
+    else:
+        with app.app_context():
+            zids = [zid for zid, in Student.query.with_entities(Student.zid)]
+
+    # ask UDB itself, not the snapshot or a cache in front of it
+    config.UDB_SNAPSHOT_ENABLED = False
+    config.UDB_CACHE_ENABLED = False
+    udb_service = create_udb_service(app, config)
+    snapshot = create_udb_snapshot(app, config)
+
+    start = time.time()
+    found, missing, errors = prefetch(udb_service, snapshot, zids, args.workers or config.UDB_BATCH_WORKERS)
+    pruned = snapshot.prune()
+
+    print 'Fetched %d students in %.1fs: %d found, %d not in UDB, %d failed' % (
+        len(zids), time.time() - start, found, missing, errors)
+    print 'The snapshot holds %d up to date students (%d entries past UDB_SNAPSHOT_RETENTION removed)' % (
+        snapshot.count(), pruned)
+
+    if errors:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+"""
+Counts every event's check-ins again from scratch and replaces the running
+totals (EventStats) shown in the events list and get_event_info. Run it after
+editing or deleting check-ins or students by hand, which doesn't update them.
+
+    python rebuild_stats.py              # every event
+    python rebuild_stats.py --event ID   # one event
+"""
+
+import argparse
+
+from app import create_app
+from app.event_stats import rebuild_event_stats
+from config import get_config
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--event', type=int, help='id of the event to recount')
+    args = parser.parse_args()
+
+    app = create_app(get_config())
+    with app.app_context():
+        rows = rebuild_event_stats(args.event)
+
+    print 'Recounted %d events, %d check-ins' % (len(rows), sum(row['check_ins'] for row in rows))
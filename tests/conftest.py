@@ -0,0 +1,90 @@
+"""
+Fixtures shared by the tests. Apps run against an in-memory SQLite database
+(or a file, for tests that need more than one connection), with UDB faked
+and python-ldap replaced by tests.stub_ldap.
+"""
+
+import socket
+import sys
+
+import pytest
+
+from tests import stub_ldap
+
+sys.modules['ldap'] = stub_ldap
+sys.modules['ldap.filter'] = stub_ldap.filter
+
+from app import create_app
+from app.db import db
+from app.services.handbook_service import HandbookService
+from benchmarks.stub_udb import start_stub_udb
+from tests.helpers import make_config
+
+
+@pytest.fixture(autouse=True)
+def no_handbook(monkeypatch):
+    # the handbook is looked up in the background; keep the tests offline
+    monkeypatch.setattr(HandbookService, 'degree_name', lambda self, code: None)
+    monkeypatch.setattr(HandbookService, 'course_name', lambda self, code: None)
+
+
+@pytest.fixture
+def make_app(request):
+    """
+    Returns a function that creates an app with any config values overridden,
+    and its tables, inside an app context that lasts for the test.
+    """
+    def make_app(**settings):
+        app = create_app(make_config(**settings))
+        context = app.app_context()
+        context.push()
+        db.create_all()
+
+        def teardown():
+            db.session.remove()
+            db.drop_all()
+            context.pop()
+        request.addfinalizer(teardown)
+        return app
+    return make_app
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def file_app(make_app, tmpdir):
+    """
+    An app with its database in a file, for tests that use more than one
+    connection or thread.
+    """
+    return make_app(SQLALCHEMY_DATABASE_URI='sqlite:///' + str(tmpdir.join('bark.db')))
+
+
+@pytest.fixture
+def ldap_server():
+    stub_ldap.reset()
+    yield stub_ldap
+    stub_ldap.reset()
+
+
+@pytest.fixture
+def udb_server():
+    server = start_stub_udb()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def closed_port():
+    """
+    A local port nothing is listening on.
+    """
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
@@ -0,0 +1,62 @@
+"""
+Helpers for setting up apps, events and logins in the tests. Fixtures are in
+conftest.py.
+"""
+
+import json
+from datetime import datetime, timedelta
+
+from app.db import Event, User, db
+from config import Development
+
+
+def make_config(**settings):
+    config = Development()
+    config.DEBUG = False
+    config.TESTING = True
+    config.SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    config.METRICS_DIR = None
+    config.LIVE_FEED_ENABLED = False
+    for key, value in settings.items():
+        setattr(config, key, value)
+    return config
+
+
+def add_event(token='token', **fields):
+    """
+    Adds an event that is running now, with any fields overridden.
+    """
+    event = Event()
+    event.name = 'Event ' + token
+    event.token = token
+    event.start = datetime.now() - timedelta(hours=1)
+    event.end = datetime.now() + timedelta(hours=1)
+    event.check_cse = False
+    event.check_arc = False
+    for name, value in fields.items():
+        setattr(event, name, value)
+    db.session.add(event)
+    db.session.commit()
+    return event
+
+
+def log_in(client, zid='z1234567'):
+    """
+    Logs the client in as a user, adding them if needed.
+    """
+    user = User.query.filter(User.zid == zid).first()
+    if user is None:
+        user = User(zid=zid, first_name='Test', last_name='User')
+        db.session.add(user)
+        db.session.commit()
+
+    with client.session_transaction() as session:
+        session['user_id'] = unicode(user.id)
+        session['_fresh'] = True
+    return user
+
+
+def call_api(client, action, token='token', **data):
+    data.update(action=action, token=token)
+    resp = client.post('/api', data=json.dumps(data), content_type='application/json')
+    return json.loads(resp.data)
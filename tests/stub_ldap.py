@@ -0,0 +1,109 @@
+"""
+Stands in for python-ldap in the tests, with a directory kept in memory.
+conftest.py installs it as `ldap` before the app is imported.
+
+Add people with `add_user`; every connection the app opens is kept in
+`connections` so tests can see how it was bound and whether it was closed.
+"""
+
+import types
+
+SCOPE_SUBTREE = 2
+OPT_NETWORK_TIMEOUT = 0x5005
+OPT_TIMEOUT = 0x5002
+OPT_REFERRALS = 0x0008
+
+
+class LDAPError(Exception):
+    pass
+
+
+class INVALID_CREDENTIALS(LDAPError):
+    pass
+
+
+class SERVER_DOWN(LDAPError):
+    pass
+
+
+class OPERATIONS_ERROR(LDAPError):
+    pass
+
+
+filter = types.ModuleType('ldap.filter')
+filter.escape_filter_chars = lambda value: value.replace('\\', r'\5c').replace('*', r'\2a') \
+    .replace('(', r'\28').replace(')', r'\29')
+
+# upn -> (password, attributes)
+directory = {}
+connections = []
+# set to an LDAPError to make the next operation on any connection fail
+fail_next = []
+
+
+def add_user(username, password, given_name, surname):
+    directory[username + '@ad.unsw.edu.au'] = (password, {
+        'cn': [username],
+        'givenName': [given_name.encode('utf-8')],
+        'sn': [surname.encode('utf-8')],
+        'mail': [('%s@unsw.edu.au' % username).encode('utf-8')]
+    })
+
+
+def reset():
+    directory.clear()
+    del connections[:]
+    del fail_next[:]
+
+
+def initialize(host):
+    conn = StubConnection(host)
+    connections.append(conn)
+    return conn
+
+
+class StubConnection(object):
+    def __init__(self, host):
+        self.host = host
+        self.options = {}
+        # None until bound; '' when bound anonymously
+        self.bound_as = None
+        self.binds = 0
+        self.unbound = False
+
+    def _check(self):
+        if self.unbound:
+            raise LDAPError('connection is closed')
+        if fail_next:
+            raise fail_next.pop(0)
+
+    def set_option(self, option, value):
+        self.options[option] = value
+
+    def simple_bind_s(self, who='', cred=''):
+        self._check()
+        self.binds += 1
+        if not who and not cred:
+            self.bound_as = ''
+            return
+        if who not in directory or directory[who][0] != cred:
+            self.bound_as = None
+            raise INVALID_CREDENTIALS(who)
+        self.bound_as = who
+
+    def search_st(self, base, scope, filterstr, attrlist=None, attrsonly=0, timeout=-1):
+        self._check()
+        if not self.bound_as:
+            raise OPERATIONS_ERROR('a successful bind is required to search')
+
+        results = []
+        for upn, (password, attrs) in sorted(directory.items()):
+            if filterstr == 'cn=' + attrs['cn'][0]:
+                results.append(('CN=%s,%s' % (attrs['cn'][0], base), dict(attrs)))
+        # AD sends referrals along with the entries
+        results.append((None, ['ldap://DomainDnsZones.ad.unsw.edu.au/DC=DomainDnsZones']))
+        return results
+
+    def unbind_s(self):
+        self.unbound = True
+        self.bound_as = None
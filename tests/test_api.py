@@ -0,0 +1,51 @@
+import time
+
+from flask import current_app
+
+from app.services.udb_service import DummyUDBService
+from tests.helpers import add_event, call_api
+
+
+def test_check_in(app):
+    add_event()
+    client = app.test_client()
+
+    resp = call_api(client, 'check_in', zid='z5000001', max_scans=1)
+    assert resp['success']
+    assert resp['num_scans'] == 1
+
+    resp = call_api(client, 'check_in', zid='z5000001', max_scans=1)
+    assert not resp['success']
+    assert resp['error'] == 'Student has already checked in once'
+
+
+def test_batch_scan_times_are_bounded(app):
+    add_event()
+    now = time.time()
+
+    resp = call_api(app.test_client(), 'check_in_batch', check_ins=[
+        {'zid': 'z5000001', 'max_scans': 1, 'scanned_at': now - 60},
+        {'zid': 'z5000002', 'max_scans': 1, 'scanned_at': now + 3600},
+        {'zid': 'z5000003', 'max_scans': 1, 'scanned_at': now - 2 * 24 * 3600},
+    ])
+    assert [result['success'] for result in resp['results']] == [True, False, False]
+    assert resp['results'][1]['error'] == 'scanned_at is in the future'
+    assert resp['results'][2]['error'] == 'scanned_at is too long ago'
+
+
+def test_batch_lookups_have_an_app_context(app, monkeypatch):
+    add_event()
+    get_user = DummyUDBService.get_user
+    seen = []
+
+    def logging_get_user(self, zid):
+        current_app.logger.debug('Looking up %s', zid)
+        seen.append(zid)
+        return get_user(self, zid)
+    monkeypatch.setattr(DummyUDBService, 'get_user', logging_get_user)
+
+    resp = call_api(app.test_client(), 'check_in_batch', check_ins=[
+        {'zid': 'z500000%d' % i, 'max_scans': 1} for i in range(5)
+    ])
+    assert all(result['success'] for result in resp['results'])
+    assert sorted(seen) == ['z500000%d' % i for i in range(5)]
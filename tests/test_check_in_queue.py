@@ -0,0 +1,121 @@
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.db import CheckIn, EventStats, Student, db
+from app.event_index import event_info
+from app.services.udb_service import DummyUDBService
+from tests.helpers import add_event, call_api
+
+
+@pytest.fixture
+def queue_app(make_app, tmpdir):
+    app = make_app(
+        SQLALCHEMY_DATABASE_URI='sqlite:///' + str(tmpdir.join('bark.db')),
+        CHECK_IN_WRITE_BEHIND=True,
+        CHECK_IN_QUEUE_PATH=str(tmpdir.join('queue.db')),
+        # the tests flush the queue themselves
+        CHECK_IN_QUEUE_INTERVAL=timedelta(hours=1)
+    )
+    yield app
+    # as the worker would on exit, while the database is still there
+    app.extensions['check_in_queue'].stop()
+
+
+def stored_scans():
+    return dict(
+        db.session.query(Student.zid, CheckIn.number_of_scans).join(CheckIn, CheckIn.student_id == Student.id)
+    )
+
+
+def test_max_scans_is_enforced_exactly(queue_app):
+    add_event()
+    queue = queue_app.extensions['check_in_queue']
+    results = []
+
+    def scan(zid):
+        client = queue_app.test_client()
+        for _ in range(5):
+            results.append((zid, call_api(client, 'check_in', zid='z500000%d' % zid, max_scans=3)))
+
+    # eight scanners at once, two of them per student
+    threads = [threading.Thread(target=scan, args=(i % 4,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for zid in range(4):
+        responses = [resp for z, resp in results if z == zid]
+        assert sorted(resp.get('num_scans') for resp in responses if resp['success']) == [1, 2, 3]
+        assert len([resp for resp in responses if not resp['success']]) == 7
+
+    assert queue.flush()
+    assert stored_scans() == dict(('z500000%d' % i, 3) for i in range(4))
+    assert queue.check() == []
+    assert queue.failed() == []
+
+
+def test_a_batch_is_checked_against_max_scans(queue_app):
+    add_event()
+    resp = call_api(queue_app.test_client(), 'check_in_batch', check_ins=[
+        {'zid': 'z5000001', 'max_scans': 2} for _ in range(3)
+    ])
+    assert [result['success'] for result in resp['results']] == [True, True, False]
+    assert resp['results'][2]['error'] == 'Student has already checked in twice'
+
+
+def test_repeat_scans_answer_with_the_first_scan(queue_app, monkeypatch):
+    add_event()
+    queue = queue_app.extensions['check_in_queue']
+    client = queue_app.test_client()
+
+    first = call_api(client, 'check_in', zid='z5000001', max_scans=5)
+
+    # UDB answers differently from now on
+    get_user = DummyUDBService.get_user
+    monkeypatch.setattr(DummyUDBService, 'get_user', lambda self, zid: get_user(self, 'z5999999'))
+
+    queued = call_api(client, 'check_in', zid='z5000001', max_scans=5)
+    queue.flush()
+    written = call_api(client, 'check_in', zid='z5000001', max_scans=5)
+
+    for resp in (queued, written):
+        assert resp['is_cse'] == first['is_cse']
+        assert resp['degree'] == first['degree']
+        assert resp['courses'] == first['courses']
+    assert [first['num_scans'], queued['num_scans'], written['num_scans']] == [1, 2, 3]
+
+
+def test_a_replayed_batch_is_not_written_twice(queue_app):
+    event = add_event()
+    queue = queue_app.extensions['check_in_queue']
+    user_info = DummyUDBService().get_user
+    info = event_info(event)
+
+    now = datetime.now()
+    queue.put_many(info, [
+        ('z5000001', None, user_info('z5000001'), now),
+        ('z5000001', None, user_info('z5000001'), now),
+        ('z5000002', None, user_info('z5000002'), now),
+    ])
+
+    conn = sqlite3.connect(queue._path)
+    pending = conn.execute('SELECT * FROM pending').fetchall()
+    assert queue.flush()
+    stats = db.session.query(EventStats).get(info.id)
+    counted = (stats.check_ins, stats.scans)
+
+    # the writer stopped after committing, before taking the batch out of
+    # the queue
+    conn.executemany('INSERT INTO pending VALUES (?, ?, ?, ?, ?)', pending)
+    conn.commit()
+    assert queue.flush()
+
+    assert conn.execute('SELECT COUNT(*) FROM pending').fetchone()[0] == 0
+    assert stored_scans() == {'z5000001': 2, 'z5000002': 1}
+    stats = db.session.query(EventStats).get(info.id)
+    assert (stats.check_ins, stats.scans) == counted == (2, 3)
+    assert queue.failed() == []
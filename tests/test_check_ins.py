@@ -0,0 +1,57 @@
+import threading
+
+from sqlalchemy.dialects import postgresql
+
+from app.check_ins import find_student, get_or_create_degree, get_or_create_student
+from app.db import Degree, Student, db, insert_ignore
+from tests.helpers import add_event, call_api
+
+
+def test_first_scans_at_once_create_one_student(file_app):
+    ids = []
+
+    def scan():
+        with file_app.app_context():
+            student = get_or_create_student(find_student('z5000001', None))
+            db.session.commit()
+            ids.append(student.id)
+
+    threads = [threading.Thread(target=scan) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(ids) == 8
+    assert len(set(ids)) == 1
+    assert Student.query.count() == 1
+
+
+def test_duplicates_without_unique_indexes(app):
+    # a database migrate_db.py hasn't been run on
+    db.session.execute('DROP INDEX ix_student_zid')
+    db.session.execute('DROP INDEX ix_degree_code')
+    for _ in range(2):
+        db.session.add(Student(zid='z5000001', given_names='Some', surname='Student'))
+        db.session.add(Degree(code=3778))
+    db.session.commit()
+
+    assert get_or_create_student(Student(zid='z5000001')).id == 1
+    assert get_or_create_degree(3778).id == 1
+
+    add_event()
+    resp = call_api(app.test_client(), 'check_in', zid='z5000001', max_scans=1)
+    assert resp['success']
+
+
+def test_insert_ignore_on_postgres(app, monkeypatch):
+    statements = []
+
+    class Bind(object):
+        dialect = postgresql.dialect()
+    monkeypatch.setattr(db.session, 'get_bind', lambda **kwargs: Bind())
+    monkeypatch.setattr(db.session, 'execute', lambda statement, rows: statements.append(statement))
+
+    insert_ignore(Student.__table__, [{'zid': 'z5000001'}])
+    sql = str(statements[0].compile(dialect=postgresql.dialect()))
+    assert sql.endswith('ON CONFLICT DO NOTHING')
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+
+import sqlalchemy
+
+from app.db import Event, db
+from app.event_index import EventIndex
+from tests.helpers import add_event
+
+
+def make_index(version_interval=timedelta(0)):
+    return EventIndex(timedelta(hours=1), timedelta(minutes=1), version_interval)
+
+
+def test_changes_reach_every_index(file_app):
+    event = add_event('a')
+    # one index per worker
+    indexes = [make_index(), make_index()]
+    for index in indexes:
+        assert index.get('a').check_cse is False
+
+    event.check_cse = True
+    db.session.commit()
+    for index in indexes:
+        assert index.get('a').check_cse is True
+
+    db.session.delete(event)
+    db.session.commit()
+    for index in indexes:
+        assert index.get('a') is None
+
+
+def test_refresh_during_a_delete(file_app):
+    add_event('a')
+    index = make_index()
+
+    # another worker deletes the event, and commits after this worker has
+    # reloaded its index
+    other = db.create_scoped_session()
+    other.delete(other.query(Event).filter(Event.token == 'a').one())
+    other.flush()
+    assert index.get('a') is not None
+
+    other.commit()
+    other.remove()
+    assert index.get('a') is None
+
+
+def test_new_events_are_loaded(file_app):
+    index = make_index()
+    assert index.get('b') is None
+
+    add_event('b', start=datetime.now() + timedelta(minutes=30))
+    assert index.get('b') is not None
+    assert 'b' in index._events
+
+
+def test_lookups_between_version_checks_skip_the_database(file_app):
+    add_event('a')
+    index = make_index(timedelta(minutes=1))
+    assert index.get('a') is not None
+
+    queries = []
+
+    def count_query(conn, cursor, statement, *args):
+        queries.append(statement)
+    sqlalchemy.event.listen(db.engine, 'before_cursor_execute', count_query)
+    try:
+        for _ in range(10):
+            assert index.get('a') is not None
+    finally:
+        sqlalchemy.event.remove(db.engine, 'before_cursor_execute', count_query)
+    assert queries == []
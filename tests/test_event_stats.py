@@ -0,0 +1,42 @@
+from app.db import CheckIn, EventStats, Student, db
+from app.event_stats import add_missing_stats, get_event_stats
+from tests.helpers import add_event, call_api
+
+
+def add_check_in(event, zid):
+    check_in = CheckIn()
+    check_in.student = Student(zid=zid, given_names='Test', surname='Student', is_arc=True)
+    check_in.event_id = event.id
+    check_in.is_cse = True
+    db.session.add(check_in)
+    db.session.commit()
+
+
+def test_reading_stats_never_writes(app, monkeypatch):
+    event = add_event()
+    add_check_in(event, 'z1111111')
+
+    def commit():
+        raise AssertionError('get_event_stats committed')
+    monkeypatch.setattr(db.session, 'commit', commit)
+
+    assert get_event_stats(event.id) == {'event_id': event.id, 'check_ins': 1, 'cse': 1, 'arc': 1, 'scans': 1}
+    assert call_api(app.test_client(), 'get_event_info')['attendance']['check_ins'] == 1
+    db.session.rollback()
+    assert EventStats.query.count() == 0
+
+
+def test_missing_stats_are_added(app):
+    first = add_event('first')
+    second = add_event('second')
+    add_event('empty')
+    add_check_in(first, 'z1111111')
+    add_check_in(first, 'z2222222')
+    add_check_in(second, 'z3333333')
+    db.session.add(EventStats(event_id=second.id, check_ins=1, cse=1, arc=1, scans=1))
+    db.session.commit()
+
+    assert add_missing_stats() == 1
+    db.session.commit()
+    assert EventStats.query.get(first.id).check_ins == 2
+    assert add_missing_stats() == 0
@@ -0,0 +1,51 @@
+import codecs
+from StringIO import StringIO
+
+from app.db import Student, db
+from import_arc import import_arc
+
+
+def add_students(**is_arc):
+    for zid, member in is_arc.items():
+        db.session.add(Student(zid=zid, given_names='Test', surname='Student', is_arc=member))
+    db.session.commit()
+
+
+def memberships():
+    return dict(db.session.query(Student.zid, Student.is_arc))
+
+
+def test_import(app, capsys):
+    add_students(z1111111=False, z2222222=True, z3333333=True, z4444444=None)
+    members = codecs.BOM_UTF8 + 'zid,name\nz1111111,A\n2222222,B\n'
+
+    assert import_arc(StringIO(members))
+    assert memberships() == {'z1111111': True, 'z2222222': True, 'z3333333': False, 'z4444444': False}
+    out = capsys.readouterr()[0]
+    assert 'Read 2 zIDs (2 distinct), skipped 0 lines' in out
+    assert '1 students became ARC members, 1 stopped being members' in out
+    assert "1 students whose membership wasn't known are now not members" in out
+
+
+def test_lists_without_zids_are_refused(app):
+    add_students(z1111111=True)
+
+    assert not import_arc(StringIO('name,email\nA,a@example.com\n'))
+    assert not import_arc(StringIO(''))
+    assert memberships() == {'z1111111': True}
+
+
+def test_lists_with_many_bad_lines_are_refused(app):
+    add_students(z1111111=True, z2222222=True)
+    members = 'zid\n' + 'z1111111\n' * 18 + 'z222222\n' * 2
+
+    assert not import_arc(StringIO(members))
+    assert memberships() == {'z1111111': True, 'z2222222': True}
+
+
+def test_force(app):
+    add_students(z1111111=True, z2222222=True)
+    members = 'zid\n' + 'z1111111\n' * 18 + 'z222222\n' * 2
+
+    assert import_arc(StringIO(members), force=True)
+    assert memberships() == {'z1111111': True, 'z2222222': False}
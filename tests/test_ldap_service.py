@@ -0,0 +1,48 @@
+from datetime import timedelta
+
+from app.services.ldap_service import LDAPService
+
+
+def make_service(pool_size=2):
+    return LDAPService('ldap://ad.example', timeout=timedelta(seconds=1), pool_size=pool_size)
+
+
+def test_authenticate(ldap_server):
+    ldap_server.add_user('z1234567', 'hunter2', u'Zo\xeb', 'Smith')
+    service = make_service()
+
+    assert service.authenticate('z1234567', 'hunter2') == {
+        'first_name': u'Zo\xeb',
+        'last_name': u'Smith',
+        'email': u'z1234567@unsw.edu.au'
+    }
+    assert service.authenticate('z1234567', 'wrong') is None
+    assert service.authenticate('z7654321', 'hunter2') is None
+
+
+def test_connections_are_reused_but_not_left_bound(ldap_server):
+    ldap_server.add_user('z1234567', 'hunter2', 'Test', 'User')
+    service = make_service()
+
+    assert service.authenticate('z1234567', 'hunter2') is not None
+    assert service.authenticate('z1234567', 'wrong') is None
+    assert service.authenticate('z1234567', 'hunter2') is not None
+
+    conn, = ldap_server.connections
+    assert conn.binds == 6
+    # nothing can be done as the last user while it sits in the pool
+    assert conn.bound_as == ''
+    assert not conn.unbound
+
+
+def test_failed_connections_are_thrown_away(ldap_server):
+    ldap_server.add_user('z1234567', 'hunter2', 'Test', 'User')
+    service = make_service()
+
+    ldap_server.fail_next.append(ldap_server.SERVER_DOWN())
+    assert service.authenticate('z1234567', 'hunter2') is None
+    assert service.authenticate('z1234567', 'hunter2') is not None
+
+    broken, conn = ldap_server.connections
+    assert broken.unbound
+    assert not conn.unbound
@@ -0,0 +1,129 @@
+import json
+import Queue
+import sqlite3
+from datetime import timedelta
+
+import pytest
+
+from app import live_feed
+from app.live_feed import LiveFeed
+from tests.helpers import add_event, call_api, log_in
+
+
+@pytest.fixture
+def make_feed_app(make_app, tmpdir, monkeypatch):
+    # publishers look the watchers up every time
+    monkeypatch.setattr(live_feed, 'WATCHER_CHECK_INTERVAL', -1)
+
+    def make_feed_app(**settings):
+        return make_app(
+            SQLALCHEMY_DATABASE_URI='sqlite:///' + str(tmpdir.join('bark.db')),
+            LIVE_FEED_ENABLED=True,
+            LIVE_FEED_PATH=str(tmpdir.join('live_feed.db')),
+            # the tests read the feed themselves
+            LIVE_FEED_INTERVAL=timedelta(hours=1),
+            **settings
+        )
+    return make_feed_app
+
+
+def dashboard(app):
+    """
+    Another worker's view of the feed, to watch events with.
+    """
+    return LiveFeed(app, app.config['LIVE_FEED_PATH'], interval=app.config['LIVE_FEED_INTERVAL'],
+                    retention=app.config['LIVE_FEED_RETENTION'], timeout=app.config['LIVE_FEED_TIMEOUT'])
+
+
+def published(app):
+    return sqlite3.connect(app.config['LIVE_FEED_PATH']).execute('SELECT COUNT(*) FROM feed').fetchone()[0]
+
+
+def watchers(app):
+    return dashboard(app)._connect().execute('SELECT COUNT(*) FROM watcher').fetchone()[0]
+
+
+def received(feed, queue):
+    feed._read()
+    messages = []
+    while True:
+        try:
+            _, kind, data = queue.get_nowait()
+        except Queue.Empty:
+            return messages
+        messages.append((kind, json.loads(data)))
+
+
+def test_only_watched_events_are_published(make_feed_app):
+    app = make_feed_app()
+    event_id = add_event().id
+    client = app.test_client()
+    feed = dashboard(app)
+
+    assert call_api(client, 'check_in', zid='z5000001', max_scans=1)['success']
+    assert published(app) == 0
+
+    queue = feed.subscribe(event_id)
+    assert call_api(client, 'check_in', zid='z5000002', max_scans=1)['success']
+    messages = received(feed, queue)
+    assert [kind for kind, _ in messages] == ['check_in', 'stats']
+    assert messages[0][1]['zid'] == 'z5000002'
+    assert messages[1][1]['check_ins'] == 2
+
+    feed.unsubscribe(event_id, queue)
+    assert call_api(client, 'check_in', zid='z5000003', max_scans=1)['success']
+    assert published(app) == 1
+
+
+def test_queued_check_ins_are_published_once_written(make_feed_app, tmpdir):
+    app = make_feed_app(
+        CHECK_IN_WRITE_BEHIND=True,
+        CHECK_IN_QUEUE_PATH=str(tmpdir.join('queue.db')),
+        CHECK_IN_QUEUE_INTERVAL=timedelta(hours=1)
+    )
+    check_in_queue = app.extensions['check_in_queue']
+    try:
+        event_id = add_event().id
+        feed = dashboard(app)
+        queue = feed.subscribe(event_id)
+
+        assert call_api(app.test_client(), 'check_in', zid='z5000001', max_scans=1)['success']
+        assert received(feed, queue) == []
+
+        assert check_in_queue.flush()
+        messages = received(feed, queue)
+        assert [kind for kind, _ in messages] == ['check_in', 'stats']
+        assert messages[0][1]['zid'] == 'z5000001'
+        assert messages[1][1]['check_ins'] == 1
+    finally:
+        check_in_queue.stop()
+
+
+def test_streams_closed_before_they_start_watch_nothing(make_feed_app):
+    app = make_feed_app()
+    event_id = add_event().id
+    client = app.test_client()
+    log_in(client)
+
+    resp = client.get('/events/%d/live' % event_id)
+    assert resp.status_code == 200
+    # the client went away before the first chunk
+    resp.close()
+
+    assert watchers(app) == 0
+    assert call_api(client, 'check_in', zid='z5000001', max_scans=1)['success']
+    assert published(app) == 0
+
+
+def test_streams_watch_their_event_until_they_end(make_feed_app):
+    app = make_feed_app(LIVE_STREAM_DURATION=timedelta(0))
+    event_id = add_event().id
+    client = app.test_client()
+    log_in(client)
+
+    stream = client.get('/events/%d/live' % event_id).response
+    assert next(stream) == 'retry: 2000\n'
+    assert watchers(app) == 1
+
+    assert list(stream)[0].startswith('event: stats')
+    assert watchers(app) == 0
@@ -0,0 +1,11 @@
+from tests.helpers import log_in
+
+
+def test_garbled_sessions_are_logged_out(app):
+    client = app.test_client()
+    log_in(client)
+    assert client.get('/qr/nonexistent.svg').status_code == 404
+
+    with client.session_transaction() as session:
+        session['user_id'] = 'garbage'
+    assert client.get('/qr/nonexistent.svg').status_code == 403
@@ -0,0 +1,50 @@
+import pytest
+
+from app.event_index import EventIndex
+from app.metrics import Metrics, clear_dumps
+from tests.helpers import add_event, call_api, log_in
+
+
+def test_metrics_are_off_by_default(app):
+    client = app.test_client()
+    log_in(client)
+    assert client.get('/metrics').status_code == 404
+
+
+def test_metrics_need_a_login_or_token(make_app):
+    app = make_app(METRICS_ENABLED=True, METRICS_TOKEN='secret')
+    client = app.test_client()
+
+    assert client.get('/metrics').status_code == 403
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    assert client.get('/metrics', headers={'Authorization': 'Bearer secret'}).status_code == 200
+
+    log_in(client)
+    assert client.get('/metrics').status_code == 200
+
+
+def test_failed_requests_are_counted(make_app, monkeypatch):
+    app = make_app(METRICS_ENABLED=True, METRICS_TOKEN='secret')
+    add_event()
+    client = app.test_client()
+    assert call_api(client, 'get_event_info')['success']
+
+    def broken(self, token):
+        raise RuntimeError('broken')
+    monkeypatch.setattr(EventIndex, 'get', broken)
+    with pytest.raises(RuntimeError):
+        call_api(client, 'get_event_info')
+
+    body = client.get('/metrics', headers={'Authorization': 'Bearer secret'}).data
+    assert 'bark_api_requests_total{action="get_event_info",success="true"} 1' in body
+    assert 'bark_api_requests_total{action="invalid",success="false"} 1' in body
+
+
+def test_dumps_from_an_earlier_run_are_cleared(app, tmpdir):
+    metrics = Metrics(True, app.config['SLOW_REQUEST_THRESHOLD'], app.logger, str(tmpdir))
+    metrics.increment('bark_test_total', {})
+    metrics._dump()
+    assert tmpdir.listdir()
+
+    clear_dumps(str(tmpdir))
+    assert not tmpdir.listdir()
@@ -0,0 +1,14 @@
+from tests.helpers import add_event, log_in
+
+
+def test_qr_codes_need_a_login(app):
+    add_event('secret')
+    client = app.test_client()
+
+    assert client.get('/qr/secret.svg').status_code == 403
+
+    log_in(client)
+    resp = client.get('/qr/secret.svg')
+    assert resp.status_code == 200
+    assert resp.mimetype == 'image/svg+xml'
+    assert client.get('/qr/nonexistent.svg').status_code == 404
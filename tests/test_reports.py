@@ -0,0 +1,42 @@
+import csv
+
+from app.db import CheckIn, Degree, Student, db
+from app.views import reports_view
+from app.views.reports_view import aggregate_check_ins, generate_csv
+from tests.helpers import add_event
+
+
+def add_check_ins(event, degrees):
+    for i, degree in enumerate(degrees):
+        student = Student(zid='z500000%d' % i, given_names='Student', surname=str(i), is_arc=False)
+        check_in = CheckIn()
+        check_in.student = student
+        check_in.event_id = event.id
+        check_in.degree = degree
+        check_in.is_cse = True
+        db.session.add(check_in)
+    db.session.commit()
+
+
+def test_csv_is_written_a_chunk_at_a_time(app, monkeypatch):
+    monkeypatch.setattr(reports_view, 'CHUNK_SIZE', 2)
+    event = add_event()
+    named = Degree(code=3778, name='Computer Science')
+    unnamed = Degree(code=1234)
+    add_check_ins(event, [named, unnamed, None, named, named])
+
+    chunks = list(generate_csv(event.id, ['zid', 'degree']))
+    assert len(chunks) == 3
+
+    rows = list(csv.DictReader(''.join(chunks).splitlines()))
+    assert [row['degree'] for row in rows] == [
+        'Computer Science', 'Unknown Degree (1234)', '', 'Computer Science', 'Computer Science'
+    ]
+    assert aggregate_check_ins('degree') == [
+        ('No degree', 1, 1, 1, 1, 0), ('Unknown Degree (1234)', 1, 1, 1, 1, 0), ('Computer Science', 3, 3, 3, 3, 0)
+    ]
+
+
+def test_csv_without_check_ins(app):
+    event = add_event()
+    assert list(generate_csv(event.id, ['name', 'zid'])) == ['name,zid\r\n']
@@ -0,0 +1,71 @@
+import time
+from datetime import timedelta
+
+import pytest
+import requests
+
+from app.services.udb_service import UDBService
+
+
+def make_service(url, timeout=1, retries=2, retry_backoff=0.01):
+    return UDBService(url, 'udb', 'password', timeout=timedelta(seconds=timeout), retries=retries,
+                      retry_backoff=timedelta(seconds=retry_backoff))
+
+
+@pytest.fixture
+def attempts(monkeypatch):
+    """
+    Counts the requests made to UDB, whether or not they get anywhere.
+    """
+    calls = []
+    get = requests.Session.get
+
+    def counting_get(self, *args, **kwargs):
+        calls.append(time.time())
+        return get(self, *args, **kwargs)
+    monkeypatch.setattr(requests.Session, 'get', counting_get)
+    return calls
+
+
+def test_get_user(udb_server):
+    service = make_service(udb_server.url)
+
+    user = service.get_user('z5000001')
+    assert user.zid == 'z5000001'
+    assert user.degrees
+
+    assert service.get_user('5000001') is None
+    assert udb_server.requests == 2
+
+
+def test_connection_errors_are_retried(closed_port, attempts):
+    service = make_service('http://127.0.0.1:%d/' % closed_port, retries=2)
+
+    with pytest.raises(IOError):
+        service.get_user('z5000001')
+    assert len(attempts) == 3
+
+
+def test_retries_stop_at_the_timeout(closed_port, attempts):
+    service = make_service('http://127.0.0.1:%d/' % closed_port, timeout=0.5, retries=5, retry_backoff=0.3)
+
+    start = time.time()
+    with pytest.raises(IOError):
+        service.get_user('z5000001')
+
+    # the second backoff (0.6s) would end after the timeout
+    assert len(attempts) == 2
+    assert time.time() - start < 0.5
+
+
+def test_timeouts_are_not_retried(udb_server):
+    udb_server.latency = 0.5
+    service = make_service(udb_server.url, timeout=0.1, retries=2)
+
+    start = time.time()
+    with pytest.raises(IOError) as e:
+        service.get_user('z5000001')
+
+    assert 'Timed out' in str(e.value)
+    assert udb_server.requests == 1
+    assert time.time() - start < 0.4
@@ -0,0 +1,52 @@
+import time
+from datetime import date, timedelta
+
+from app.services.udb_parser import UDBClass, UDBUser
+from app.services.udb_snapshot import SnapshotUDBService, UDBSnapshot
+
+DAY = 24 * 60 * 60
+
+
+class DownUDBService(object):
+    def get_user(self, zid):
+        raise IOError('UDB is down')
+
+
+class UpUDBService(object):
+    def get_user(self, zid):
+        return make_user(zid)
+
+
+def make_user(zid):
+    return UDBUser(zid=zid, username=None, usernames=(), given_names='Test', surname='Student',
+                   degrees=(UDBClass('3778', date(2030, 1, 1)),), courses=(), classes=(), expiry=None)
+
+
+def age(snapshot, zid, days):
+    snapshot._connect().execute('UPDATE udb_user SET fetched = ? WHERE zid = ?', (time.time() - days * DAY, zid))
+
+
+def make_snapshot(tmpdir):
+    return UDBSnapshot(str(tmpdir.join('snapshot.db')), max_age=timedelta(days=7),
+                       retention=timedelta(days=365), timeout=timedelta(seconds=1))
+
+
+def test_stale_entries_are_kept_to_fall_back_on(tmpdir):
+    snapshot = make_snapshot(tmpdir)
+    snapshot.put_many([('z1111111', make_user('z1111111')), ('z2222222', make_user('z2222222'))])
+    age(snapshot, 'z1111111', 30)
+    age(snapshot, 'z2222222', 400)
+
+    assert snapshot.prune() == 1
+    assert snapshot.count() == 0
+
+    service = SnapshotUDBService(DownUDBService(), snapshot)
+    assert service.get_user('z1111111').degrees[0].code == '3778'
+
+
+def test_students_not_in_udb_are_asked_about_again(tmpdir):
+    snapshot = make_snapshot(tmpdir)
+    snapshot.put_many([('z1111111', None)])
+
+    assert SnapshotUDBService(UpUDBService(), snapshot).get_user('z1111111').zid == 'z1111111'
+    assert SnapshotUDBService(DownUDBService(), snapshot).get_user('z1111111') is None